@@ -2,13 +2,85 @@
 import pandas as pd
 import database
 import json
+from datetime import date, timedelta
+import centros_catalog
+import exportaciones
+import usuarios_masivos
+
+TODAS = "(Todas)"
+ETIQUETAS_FACETAS = {
+    "TIPO_INSTITUCION": "Tipo de institución",
+    "REGIONAL": "Regional",
+    "PROVINCIA": "Provincia",
+    "CANTON": "Cantón",
+    "DISTRITO": "Distrito",
+}
+
+def _aplicar_filtros(catalogo):
+    """Posiciones de los centros que cumplen los filtros del buscador y conteos por faceta.
+
+    Lee los valores de los filtros desde session_state para que la
+    exportación y el buscador usen exactamente el mismo resultado.
+    """
+    seleccion = {
+        faceta: st.session_state.get(f"faceta_{faceta}")
+        for faceta in catalogo.facetas.facetas
+        if st.session_state.get(f"faceta_{faceta}", TODAS) != TODAS
+    }
+    radio = None
+    if st.session_state.get('filtro_radio_activo'):
+        radio = (
+            st.session_state.get('filtro_lat', 9.9333),
+            st.session_state.get('filtro_lng', -84.0833),
+            st.session_state.get('filtro_radio_km', 5.0)
+        )
+    # Resultado compartido entre sesiones (caché LRU por versión del catálogo)
+    return catalogo.buscar(
+        st.session_state.get('filtro_nombre', ''),
+        st.session_state.get('filtro_codigo', ''),
+        seleccion,
+        radio
+    )
+
+def _base_edicion(catalogo, ids_pagina, pagina):
+    """Página que se está editando, tal como estaba al empezar la edición.
+
+    Guarda en session_state las posiciones, una copia de las filas y la
+    versión del catálogo, y la conserva mientras `pagina` (filtros y
+    paginación) no cambie: si otro administrador guarda entretanto, las
+    ediciones pendientes siguen sobre su base y `guardar_cambios` las valida
+    contra la versión vigente.
+    """
+    base = st.session_state.get("centros_edicion")
+    if base is None or base["pagina"] != pagina:
+        df_pagina = catalogo.df.iloc[ids_pagina]
+        # Las categorías se editan como texto para admitir valores nuevos
+        df_pagina = df_pagina.astype({c: centros_catalog.TIPO_TEXTO for c in df_pagina.columns if isinstance(df_pagina[c].dtype, pd.CategoricalDtype)})
+        base = {
+            "pagina": pagina,
+            "posiciones": tuple(int(i) for i in ids_pagina),
+            "version": catalogo.version,
+            "df": df_pagina.copy(),
+        }
+        st.session_state["centros_edicion"] = base
+    return base
+
+def show_ui(catalogo):
+    df_centros = catalogo.df
+    # Consultas independientes de la parte superior y del dashboard: se
+    # lanzan juntas y cada sección recoge la suya (o su error) más abajo.
+    consultas = database.consultar_en_paralelo({
+        "auditoria": database.obtener_auditoria,
+        "usuarios": database.get_all_users,
+        "total_envios": database.get_total_submission_count,
+        "envios_area": database.get_submission_count_by_area,
+        "envios_usuario": database.get_submission_count_by_user,
+    })
 
-def show_ui(df_centros):
     # Mostrar historial de auditoría
     st.subheader("🕵️ Historial de acciones (auditoría)")
     try:
-        import database as db
-        auditoria_df = db.obtener_auditoria()
+        auditoria_df = consultas.obtener("auditoria")
         if not auditoria_df.empty:
             st.dataframe(auditoria_df, use_container_width=True)
         else:
@@ -21,7 +93,7 @@ def show_ui(df_centros):
     try:
         users_df = pd.DataFrame()
         try:
-            users_df = database.get_all_users()
+            users_df = consultas.obtener("usuarios")
         except Exception:
             pass
         if not users_df.empty:
@@ -31,10 +103,9 @@ def show_ui(df_centros):
             if st.button("Actualizar rol", key="btn_update_role"):
                 import database as db
                 try:
-                    conn = db.get_db_connection()
-                    with conn.cursor() as cur:
-                        cur.execute("UPDATE usuarios SET role = %s WHERE id = %s", (new_role, selected_user_id_role))
-                    conn.commit()
+                    ok, msg = db.update_user_role(selected_user_id_role, new_role)
+                    if not ok:
+                        raise RuntimeError(msg)
                     db.registrar_auditoria(
                         st.session_state["user_id"],
                         "cambio_rol_usuario",
@@ -49,46 +120,31 @@ def show_ui(df_centros):
     except Exception as e:
         st.error(f"Error en la gestión de roles: {e}")
 
-    # Exportar datos filtrados
+    # Exportar datos filtrados. Los archivos se generan solo al pulsar el
+    # botón (en otro hilo) y se reutilizan mientras no cambien filtro ni datos.
     st.subheader("📤 Exportar datos filtrados")
-    # Asegurarse de que df_filtrado esté definido
-    filtro_nombre = st.session_state.get('filtro_nombre', '')
-    filtro_provincia = st.session_state.get('filtro_provincia', '')
-    filtro_codigo = st.session_state.get('filtro_codigo', '')
-    df_filtrado = df_centros.copy()
-    if filtro_nombre:
-        df_filtrado = df_filtrado[df_filtrado['CENTRO_EDUCATIVO'].str.contains(filtro_nombre, case=False, na=False)]
-    if filtro_provincia and 'PROVINCIA' in df_filtrado.columns:
-        df_filtrado = df_filtrado[df_filtrado['PROVINCIA'].str.contains(filtro_provincia, case=False, na=False)]
-    if filtro_codigo and 'CODIGO' in df_filtrado.columns:
-        df_filtrado = df_filtrado[df_filtrado['CODIGO'].astype(str).str.contains(filtro_codigo, case=False, na=False)]
+    ids_exportar = _aplicar_filtros(catalogo)[0]
 
     col_exp1, col_exp2 = st.columns(2)
     with col_exp1:
-        csv = df_filtrado.to_csv(index=False).encode('utf-8')
         st.download_button(
             label="Descargar CSV",
-            data=csv,
+            data=lambda: catalogo.exportar(ids_exportar, "csv"),
             file_name="centros_filtrados.csv",
-            mime="text/csv",
+            mime=exportaciones.MIME_CSV,
             key="btn_export_csv"
         )
     with col_exp2:
-        try:
-            import io
-            import pandas as pd
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                df_filtrado.to_excel(writer, index=False, sheet_name='Centros')
+        if exportaciones.xlsxwriter is not None:
             st.download_button(
                 label="Descargar Excel",
-                data=output.getvalue(),
+                data=lambda: catalogo.exportar(ids_exportar, "xlsx"),
                 file_name="centros_filtrados.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                mime=exportaciones.MIME_EXCEL,
                 key="btn_export_excel"
             )
-        except Exception as e:
-            st.error(f"Error al exportar a Excel: {e}")
+        else:
+            st.info("Instale 'xlsxwriter' para exportar a Excel.")
 
     st.title(f"Panel de Administrador")
     tab_list = [
@@ -106,9 +162,9 @@ def show_ui(df_centros):
         st.header("Dashboard de Operaciones")
         
         try:
-            total_envios = database.get_total_submission_count()
-            envios_area = database.get_submission_count_by_area()
-            envios_usuario = database.get_submission_count_by_user()
+            total_envios = consultas.obtener("total_envios")
+            envios_area = consultas.obtener("envios_area")
+            envios_usuario = consultas.obtener("envios_usuario")
             
             st.metric("Total de Formularios Enviados", total_envios)
             
@@ -130,6 +186,41 @@ def show_ui(df_centros):
         except Exception as e:
             st.error(f"Error cargando el dashboard: {e}")
 
+        st.subheader("Actividad en el tiempo")
+        try:
+            hoy = date.today()
+            col_rango, col_granularidad, col_por = st.columns([2, 1, 1])
+            with col_rango:
+                rango = st.date_input("Rango de fechas", value=(hoy - timedelta(days=29), hoy), max_value=hoy, key="dashboard_rango")
+            with col_granularidad:
+                granularidad = st.radio("Agrupar por", ["Día", "Semana"], horizontal=True, key="dashboard_granularidad")
+            with col_por:
+                por = st.radio("Series", ["Área", "Usuario"], horizontal=True, key="dashboard_series")
+            # Mientras se elige el rango, date_input devuelve solo la fecha inicial
+            if isinstance(rango, (tuple, list)) and len(rango) == 2:
+                desde, hasta = rango
+                actividad = database.get_actividad_envios(
+                    desde, hasta,
+                    por="usuario" if por == "Usuario" else "area",
+                    granularidad="week" if granularidad == "Semana" else "day"
+                )
+                if not actividad.empty:
+                    serie = actividad.pivot_table(index="periodo", columns="nombre", values="envios", aggfunc="sum", fill_value=0)
+                    st.line_chart(serie)
+                    st.caption(f"{int(actividad['envios'].sum())} envíos entre {desde:%d/%m/%Y} y {hasta:%d/%m/%Y}")
+                else:
+                    st.info("No hay envíos en el rango seleccionado.")
+            else:
+                st.info("Seleccione la fecha final del rango.")
+        except Exception as e:
+            st.error(f"Error cargando la actividad: {e}")
+
+        if consultas.segundos:
+            st.caption(f"Consultas del panel en paralelo: {len(consultas.segundos)}, la más lenta tardó {max(consultas.segundos.values()) * 1000:.0f} ms")
+        stats_catalogos = database.cache_catalogos.estadisticas()
+        st.caption(f"Caché de áreas y plantillas: {stats_catalogos['tasa_aciertos']:.0%} de aciertos "
+                   f"({stats_catalogos['aciertos']} aciertos, {stats_catalogos['fallos']} fallos, {stats_catalogos['entradas']} entradas)")
+
     # --- 2. BUSCADOR DE CENTROS (CON LÓGICA DE ADJUNTAR) ---
     with tab_buscador:
         st.header("Consulta de Centros Educativos")
@@ -138,47 +229,96 @@ def show_ui(df_centros):
         # Filtros y búsqueda avanzada
         st.subheader("🔍 Filtros y búsqueda avanzada")
         filtro_nombre = st.text_input("Buscar por nombre de centro", help="Campo accesible para lectores de pantalla", key="filtro_nombre", placeholder="Ejemplo: Liceo")
-        filtro_provincia = st.text_input("Filtrar por provincia", help="Campo accesible para lectores de pantalla", key="filtro_provincia", placeholder="Ejemplo: San José")
         filtro_codigo = st.text_input("Filtrar por código de centro", help="Campo accesible para lectores de pantalla", key="filtro_codigo", placeholder="Ejemplo: 12345")
 
-        df_filtrado = df_centros.copy()
-        if filtro_nombre:
-            df_filtrado = df_filtrado[df_filtrado['CENTRO_EDUCATIVO'].str.contains(filtro_nombre, case=False, na=False)]
-        if filtro_provincia and 'PROVINCIA' in df_filtrado.columns:
-            df_filtrado = df_filtrado[df_filtrado['PROVINCIA'].str.contains(filtro_provincia, case=False, na=False)]
-        if filtro_codigo and 'CODIGO' in df_filtrado.columns:
-            df_filtrado = df_filtrado[df_filtrado['CODIGO'].astype(str).str.contains(filtro_codigo, case=False, na=False)]
+        with st.expander("📍 Buscar por cercanía"):
+            st.checkbox("Filtrar por distancia a un punto", key="filtro_radio_activo")
+            col_lat, col_lng, col_radio = st.columns(3)
+            with col_lat:
+                st.number_input("Latitud", value=9.9333, format="%.6f", key="filtro_lat")
+            with col_lng:
+                st.number_input("Longitud", value=-84.0833, format="%.6f", key="filtro_lng")
+            with col_radio:
+                st.number_input("Radio (km)", min_value=0.1, max_value=100.0, value=5.0, step=0.5, key="filtro_radio_km")
+
+        # Facetas en cascada: cada selector muestra solo los valores con centros
+        # según las selecciones anteriores, con su cantidad
+        _, conteos_facetas = _aplicar_filtros(catalogo)
+        columnas_facetas = st.columns(max(1, len(conteos_facetas)))
+        for columna, (faceta, conteos) in zip(columnas_facetas, conteos_facetas.items()):
+            clave = f"faceta_{faceta}"
+            # Una selección que dejó de tener centros (cambió un nivel superior) se reinicia
+            if st.session_state.get(clave, TODAS) not in conteos:
+                st.session_state[clave] = TODAS
+            with columna:
+                st.selectbox(
+                    ETIQUETAS_FACETAS.get(faceta, faceta),
+                    options=[TODAS] + list(conteos),
+                    format_func=lambda v, c=conteos: f"{v} ({sum(c.values()) if v == TODAS else c[v]})",
+                    key=clave
+                )
+
+        # Coincidencia sin distinguir mayúsculas ni tildes ("San Jose" = "SAN JOSÉ")
+        ids_filtrados = _aplicar_filtros(catalogo)[0]
 
         # Paginación
         st.subheader("📄 Paginación de resultados")
         page_size = st.selectbox("Resultados por página", [10, 25, 50, 100], index=1)
-        total_rows = len(df_filtrado)
+        total_rows = len(ids_filtrados)
         total_pages = (total_rows // page_size) + int(total_rows % page_size > 0)
         page = st.number_input("Página", min_value=1, max_value=max(1, total_pages), value=1, step=1)
         start_idx = (page - 1) * page_size
         end_idx = start_idx + page_size
-        st.caption(f"Mostrando {start_idx+1} a {min(end_idx, total_rows)} de {total_rows} resultados")
-        df_pagina = df_filtrado.iloc[start_idx:end_idx]
+        st.caption(f"Mostrando {min(start_idx+1, total_rows)} a {min(end_idx, total_rows)} de {total_rows} resultados")
+        stats_cache = centros_catalog.cache_filtros.estadisticas()
+        st.caption(f"Caché de búsquedas: {stats_cache['aciertos']} aciertos, {stats_cache['fallos']} fallos, {stats_cache['entradas']}/{stats_cache['maximo']} entradas")
+        # Solo la página actual se envía al navegador; el índice conserva la
+        # posición de cada fila en el catálogo
+        ids_pagina = ids_filtrados[start_idx:end_idx]
+        df_pagina = df_centros.iloc[ids_pagina]
 
         # Edición solo para administradores
         if st.session_state.get("role") == "admin":
-            st.warning("Como administrador puedes editar los datos de los centros. Recuerda guardar los cambios.")
-            edited_df = st.data_editor(df_filtrado, use_container_width=True, num_rows="dynamic", key="centros_editor")
+            st.warning("Como administrador puedes editar los datos de los centros de esta página. Recuerda guardar los cambios antes de cambiar de página.")
+            pagina = (
+                filtro_nombre, filtro_codigo, page_size, page,
+                tuple(st.session_state.get(f"faceta_{f}", TODAS) for f in conteos_facetas),
+                tuple(st.session_state.get(k) for k in ("filtro_radio_activo", "filtro_lat", "filtro_lng", "filtro_radio_km")),
+            )
+            base = _base_edicion(catalogo, ids_pagina, pagina)
+            if base["version"] != catalogo.version:
+                st.caption("Otro administrador guardó cambios desde que abrió esta página. Al guardar se comprobará que nadie modificó las mismas celdas.")
+                if st.button("Descartar mis cambios y recargar la página", key="btn_recargar_centros"):
+                    del st.session_state["centros_edicion"]
+                    st.rerun()
+            # Clave por base (versión y filas): las ediciones pendientes no se
+            # trasladan a otras filas ni se pierden si otro guarda entretanto
+            editor_key = f"centros_editor_{base['version']}_{hash(base['posiciones'])}"
+            edited_df = st.data_editor(base["df"], use_container_width=True, hide_index=True, num_rows="dynamic", key=editor_key)
             if st.button("Guardar cambios en centros", key="btn_save_centros"):
                 try:
-                    edited_df.to_csv("datos_centros.csv", index=False)
-                    import database as db
-                    db.registrar_auditoria(
-                        st.session_state["user_id"],
-                        "edicion_centros",
-                        f"Edición de datos de centros. Filtro aplicado: nombre={filtro_nombre}, provincia={filtro_provincia}, codigo={filtro_codigo}"
-                    )
-                    st.success("Cambios guardados correctamente en 'datos_centros.csv'.")
-                    st.toast("Cambios guardados en centros", icon="✅")
+                    cambios = centros_catalog.diferencias(base["df"], edited_df)
+                    if not any(cambios.values()):
+                        st.info("No hay cambios para guardar.")
+                    else:
+                        centros_catalog.guardar_cambios(catalogo, cambios, usuario=st.session_state["user_id"])
+                        # La próxima edición parte de la versión recién guardada
+                        del st.session_state["centros_edicion"]
+                        import database as db
+                        db.registrar_auditoria(
+                            st.session_state["user_id"],
+                            "edicion_centros",
+                            f"Edición de datos de centros: {len(cambios['modificaciones'])} modificados, {len(cambios['altas'])} nuevos, {len(cambios['bajas'])} eliminados. "
+                            f"Filtro aplicado: nombre={filtro_nombre}, codigo={filtro_codigo}, " + ", ".join(f"{f}={st.session_state.get(f'faceta_{f}', TODAS)}" for f in conteos_facetas)
+                        )
+                        st.success("Cambios guardados correctamente en el catálogo de centros.")
+                        st.toast("Cambios guardados en centros", icon="✅")
+                except centros_catalog.ConflictoEdicion as e:
+                    st.error(str(e))
                 except Exception as e:
                     st.error(f"Error al guardar cambios: {e}")
         else:
-            st.dataframe(df_filtrado, use_container_width=True)
+            st.dataframe(df_pagina, use_container_width=True)
 
         st.divider()
         st.subheader("📎 Adjuntar Centro a un Formulario")
@@ -188,29 +328,26 @@ def show_ui(df_centros):
         search_query = st.text_input("Buscar centro (por nombre)", key="admin_search_query")
 
         if 'CENTRO_EDUCATIVO' in df_centros.columns:
-            lista_nombres_centros = sorted(df_centros['CENTRO_EDUCATIVO'].astype(str).unique().tolist())
-            if search_query and search_query.strip():
-                q = search_query.strip().lower()
-                lista_nombres_centros = [n for n in lista_nombres_centros if q in n.lower()]
+            # Solo los mejores resultados del índice de trigramas (tolera errores de tipeo)
+            # La lista lleva los CODSABER: los nombres se repiten entre centros
+            lista_codigos_centros = catalogo.codigos(catalogo.sugerir_centros(search_query))
         else:
-            lista_nombres_centros = []
+            lista_codigos_centros = []
 
         centro_para_adjuntar = st.selectbox(
             "Escriba o seleccione el nombre del centro que desea adjuntar:",
-            options=lista_nombres_centros,
-            index=0 if lista_nombres_centros else None,
+            options=lista_codigos_centros,
+            index=0 if lista_codigos_centros else None,
+            format_func=catalogo.etiqueta,
             key="admin_attach_selectbox"
         )
 
         if st.button("Adjuntar Centro Seleccionado", key="btn_adjuntar_admin"):
-            if centro_para_adjuntar:
-                datos_centro_seleccionado = df_centros[
-                    df_centros['CENTRO_EDUCATIVO'] == centro_para_adjuntar
-                ].iloc[0]
-                
-                st.session_state.centro_adjunto = datos_centro_seleccionado.to_dict()
+            datos_centro_seleccionado = catalogo.centro(centro_para_adjuntar) if centro_para_adjuntar else None
+            if datos_centro_seleccionado:
+                st.session_state.centro_adjunto = datos_centro_seleccionado
                 
-                st.success(f"¡{centro_para_adjuntar} adjuntado!")
+                st.success(f"¡{datos_centro_seleccionado.get('CENTRO_EDUCATIVO', centro_para_adjuntar)} adjuntado!")
                 st.info("Los datos se pre-llenarán en la pestaña 'Llenar Formulario' (vista de Operador).")
             else:
                 st.warning("Por favor, seleccione un centro de la lista.")
@@ -218,10 +355,10 @@ def show_ui(df_centros):
         # Mostrar preview del centro seleccionado
         if 'admin_attach_selectbox' in st.session_state and st.session_state.admin_attach_selectbox:
             try:
-                preview = df_centros[df_centros['CENTRO_EDUCATIVO'] == st.session_state.admin_attach_selectbox]
-                if not preview.empty:
+                preview = catalogo.centro(st.session_state.admin_attach_selectbox)
+                if preview:
                     st.subheader("Vista previa del centro seleccionado")
-                    st.write(preview.iloc[0].to_dict())
+                    st.write(preview)
             except Exception:
                 pass
 
@@ -356,17 +493,45 @@ def show_ui(df_centros):
                             st.error(message)
                 else:
                     st.error("Todos los campos son requeridos.")
+
+        with st.expander("📥 Administración masiva desde CSV"):
+            operaciones_csv = {
+                "crear": "Crear usuarios",
+                "rol": "Cambiar roles",
+                "desbloquear": "Desbloquear usuarios",
+            }
+            operacion_csv = st.radio("Operación", list(operaciones_csv), format_func=operaciones_csv.get, horizontal=True, key="usuarios_csv_operacion")
+            st.caption(f"Columnas requeridas: {', '.join(usuarios_masivos.OPERACIONES[operacion_csv])}")
+            archivo_csv = st.file_uploader("Archivo CSV", type=["csv"], key="usuarios_csv_archivo")
+            if archivo_csv is not None:
+                try:
+                    df_csv = usuarios_masivos.leer_csv(archivo_csv, operacion_csv)
+                    errores_csv = usuarios_masivos.validar(df_csv)
+                    # Las contraseñas no se muestran en la vista previa
+                    st.dataframe(df_csv.drop(columns=["password"], errors="ignore"), use_container_width=True)
+                    if errores_csv:
+                        st.error("Corrija el archivo antes de aplicarlo:\n\n" + "\n".join(f"- {e}" for e in errores_csv[:20]))
+                    elif st.button(f"{operaciones_csv[operacion_csv]} ({len(df_csv)})", key="btn_usuarios_csv"):
+                        with st.spinner("Aplicando cambios..."):
+                            success, message = usuarios_masivos.aplicar(df_csv, operacion_csv)
+                        if success:
+                            database.registrar_auditoria(
+                                st.session_state["user_id"],
+                                f"usuarios_csv_{operacion_csv}",
+                                f"{message} Usuarios: {', '.join(df_csv['username'].head(50))}"
+                            )
+                            st.success(message)
+                        else:
+                            st.error(message)
+                except Exception as e:
+                    st.error(f"Error procesando el CSV: {e}")
         
         st.divider()
         st.subheader("Usuarios Existentes")
         users_df = pd.DataFrame()
         try:
-            users_df = database.get_all_users()
-            # Mostrar si el usuario está bloqueado
-            if not users_df.empty:
-                # Obtener estado de bloqueo
-                import database as db
-                users_df['Bloqueado'] = users_df['id'].apply(lambda uid: db.get_user(users_df.loc[users_df['id'] == uid, 'username'].values[0]).get('is_locked', False))
+            # El estado de bloqueo viene en la misma consulta
+            users_df = database.get_all_users().rename(columns={"is_locked": "Bloqueado", "failed_attempts": "Intentos fallidos"})
             st.dataframe(users_df, use_container_width=True)
         except Exception as e:
             st.error(f"Error al cargar usuarios: {e}")
@@ -452,4 +617,31 @@ def show_ui(df_centros):
             else:
                 st.dataframe(all_submissions_df, use_container_width=True)
         except Exception as e:
-            st.error(f"Error al cargar envíos: {e}")
\ No newline at end of file
+            st.error(f"Error al cargar envíos: {e}")
+
+        st.subheader("📥 Exportar envíos de una plantilla")
+        st.write("Descarga los datos de todos los envíos de una plantilla, con una columna por campo.")
+        try:
+            areas_export = {area['id']: area['name'] for area in database.get_all_areas()}
+            if areas_export:
+                export_area_id = st.selectbox("Área:", options=list(areas_export.keys()), format_func=lambda x: areas_export[x], key="export_envios_area")
+                templates_export = {t['id']: t['name'] for t in database.get_templates_by_area(export_area_id)}
+                if templates_export:
+                    export_template_id = st.selectbox("Plantilla:", options=list(templates_export.keys()), format_func=lambda x: templates_export[x], key="export_envios_template")
+                    formatos = ["CSV", "Parquet"] if exportaciones.pa is not None else ["CSV"]
+                    formato = st.radio("Formato:", formatos, horizontal=True, key="export_envios_formato")
+                    extension = "parquet" if formato == "Parquet" else "csv"
+                    # Se genera al pulsar el botón, leyendo los envíos por bloques
+                    st.download_button(
+                        label=f"Descargar envíos ({formato})",
+                        data=lambda: exportaciones.exportar_envios(export_template_id, extension),
+                        file_name=f"envios_{templates_export[export_template_id]}.{extension}",
+                        mime=exportaciones.MIME_PARQUET if extension == "parquet" else exportaciones.MIME_CSV,
+                        key="btn_export_envios"
+                    )
+                else:
+                    st.info("Esta área no tiene plantillas.")
+            else:
+                st.info("No hay áreas creadas.")
+        except Exception as e:
+            st.error(f"Error al preparar la exportación de envíos: {e}")
\ No newline at end of file
@@ -1,8 +1,8 @@
 ﻿
 import streamlit as st
-import pandas as pd
 import database
 import auth
+import centros_catalog
 
 # Configuración de la página (debe ejecutarse antes de otros comandos de Streamlit)
 try:
@@ -90,20 +90,20 @@ def main_app():
 
     # Mostrar la vista correspondiente según el rol
     if st.session_state.get("role") == "admin" and admin_view:
-        # Cargar datos de centros
+        # Cargar datos de centros (catálogo compartido por el proceso)
         try:
-            df_centros = pd.read_csv("datos_centros.csv")
+            catalogo = centros_catalog.get_catalogo()
         except Exception as e:
             st.error(f"Error cargando datos de centros: {e}")
-            df_centros = pd.DataFrame()
-        admin_view.show_ui(df_centros)
+            catalogo = centros_catalog.CatalogoCentros.vacio()
+        admin_view.show_ui(catalogo)
     elif st.session_state.get("role") == "operador" and operator_view:
         try:
-            df_centros = pd.read_csv("datos_centros.csv")
+            catalogo = centros_catalog.get_catalogo()
         except Exception as e:
             st.error(f"Error cargando datos de centros: {e}")
-            df_centros = pd.DataFrame()
-        operator_view.show_ui(df_centros)
+            catalogo = centros_catalog.CatalogoCentros.vacio()
+        operator_view.show_ui(catalogo)
     else:
         st.error("No se pudo determinar la vista para el usuario actual.")
 
@@ -117,19 +117,34 @@ def login_form():
         password = st.text_input("Contraseña", type="password")
         submit = st.form_submit_button("Iniciar sesión")
     if submit:
-        # Verificar conexión a la base de datos antes de intentar autenticar
-        conn_test = database.get_db_connection()
-        if conn_test is None:
+        # Sin pool no hay base de datos configurada o accesible (no abre conexiones)
+        if database.get_pool() is None:
             st.error("Error: no hay conexión a la base de datos. Revisa la variable DB_URL o la configuración de la BD.")
             return
+        # Una consulta para leer el hash, verificación fuera del hilo de la
+        # sesión y un UPDATE ... RETURNING para registrar el resultado
         user = database.get_user(username)
-        if user and auth.check_password(password, user["password_hash"]):
+        if not user:
+            st.error("Usuario o contraseña incorrectos.")
+            return
+        if user["is_locked"]:
+            st.error("Usuario bloqueado por demasiados intentos fallidos. Contacte a un administrador.")
+            return
+        try:
+            valida, nuevo_hash = auth.verificar_password(password, user["password_hash"])
+        except auth.TimeoutError:
+            st.error("Hay muchos inicios de sesión en este momento. Intente de nuevo en unos segundos.")
+            return
+        resultado = database.registrar_login(user["id"], valida, nuevo_hash)
+        if valida and resultado is not None:
             st.session_state["user_id"] = user["id"]
             st.session_state["username"] = user["username"]
             st.session_state["full_name"] = user["full_name"]
             st.session_state["role"] = user["role"]
             st.success("¡Bienvenido, {}!".format(user["full_name"]))
             st.rerun()
+        elif resultado is None or resultado["is_locked"]:
+            st.error("Usuario bloqueado por demasiados intentos fallidos. Contacte a un administrador.")
         else:
             st.error("Usuario o contraseña incorrectos.")
 
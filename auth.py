@@ -1,8 +1,41 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
 from werkzeug.security import generate_password_hash, check_password_hash
 
+# Método y coste de los hashes nuevos, en el formato de werkzeug: "scrypt"
+# (= scrypt:32768:8:1), "scrypt:65536:8:1", "pbkdf2:sha256:600000"... Las
+# contraseñas guardadas con otros parámetros se vuelven a hashear al iniciar
+# sesión correctamente.
+METODO_HASH = os.environ.get("AUTH_HASH_METHOD", "scrypt")
+
+# Verificaciones de contraseña simultáneas como máximo. Cada hash scrypt
+# ocupa CPU y ~32 MB durante ~0,1 s: en un pico de logins el resto espera
+# en cola en vez de saturar el servidor y frenar a las demás sesiones.
+HILOS_VERIFICACION = int(os.environ.get("AUTH_HILOS_VERIFICACION", os.cpu_count() or 1))
+ESPERA_VERIFICACION_SEGUNDOS = float(os.environ.get("AUTH_ESPERA_SEGUNDOS", 30))
+
+_verificadores = ThreadPoolExecutor(max_workers=HILOS_VERIFICACION, thread_name_prefix="verificar_password")
+_prefijo_metodo = None
+_prefijo_lock = threading.Lock()
+
 def hash_password(password):
     """Genera un hash seguro para una contraseña."""
-    return generate_password_hash(password)
+    return generate_password_hash(password, method=METODO_HASH)
+
+def hash_passwords(passwords, hilos=None):
+    """Genera los hashes de varias contraseñas en paralelo, en el mismo orden.
+
+    scrypt/pbkdf2 (hashlib, OpenSSL) sueltan el GIL mientras calculan, así
+    que los hilos usan todos los núcleos sin lanzar procesos aparte.
+    """
+    passwords = list(passwords)
+    hilos = hilos or os.cpu_count() or 1
+    if hilos == 1 or len(passwords) < 2:
+        return [hash_password(p) for p in passwords]
+    with ThreadPoolExecutor(max_workers=min(hilos, len(passwords))) as ejecutor:
+        return list(ejecutor.map(hash_password, passwords))
 
 def check_password(password, hashed_password):
     """Verifica una contraseña contra un hash existente."""
@@ -10,3 +43,34 @@ def check_password(password, hashed_password):
     if isinstance(hashed_password, memoryview):
         return False  # Old format is incompatible, so authentication fails
     return check_password_hash(hashed_password, password)
+
+def necesita_rehash(hashed_password):
+    """True si el hash no usa el método y los parámetros de METODO_HASH."""
+    global _prefijo_metodo
+    if not isinstance(hashed_password, str):
+        return False
+    with _prefijo_lock:
+        if _prefijo_metodo is None:
+            # werkzeug completa los parámetros por defecto ("scrypt" -> "scrypt:32768:8:1")
+            _prefijo_metodo = hash_password("").split("$", 1)[0]
+    return hashed_password.split("$", 1)[0] != _prefijo_metodo
+
+def _verificar(password, hashed_password):
+    if not check_password(password, hashed_password):
+        return False, None
+    return True, hash_password(password) if necesita_rehash(hashed_password) else None
+
+def verificar_password(password, hashed_password):
+    """
+    Verifica la contraseña en el grupo acotado de hilos de verificación.
+
+    Devuelve (valida, nuevo_hash): `nuevo_hash` es el hash con los
+    parámetros actuales si el guardado está desactualizado, o None. Lanza
+    TimeoutError si la cola no la atiende en ESPERA_VERIFICACION_SEGUNDOS.
+    """
+    futuro = _verificadores.submit(_verificar, password, hashed_password)
+    try:
+        return futuro.result(timeout=ESPERA_VERIFICACION_SEGUNDOS)
+    except TimeoutError:
+        futuro.cancel()
+        raise
@@ -0,0 +1,90 @@
+"""
+Mide el coste por llamada de las consultas de SENTENCIAS_PREPARADAS con y
+sin preparar.
+
+Uso:
+    DB_URL=postgresql://... python benchmark_sentencias.py [--llamadas 1000] [--rondas 6]
+
+Abre dos conexiones a la misma BD: una normal (cada llamada envía el SQL y
+Postgres lo analiza y planifica) y una ConexionPreparada (PREPARE una vez y
+después EXECUTE). Las escrituras de cada medición se deshacen al
+terminarla, así que la BD queda como estaba.
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime
+
+import psycopg2
+
+import database
+
+
+def _parametros(cur):
+    """Parámetros reales para cada sentencia, tomados de la propia BD."""
+    cur.execute("SELECT id, username FROM usuarios ORDER BY id LIMIT 1")
+    usuario = cur.fetchone()
+    cur.execute("SELECT id FROM form_templates ORDER BY id LIMIT 1")
+    plantilla = cur.fetchone()
+    if not usuario or not plantilla:
+        raise SystemExit("Se necesita al menos un usuario y una plantilla en la BD.")
+    lote_auditoria = [(usuario[0], "benchmark", "detalle", datetime.now())] * 10
+    return {
+        "usuario_por_nombre": (usuario[1],),
+        "estructura_plantilla": (plantilla[0],),
+        "insertar_envio": (plantilla[0], usuario[0], json.dumps({"campo": "valor"})),
+        "insertar_auditoria": tuple(list(columna) for columna in zip(*lote_auditoria)),
+        "login_exitoso": (None, usuario[0]),
+        "login_fallido": (database.MAX_INTENTOS_LOGIN, usuario[0]),
+    }
+
+
+def _medir(conn, nombre, parametros, llamadas):
+    try:
+        with conn.cursor() as cur:
+            # Calentamiento: la primera llamada prepara la sentencia
+            database.ejecutar_sentencia(cur, nombre, parametros)
+            inicio = time.perf_counter()
+            for _ in range(llamadas):
+                database.ejecutar_sentencia(cur, nombre, parametros)
+            return (time.perf_counter() - inicio) / llamadas
+    finally:
+        # Deshacer las escrituras y soltar los bloqueos de los resúmenes que
+        # actualizan los triggers antes de medir con la otra conexión
+        conn.rollback()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara sentencias preparadas y sin preparar.")
+    parser.add_argument("--llamadas", type=int, default=1000, help="Llamadas por sentencia, modo y ronda")
+    parser.add_argument("--rondas", type=int, default=6, help="Rondas por sentencia; se informa la mediana")
+    args = parser.parse_args()
+
+    db_url = database._configuracion("DB_URL")
+    if not db_url:
+        raise SystemExit("Defina DB_URL (variable de entorno o .streamlit/secrets.toml).")
+    normal = psycopg2.connect(db_url)
+    preparada = psycopg2.connect(db_url, connection_factory=database.ConexionPreparada)
+    try:
+        with normal.cursor() as cur:
+            parametros = _parametros(cur)
+        print(f"{'sentencia':<22} {'sin preparar':>14} {'preparada':>12} {'mejora':>8}")
+        for nombre in database.SENTENCIAS_PREPARADAS:
+            # Se alterna qué conexión mide primero: las escrituras deshechas
+            # dejan filas muertas que encarecen a la que va detrás
+            tiempos = {normal: [], preparada: []}
+            for ronda in range(args.rondas):
+                for conn in ((normal, preparada) if ronda % 2 == 0 else (preparada, normal)):
+                    tiempos[conn].append(_medir(conn, nombre, parametros[nombre], args.llamadas))
+            sin_preparar = statistics.median(tiempos[normal])
+            con_preparar = statistics.median(tiempos[preparada])
+            print(f"{nombre:<22} {sin_preparar * 1e6:11.1f} µs {con_preparar * 1e6:9.1f} µs "
+                  f"{(1 - con_preparar / sin_preparar) * 100:7.1f}%")
+    finally:
+        normal.close()
+        preparada.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Bloqueo entre procesos mediante un archivo creado en exclusiva.
+
+Lo usan los archivos compartidos por todos los procesos de la aplicación:
+el catálogo de centros (`centros_catalog`) y el respaldo de auditoría
+(`database`). Solo depende de la biblioteca estándar.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+
+@contextmanager
+def bloqueo_archivo(ruta, espera=10.0, caducidad=60.0, mensaje=None):
+    """Toma el candado `ruta + ".lock"` mientras dura el bloque.
+
+    Un candado más antiguo que `caducidad` segundos se considera abandonado
+    (proceso caído) y se descarta. Lanza TimeoutError(`mensaje`) si no se
+    obtiene en `espera` segundos.
+    """
+    candado = ruta + ".lock"
+    limite = time.monotonic() + espera
+    while True:
+        try:
+            os.close(os.open(candado, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                # Un candado abandonado (proceso caído) se descarta
+                if time.time() - os.path.getmtime(candado) > caducidad:
+                    os.remove(candado)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > limite:
+                raise TimeoutError(mensaje or f"{ruta} está bloqueado por otro proceso.")
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        try:
+            os.remove(candado)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,91 @@
+"""
+Compila datos_centros.csv en la instantánea columnar que usa la app.
+
+Uso:
+    python build_centros_snapshot.py            # genera datos_centros.arrow
+    python build_centros_snapshot.py --medir    # además compara CSV vs instantánea
+
+Con --medir se lanzan procesos independientes que cargan el catálogo por
+cada vía e informan el tiempo de carga y la memoria (RSS) del proceso.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+import centros_catalog
+
+# Código que ejecuta cada proceso de medición. Imprime un JSON con el tiempo
+# de carga y la memoria residente antes y después de cargar el catálogo.
+_SCRIPT_MEDICION = r"""
+import json, os, sys, time
+import centros_catalog
+
+def memoria_kb():
+    # RSS total y parte compartida (páginas mapeadas de archivos) en Linux
+    try:
+        with open("/proc/self/statm") as f:
+            campos = f.read().split()
+        pagina = os.sysconf("SC_PAGE_SIZE") // 1024
+        return int(campos[1]) * pagina, int(campos[2]) * pagina
+    except Exception:
+        return None, None
+
+modo, ruta = sys.argv[1], sys.argv[2]
+rss_antes, _ = memoria_kb()
+inicio = time.perf_counter()
+if modo == "csv":
+    df = centros_catalog.leer_csv_centros(ruta)
+else:
+    df = centros_catalog.leer_snapshot(centros_catalog.ruta_snapshot(ruta))
+len(df)
+segundos = time.perf_counter() - inicio
+rss_despues, compartida = memoria_kb()
+print(json.dumps({"segundos": segundos, "rss_antes": rss_antes, "rss_despues": rss_despues, "compartida": compartida}))
+"""
+
+
+def _medir(modo, ruta_csv, repeticiones):
+    resultados = []
+    for _ in range(repeticiones):
+        salida = subprocess.run(
+            [sys.executable, "-c", _SCRIPT_MEDICION, modo, ruta_csv],
+            capture_output=True, text=True, check=True
+        )
+        resultados.append(json.loads(salida.stdout.strip().splitlines()[-1]))
+    return resultados
+
+
+def _kb(valor):
+    return f"{valor / 1024:.1f} MB" if valor is not None else "n/d"
+
+
+def _informe(modo, resultados):
+    tiempos = sorted(r["segundos"] for r in resultados)
+    mediana = tiempos[len(tiempos) // 2]
+    ultimo = resultados[-1]
+    delta = None
+    if ultimo["rss_antes"] is not None:
+        delta = ultimo["rss_despues"] - ultimo["rss_antes"]
+    print(f"{modo:>9}: carga {mediana * 1000:7.1f} ms | RSS proceso {_kb(ultimo['rss_despues'])} "
+          f"| RSS por catálogo {_kb(delta)} | compartida {_kb(ultimo['compartida'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera la instantánea columnar del catálogo de centros.")
+    parser.add_argument("--csv", default=centros_catalog.RUTA_CSV, help="CSV de origen")
+    parser.add_argument("--medir", action="store_true", help="Comparar tiempo de carga y RSS: CSV vs instantánea")
+    parser.add_argument("--repeticiones", type=int, default=5, help="Procesos lanzados por cada modo al medir")
+    args = parser.parse_args()
+
+    ruta = centros_catalog.construir_snapshot(args.csv)
+    print(f"✅ Instantánea generada: {ruta}")
+
+    if args.medir:
+        print(f"\nMidiendo ({args.repeticiones} procesos por modo)...")
+        for modo in ("csv", "snapshot"):
+            _informe(modo, _medir(modo, args.csv, args.repeticiones))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,902 @@
+"""
+Catálogo de centros educativos compartido por todo el proceso.
+
+El CSV de centros se carga una sola vez por proceso (no en cada rerun de
+Streamlit) y solo se vuelve a leer cuando el archivo cambia. Cada carga
+recibe un número de versión que otras cachés pueden usar como parte de su
+clave para invalidarse cuando cambian los datos.
+
+Si existe una instantánea columnar (`datos_centros.arrow`, generada con
+`python build_centros_snapshot.py`) construida a partir del mismo CSV, se
+mapea en memoria en lugar de parsear el CSV; así varios procesos del mismo
+servidor comparten las páginas del archivo.
+
+Las ediciones no reescriben el CSV: se añaden al registro de cambios
+(`datos_centros.cambios.jsonl`), que se aplica sobre el CSV al cargarlo y se
+vuelca en él cuando crece demasiado.
+"""
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+import exportaciones
+from bloqueos import bloqueo_archivo
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+except Exception:
+    # Sin pyarrow se usa siempre el CSV
+    pa = None
+    pa_ipc = None
+
+# Texto respaldado por Arrow cuando está disponible (mismo tipo venga del CSV
+# o de la instantánea)
+TIPO_TEXTO = pd.StringDtype("pyarrow") if pa is not None else str
+
+RUTA_CSV = "datos_centros.csv"
+MENSAJE_BLOQUEO = "El catálogo de centros está siendo guardado por otro usuario. Intente de nuevo."
+
+# Tipos explícitos del catálogo. Los códigos se leen como texto para no
+# perder ceros a la izquierda (p. ej. CODPRES "0000").
+COLUMNAS_CODIGO = ("CODSABER", "CODPRES")
+COLUMNAS_CATEGORICAS = ("TIPO_INSTITUCION", "REGIONAL", "PROVINCIA", "CANTON", "DISTRITO")
+COLUMNAS_COORDENADAS = ("LATITUD", "LONGITUD")
+
+# Clave de negocio de cada centro
+COLUMNA_CLAVE = "CODSABER"
+
+# Facetas del buscador, en orden jerárquico: cada una se restringe a las
+# selecciones de las anteriores
+FACETAS = ("TIPO_INSTITUCION", "REGIONAL", "PROVINCIA", "CANTON", "DISTRITO")
+
+# Columnas con clave de búsqueda normalizada
+COLUMNAS_BUSQUEDA = ("CENTRO_EDUCATIVO", "PROVINCIA", "CODSABER")
+
+_META_ORIGEN = b"origen_sha1"
+
+# Tamaño a partir del cual el registro de cambios se vuelca al CSV
+LIMITE_REGISTRO_BYTES = 256 * 1024
+
+
+def normalizar_texto(texto):
+    """Pasa a mayúsculas, quita tildes/diéresis y colapsa espacios."""
+    descompuesto = unicodedata.normalize("NFKD", str(texto))
+    sin_tildes = "".join(c for c in descompuesto if not unicodedata.combining(c))
+    return " ".join(sin_tildes.upper().split())
+
+
+def _trigramas(texto):
+    """Trigramas de cada palabra (con relleno), sin importar el orden de las palabras."""
+    trigramas = set()
+    for palabra in texto.split():
+        relleno = f"  {palabra} "
+        trigramas.update(relleno[i:i + 3] for i in range(len(relleno) - 2))
+    return trigramas
+
+
+class IndiceTrigramas:
+    """Índice invertido de trigramas para búsqueda aproximada de nombres.
+
+    Cada texto se descompone en trigramas por palabra; una consulta puntúa
+    los textos según la fracción de sus trigramas que aparecen en ellos
+    (tolera errores de tipeo y palabras en otro orden) y desempata con la
+    similitud de Dice, que favorece los nombres más parecidos en longitud.
+    """
+
+    def __init__(self, textos):
+        textos = [normalizar_texto(t) for t in textos]
+        listas = {}
+        self._tamanos = np.zeros(len(textos), dtype=np.int32)
+        for i, texto in enumerate(textos):
+            trigramas = _trigramas(texto)
+            self._tamanos[i] = len(trigramas)
+            for trigrama in trigramas:
+                listas.setdefault(trigrama, []).append(i)
+        self._listas = {t: np.array(ids, dtype=np.int32) for t, ids in listas.items()}
+        # Orden alfabético para cuando todavía no se ha escrito nada
+        self._orden = np.array(sorted(range(len(textos)), key=textos.__getitem__), dtype=np.int64)
+
+    def buscar(self, consulta, k=20):
+        """Posiciones de los `k` textos más parecidos a la consulta, de mejor a peor."""
+        trigramas = _trigramas(normalizar_texto(consulta or ""))
+        if not trigramas:
+            return self._orden[:k]
+        listas = [self._listas[t] for t in trigramas if t in self._listas]
+        if not listas:
+            return np.empty(0, dtype=np.int64)
+        comunes = np.bincount(np.concatenate(listas), minlength=len(self._tamanos))
+        candidatos = np.flatnonzero(comunes)
+        coincidencias = comunes[candidatos]
+        cobertura = coincidencias / len(trigramas)
+        dice = 2 * coincidencias / (len(trigramas) + self._tamanos[candidatos])
+        puntaje = cobertura + 0.25 * dice
+        # Descartar coincidencias casuales (menos de un tercio de la consulta)
+        utiles = cobertura >= 1 / 3
+        candidatos, puntaje = candidatos[utiles], puntaje[utiles]
+        if len(candidatos) > k:
+            mejores = np.argpartition(-puntaje, k)[:k]
+            candidatos, puntaje = candidatos[mejores], puntaje[mejores]
+        # Orden estable: a igual puntaje, el orden del catálogo
+        return candidatos[np.lexsort((candidatos, -puntaje))]
+
+
+RADIO_TIERRA_KM = 6371.0088
+
+
+def distancia_km(lat, lng, lats, lngs):
+    """Distancia haversine (km) desde un punto a uno o varios puntos."""
+    lat1, lng1 = np.radians(lat), np.radians(lng)
+    lat2, lng2 = np.radians(lats), np.radians(lngs)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class IndiceEspacial:
+    """Rejilla regular de celdas sobre LATITUD/LONGITUD.
+
+    Los puntos se ordenan por celda (fila a fila), de modo que las celdas de
+    una fila de la rejilla forman un tramo contiguo. Las consultas solo
+    calculan distancias para los puntos de las celdas cercanas. Se ignoran
+    coordenadas vacías o fuera de Costa Rica (hay filas con 0 o mal escritas).
+    """
+
+    CELDA_GRADOS = 0.05  # ~5.5 km
+    LIMITES = {"lat": (5.0, 12.0), "lng": (-88.0, -82.0)}
+
+    def __init__(self, lats, lngs):
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        (lat_min, lat_max), (lng_min, lng_max) = self.LIMITES["lat"], self.LIMITES["lng"]
+        with np.errstate(invalid="ignore"):
+            validos = np.flatnonzero(
+                (lats >= lat_min) & (lats <= lat_max) & (lngs >= lng_min) & (lngs <= lng_max)
+            )
+        self._lat0, self._lng0 = lat_min, lng_min
+        self._filas = int(np.ceil((lat_max - lat_min) / self.CELDA_GRADOS)) + 1
+        self._columnas = int(np.ceil((lng_max - lng_min) / self.CELDA_GRADOS)) + 1
+        fila, columna = self._celda(lats[validos], lngs[validos])
+        celda = fila * self._columnas + columna
+        orden = np.argsort(celda, kind="stable")
+        self._ids = validos[orden]
+        self._lats = lats[self._ids]
+        self._lngs = lngs[self._ids]
+        # inicio[c] = primer punto de la celda c (estructura tipo CSR)
+        self._inicio = np.searchsorted(celda[orden], np.arange(self._filas * self._columnas + 1))
+        # Ancho mínimo de una celda en km (el de longitud se estrecha con la latitud)
+        self._ancho_km = self.CELDA_GRADOS * np.radians(RADIO_TIERRA_KM) * np.cos(np.radians(max(abs(lat_min), abs(lat_max))))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _celda(self, lat, lng):
+        fila = np.clip(np.floor((np.asarray(lat) - self._lat0) / self.CELDA_GRADOS).astype(np.int64), 0, self._filas - 1)
+        columna = np.clip(np.floor((np.asarray(lng) - self._lng0) / self.CELDA_GRADOS).astype(np.int64), 0, self._columnas - 1)
+        return fila, columna
+
+    def _puntos_en_anillo(self, fila, columna, radio_celdas):
+        """Posiciones (en los arrays ordenados) de las celdas a `radio_celdas` o menos."""
+        c0 = max(columna - radio_celdas, 0)
+        c1 = min(columna + radio_celdas, self._columnas - 1)
+        tramos = [
+            np.arange(self._inicio[f * self._columnas + c0], self._inicio[f * self._columnas + c1 + 1])
+            for f in range(max(fila - radio_celdas, 0), min(fila + radio_celdas, self._filas - 1) + 1)
+        ]
+        return np.concatenate(tramos) if tramos else np.empty(0, dtype=np.int64)
+
+    def cercanos(self, lat, lng, k=5):
+        """Los `k` puntos más cercanos: (ids del catálogo, distancias en km)."""
+        if len(self._ids) == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        fila, columna = (int(v) for v in self._celda(lat, lng))
+        radio = 0
+        max_radio = max(self._filas, self._columnas)
+        while True:
+            posiciones = self._puntos_en_anillo(fila, columna, radio)
+            if len(posiciones) >= min(k, len(self._ids)):
+                distancias = distancia_km(lat, lng, self._lats[posiciones], self._lngs[posiciones])
+                orden = np.argsort(distancias, kind="stable")[:k]
+                # Todo punto fuera del cuadrado está a más de radio * ancho de celda
+                if distancias[orden[-1]] <= radio * self._ancho_km or radio >= max_radio:
+                    return self._ids[posiciones[orden]], distancias[orden]
+                radio = max(radio + 1, int(np.ceil(distancias[orden[-1]] / self._ancho_km)))
+            else:
+                radio += 1
+
+    def en_radio(self, lat, lng, radio_km):
+        """Puntos a `radio_km` o menos, ordenados por distancia: (ids, distancias km)."""
+        if len(self._ids) == 0 or radio_km <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        fila, columna = (int(v) for v in self._celda(lat, lng))
+        posiciones = self._puntos_en_anillo(fila, columna, int(np.ceil(radio_km / self._ancho_km)))
+        distancias = distancia_km(lat, lng, self._lats[posiciones], self._lngs[posiciones])
+        dentro = np.flatnonzero(distancias <= radio_km)
+        orden = dentro[np.argsort(distancias[dentro], kind="stable")]
+        return self._ids[posiciones[orden]], distancias[orden]
+
+
+class IndiceFacetas:
+    """Índices agrupados por valor de cada faceta.
+
+    Por faceta se guarda el código de valor de cada fila y, por valor, el
+    array ordenado de filas que lo tienen. Las selecciones se resuelven
+    intersecando esos arrays y los conteos con un `bincount` sobre las filas
+    vigentes, sin volver a recorrer el DataFrame.
+    """
+
+    def __init__(self, df):
+        self._valores = {}
+        self._nombres = {}
+        self._codigos = {}
+        self._filas = {}
+        self._total = len(df)
+        for faceta in FACETAS:
+            if faceta not in df.columns:
+                continue
+            codigos, valores = pd.factorize(df[faceta].astype(str), sort=True)
+            orden = np.argsort(codigos, kind="stable")
+            limites = np.searchsorted(codigos[orden], np.arange(len(valores) + 1))
+            self._valores[faceta] = {v: i for i, v in enumerate(valores)}
+            self._nombres[faceta] = np.asarray(valores, dtype=object)
+            self._codigos[faceta] = codigos
+            self._filas[faceta] = [orden[limites[i]:limites[i + 1]] for i in range(len(valores))]
+
+    @property
+    def facetas(self):
+        return [f for f in FACETAS if f in self._codigos]
+
+    def filas(self, faceta, valor):
+        """Filas (ordenadas) con `valor` en la faceta; vacío si no existe."""
+        codigo = self._valores.get(faceta, {}).get(valor)
+        if codigo is None:
+            return np.empty(0, dtype=np.int64)
+        return self._filas[faceta][codigo]
+
+    def conteos(self, faceta, filas=None):
+        """{valor: cantidad} de los valores de la faceta presentes en `filas`."""
+        codigos = self._codigos[faceta] if filas is None else self._codigos[faceta][filas]
+        cantidades = np.bincount(codigos, minlength=len(self._nombres[faceta]))
+        presentes = np.flatnonzero(cantidades)
+        return dict(zip(self._nombres[faceta][presentes].tolist(), cantidades[presentes].tolist()))
+
+    def cascada(self, filas, seleccion):
+        """Aplica las selecciones {faceta: valor} en orden jerárquico.
+
+        Devuelve (filas resultantes, {faceta: conteos en su nivel}). Los conteos
+        de cada faceta consideran solo las selecciones de las facetas
+        anteriores; una selección sin filas en su nivel se ignora.
+        """
+        filas = np.arange(self._total) if filas is None else filas
+        conteos = {}
+        for faceta in self.facetas:
+            conteos[faceta] = self.conteos(faceta, filas)
+            valor = seleccion.get(faceta)
+            if valor is not None and valor in conteos[faceta]:
+                filas = np.intersect1d(filas, self.filas(faceta, valor), assume_unique=True)
+        return filas, conteos
+
+
+class CacheLRU:
+    """Caché LRU acotada y segura entre hilos, compartida por todas las sesiones.
+
+    Cuenta aciertos y fallos para poder comprobar si está sirviendo de algo.
+    """
+
+    def __init__(self, maximo=256):
+        self.maximo = maximo
+        self.aciertos = 0
+        self.fallos = 0
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._datos)
+
+    def obtener(self, clave, calcular):
+        """Valor guardado para `clave`; si no existe, lo calcula con `calcular()`."""
+        with self._lock:
+            if clave in self._datos:
+                self._datos.move_to_end(clave)
+                self.aciertos += 1
+                return self._datos[clave]
+            self.fallos += 1
+        # Se calcula fuera del candado para no bloquear otras consultas
+        valor = calcular()
+        with self._lock:
+            self._datos[clave] = valor
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
+        return valor
+
+    def vaciar(self):
+        with self._lock:
+            self._datos.clear()
+
+    def estadisticas(self):
+        with self._lock:
+            return {"aciertos": self.aciertos, "fallos": self.fallos, "entradas": len(self._datos), "maximo": self.maximo}
+
+
+# Resultados del buscador por (versión del catálogo, filtros normalizados)
+cache_filtros = CacheLRU(maximo=256)
+
+# Archivos exportados por (versión del catálogo, formato, filas exportadas)
+cache_exportaciones = CacheLRU(maximo=8)
+
+
+class CatalogoCentros:
+    """Instantánea de solo lectura del catálogo de centros.
+
+    `df` se comparte entre todas las sesiones: no debe modificarse en sitio.
+    Quien necesite alterarlo debe trabajar sobre una copia.
+    """
+
+    def __init__(self, df, version, ruta, firma, digest, bytes_registro=0):
+        self.df = df
+        self.version = version
+        self.ruta = ruta
+        self.firma = firma
+        self.digest = digest
+        # Bytes del registro de cambios ya aplicados sobre el CSV
+        self.bytes_registro = bytes_registro
+
+    @classmethod
+    def vacio(cls):
+        """Catálogo sin filas, para cuando no se pudo cargar el archivo."""
+        return cls(pd.DataFrame(), 0, None, None, None)
+
+    def __len__(self):
+        return len(self.df)
+
+    @cached_property
+    def claves_busqueda(self):
+        """Columnas de búsqueda normalizadas (mayúsculas, sin tildes).
+
+        Se calculan una vez por versión del catálogo, normalizando cada valor
+        distinto una sola vez.
+        """
+        claves = {}
+        for col in COLUMNAS_BUSQUEDA:
+            if col in self.df.columns:
+                serie = self.df[col].astype(str)
+                unicos = pd.unique(serie)
+                mapa = dict(zip(unicos, (normalizar_texto(v) for v in unicos)))
+                claves[col] = serie.map(mapa).astype(TIPO_TEXTO)
+        return claves
+
+    @cached_property
+    def posiciones_por_codigo(self):
+        """Diccionario CODSABER -> posición (`iloc`), uno por versión."""
+        if COLUMNA_CLAVE not in self.df.columns:
+            return {}
+        return {codigo: pos for pos, codigo in enumerate(self.df[COLUMNA_CLAVE].astype(str))}
+
+    @cached_property
+    def etiquetas(self):
+        """Texto que identifica cada centro en las listas: "NOMBRE (CODSABER)".
+
+        Incluye el código porque hay centros distintos con el mismo nombre.
+        """
+        if not {"CENTRO_EDUCATIVO", COLUMNA_CLAVE} <= set(self.df.columns):
+            return []
+        nombres = self.df["CENTRO_EDUCATIVO"].astype(str).tolist()
+        codigos = self.df[COLUMNA_CLAVE].astype(str).tolist()
+        return [f"{nombre} ({codigo})" for nombre, codigo in zip(nombres, codigos)]
+
+    @cached_property
+    def posiciones_por_etiqueta(self):
+        """Diccionario etiqueta -> posición (`iloc`), uno por versión."""
+        return {etiqueta: pos for pos, etiqueta in enumerate(self.etiquetas)}
+
+    def posicion(self, clave):
+        """Posición del centro con ese CODSABER o etiqueta, o None si no existe."""
+        pos = self.posiciones_por_codigo.get(clave)
+        return pos if pos is not None else self.posiciones_por_etiqueta.get(clave)
+
+    def etiqueta(self, clave):
+        """Etiqueta del centro con ese CODSABER (o la propia clave si no existe)."""
+        pos = self.posicion(clave)
+        return self.etiquetas[pos] if pos is not None else str(clave)
+
+    def centro(self, clave):
+        """Datos del centro con ese CODSABER o etiqueta como diccionario, o None."""
+        pos = self.posicion(clave)
+        return self.df.iloc[pos].to_dict() if pos is not None else None
+
+    def codigos(self, posiciones):
+        """CODSABER de las posiciones indicadas, en el mismo orden."""
+        if COLUMNA_CLAVE not in self.df.columns:
+            return []
+        return self.df[COLUMNA_CLAVE].iloc[posiciones].astype(str).tolist()
+
+    @cached_property
+    def indice_nombres(self):
+        """Índice de trigramas sobre CENTRO_EDUCATIVO (uno por versión)."""
+        nombres = self.claves_busqueda.get("CENTRO_EDUCATIVO")
+        return IndiceTrigramas(nombres.tolist() if nombres is not None else [])
+
+    def sugerir_centros(self, consulta, k=20):
+        """Posiciones de los `k` centros cuyo nombre mejor coincide con la consulta."""
+        return self.indice_nombres.buscar(consulta, k)
+
+    @cached_property
+    def indice_espacial(self):
+        """Rejilla espacial sobre LATITUD/LONGITUD (una por versión)."""
+        if not set(COLUMNAS_COORDENADAS) <= set(self.df.columns):
+            return IndiceEspacial([], [])
+        lats = pd.to_numeric(self.df["LATITUD"], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+        lngs = pd.to_numeric(self.df["LONGITUD"], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+        return IndiceEspacial(lats, lngs)
+
+    def centros_cercanos(self, lat, lng, k=5):
+        """Los `k` centros más cercanos a un punto: (posiciones, distancias en km)."""
+        return self.indice_espacial.cercanos(lat, lng, k)
+
+    def centros_en_radio(self, lat, lng, radio_km):
+        """Centros a `radio_km` o menos de un punto, del más cercano al más lejano."""
+        return self.indice_espacial.en_radio(lat, lng, radio_km)
+
+    @cached_property
+    def facetas(self):
+        """Índices agrupados de las facetas del buscador (uno por versión)."""
+        return IndiceFacetas(self.df)
+
+    def filtrar(self, nombre="", provincia="", codigo=""):
+        """Posiciones de las filas que contienen cada texto indicado.
+
+        La comparación ignora mayúsculas y tildes ("San Jose" encuentra
+        "SAN JOSÉ"). Devuelve un array ordenado de posiciones (`iloc`).
+        """
+        mascara = np.ones(len(self.df), dtype=bool)
+        for col, texto in (("CENTRO_EDUCATIVO", nombre), ("PROVINCIA", provincia), ("CODSABER", codigo)):
+            consulta = normalizar_texto(texto) if texto else ""
+            if consulta and col in self.claves_busqueda:
+                mascara &= self.claves_busqueda[col].str.contains(consulta, regex=False).to_numpy(dtype=bool, na_value=False)
+        return np.flatnonzero(mascara)
+
+    def buscar(self, nombre="", codigo="", seleccion=None, radio=None):
+        """Filtros del buscador: texto, facetas en cascada y, opcionalmente, radio.
+
+        `seleccion` es {faceta: valor} y `radio` una tupla (lat, lng, km); con
+        radio el resultado va ordenado por distancia al punto. Devuelve
+        (posiciones, conteos por faceta). El resultado se guarda en la caché
+        compartida `cache_filtros`, así que no debe modificarse.
+        """
+        seleccion = tuple(sorted((f, v) for f, v in (seleccion or {}).items() if v is not None))
+        if radio is not None:
+            radio = tuple(round(float(x), 6) for x in radio)
+        clave = (self.version, normalizar_texto(nombre or ""), normalizar_texto(codigo or ""), seleccion, radio)
+        return cache_filtros.obtener(clave, lambda: self._buscar(nombre, codigo, dict(seleccion), radio))
+
+    def exportar(self, posiciones, formato="csv"):
+        """Bytes de un CSV o Excel ("xlsx") con las filas `posiciones`.
+
+        El archivo se genera por bloques y se guarda en `cache_exportaciones`:
+        descargar otra vez el mismo resultado no lo vuelve a generar.
+        """
+        posiciones = np.ascontiguousarray(posiciones, dtype=np.int64)
+        clave = (self.version, formato, hashlib.sha1(posiciones.tobytes()).hexdigest())
+
+        def generar():
+            bloques = exportaciones.bloques_de(self.df, posiciones)
+            if formato == "xlsx":
+                archivo = exportaciones.excel_por_bloques(bloques, self.df.columns, hoja="Centros")
+            else:
+                archivo = exportaciones.csv_por_bloques(bloques, self.df.columns)
+            with archivo:
+                return archivo.read()
+
+        return cache_exportaciones.obtener(clave, generar)
+
+    def _buscar(self, nombre, codigo, seleccion, radio):
+        ids, conteos = self.facetas.cascada(self.filtrar(nombre, "", codigo), seleccion)
+        if radio is not None:
+            en_radio, _ = self.centros_en_radio(*radio)
+            ids = en_radio[np.isin(en_radio, ids)]
+        ids.flags.writeable = False
+        return ids, conteos
+
+
+_lock = threading.Lock()
+_catalogos = {}
+_ultima_version = 0
+
+
+def _firma_archivo(ruta):
+    """Firma barata (mtime, tamaño) para detectar cambios sin leer el archivo."""
+    info = os.stat(ruta)
+    return (info.st_mtime_ns, info.st_size)
+
+
+def _hash_archivo(ruta):
+    h = hashlib.sha1()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def ruta_snapshot(ruta_csv=RUTA_CSV):
+    """Ruta de la instantánea columnar asociada a un CSV."""
+    return os.path.splitext(ruta_csv)[0] + ".arrow"
+
+
+def _tipar_columnas(df):
+    """Aplica los tipos del catálogo a un DataFrame leído como texto."""
+    for col in COLUMNAS_COORDENADAS:
+        if col in df.columns:
+            # El CSV mezcla coma y punto como separador decimal
+            df[col] = pd.to_numeric(df[col].astype(str).str.replace(",", ".", regex=False), errors="coerce")
+    return _tipar_categorias(df)
+
+
+def _tipar_categorias(df):
+    """Columnas categóricas con categorías TIPO_TEXTO.
+
+    `astype("category")` sobre texto Arrow da categorías `string`, pero
+    Arrow convierte sus diccionarios a categorías `str`: se fija el tipo
+    para que el CSV, la instantánea y las ediciones den el mismo DataFrame.
+    """
+    for col in COLUMNAS_CATEGORICAS:
+        if col in df.columns:
+            serie = df[col] if isinstance(df[col].dtype, pd.CategoricalDtype) else df[col].astype("category")
+            df[col] = serie.astype(pd.CategoricalDtype(serie.cat.categories.astype(TIPO_TEXTO)))
+    return df
+
+
+def leer_csv_centros(ruta=RUTA_CSV):
+    """Parsea el CSV de centros con los tipos explícitos del catálogo."""
+    df = pd.read_csv(ruta, dtype=TIPO_TEXTO, keep_default_na=False)
+    return _tipar_columnas(df)
+
+
+def construir_snapshot(ruta_csv=RUTA_CSV, ruta_salida=None):
+    """Compila el CSV en un archivo Arrow IPC sin comprimir (mapeable en memoria).
+
+    El hash del CSV de origen se guarda en los metadatos del esquema para que
+    `get_catalogo` descarte instantáneas desactualizadas. Devuelve la ruta
+    escrita.
+    """
+    if pa is None:
+        raise RuntimeError("pyarrow no está instalado; no se puede generar la instantánea del catálogo.")
+    ruta_salida = ruta_salida or ruta_snapshot(ruta_csv)
+    tabla = pa.Table.from_pandas(leer_csv_centros(ruta_csv), preserve_index=False)
+    metadatos = dict(tabla.schema.metadata or {})
+    metadatos[_META_ORIGEN] = _hash_archivo(ruta_csv).encode()
+    tabla = tabla.replace_schema_metadata(metadatos)
+
+    temporal = ruta_salida + ".tmp"
+    with pa.OSFile(temporal, "wb") as destino:
+        with pa_ipc.new_file(destino, tabla.schema) as escritor:
+            escritor.write_table(tabla)
+    os.replace(temporal, ruta_salida)
+    return ruta_salida
+
+
+def leer_snapshot(ruta, digest_origen=None):
+    """Mapea en memoria una instantánea y la devuelve como DataFrame.
+
+    Las columnas de texto quedan respaldadas por los buffers Arrow del
+    archivo mapeado (sin copia), de modo que los procesos que abren la misma
+    instantánea comparten esas páginas. Si se indica `digest_origen` y no
+    coincide con el de la instantánea, devuelve None.
+    """
+    lector = pa_ipc.open_file(pa.memory_map(ruta, "r"))
+    if digest_origen is not None:
+        metadatos = lector.schema.metadata or {}
+        if metadatos.get(_META_ORIGEN) != digest_origen.encode():
+            return None
+    tabla = lector.read_all()
+    return _tipar_categorias(tabla.to_pandas(types_mapper=_tipo_pandas_texto))
+
+
+def _tipo_pandas_texto(tipo_arrow):
+    if tipo_arrow in (pa.string(), pa.large_string()):
+        return TIPO_TEXTO
+    return None
+
+
+def _cargar_df(ruta_csv, digest):
+    """Usa la instantánea si corresponde al CSV actual; si no, parsea el CSV."""
+    snapshot = ruta_snapshot(ruta_csv)
+    if pa is not None and os.path.exists(snapshot):
+        try:
+            df = leer_snapshot(snapshot, digest)
+            if df is not None:
+                return df
+        except Exception as e:
+            print(f"⚠️ No se pudo leer la instantánea {snapshot}: {e}")
+    return leer_csv_centros(ruta_csv)
+
+
+def _iguales(a, b):
+    if pd.isna(a) and pd.isna(b):
+        return True
+    if pd.isna(a) or pd.isna(b):
+        return False
+    return a == b
+
+
+def diferencias(original, editada):
+    """Cambios fila a fila entre una página del catálogo y su versión editada.
+
+    Las filas se emparejan por la etiqueta del índice (st.data_editor la
+    conserva para las filas existentes) y los cambios se expresan por la
+    clave CODSABER original de cada fila:
+    {"modificaciones": {codigo: {columna: (antes, después)}}, "altas": [fila], "bajas": [codigo]}.
+    """
+    modificaciones = {}
+    for etiqueta, fila in editada.iterrows():
+        if etiqueta not in original.index:
+            continue
+        antes = original.loc[etiqueta]
+        cambios = {col: (antes[col], fila[col]) for col in editada.columns if not _iguales(antes[col], fila[col])}
+        if cambios:
+            modificaciones[str(antes[COLUMNA_CLAVE])] = cambios
+    altas = [fila.to_dict() for etiqueta, fila in editada.iterrows() if etiqueta not in original.index]
+    bajas = [str(original.loc[e, COLUMNA_CLAVE]) for e in original.index if e not in editada.index]
+    return {"modificaciones": modificaciones, "altas": altas, "bajas": bajas}
+
+
+class ConflictoEdicion(ValueError):
+    """Otro usuario cambió las mismas celdas desde que se abrió la edición."""
+
+    def __init__(self, codigos):
+        self.codigos = list(codigos)
+        super().__init__(
+            "Otro usuario modificó o eliminó estos centros desde que empezó la edición: "
+            + ", ".join(self.codigos) + ". Recargue la página y vuelva a aplicar sus cambios."
+        )
+
+
+def _a_json(valor):
+    if valor is None:
+        return None
+    if isinstance(valor, np.generic):
+        valor = valor.item()
+    try:
+        if pd.isna(valor):
+            return None
+    except (TypeError, ValueError):
+        pass
+    return valor
+
+
+def _validar_cambios(df, cambios):
+    """Comprueba los cambios contra la versión vigente del catálogo.
+
+    Cada celda modificada debe conservar el valor que tenía cuando se abrió
+    la edición; si no, lanza ConflictoEdicion. Los cambios de otras filas o
+    columnas hechos entretanto no cuentan como conflicto.
+    """
+    claves = df[COLUMNA_CLAVE].astype(str)
+    posiciones = pd.Index(claves)
+    conflictos = []
+    for codigo, columnas in cambios["modificaciones"].items():
+        pos = posiciones.get_indexer([codigo])[0]
+        if pos < 0 or any(not _iguales(df.iloc[pos][col], antes) for col, (antes, _) in columnas.items()):
+            conflictos.append(codigo)
+    if conflictos:
+        raise ConflictoEdicion(conflictos)
+
+    renombres = {
+        codigo: str(_a_json(columnas[COLUMNA_CLAVE][1]) or "").strip()
+        for codigo, columnas in cambios["modificaciones"].items() if COLUMNA_CLAVE in columnas
+    }
+    nuevas = list(renombres.values()) + [str(_a_json(f.get(COLUMNA_CLAVE)) or "").strip() for f in cambios["altas"]]
+    if "" in nuevas:
+        raise ValueError(f"Todos los centros deben tener {COLUMNA_CLAVE}.")
+    restantes = set(claves) - set(cambios["bajas"]) - set(renombres)
+    repetidas = {c for c in nuevas if c in restantes or nuevas.count(c) > 1}
+    if repetidas:
+        raise ValueError(f"{COLUMNA_CLAVE} duplicado: {', '.join(sorted(repetidas))}")
+
+
+def _entradas_de_cambios(cambios, usuario=None):
+    """Traduce los cambios a entradas del registro (bajas, modificaciones y altas)."""
+    comunes = {"ts": datetime.now().isoformat(timespec="seconds"), "usuario": usuario}
+    entradas = [dict(comunes, op="baja", codigo=codigo) for codigo in cambios["bajas"]]
+    for codigo, columnas in cambios["modificaciones"].items():
+        entradas.append(dict(
+            comunes, op="modificacion", codigo=codigo,
+            antes={c: _a_json(a) for c, (a, _) in columnas.items()},
+            valores={c: _a_json(d) for c, (_, d) in columnas.items()},
+        ))
+    for fila in cambios["altas"]:
+        valores = {c: _a_json(v) for c, v in fila.items()}
+        entradas.append(dict(comunes, op="alta", codigo=str(valores[COLUMNA_CLAVE]).strip(), valores=valores))
+    return entradas
+
+
+def _normalizar_tipos(df):
+    for col in COLUMNAS_COORDENADAS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    return _tipar_categorias(df)
+
+
+def _aplicar_entradas(df, entradas):
+    """Reproduce entradas del registro de cambios sobre una copia de `df`.
+
+    Es idempotente: una alta de una clave existente la reemplaza y una baja o
+    modificación de una clave inexistente se ignora, así que volver a aplicar
+    entradas que ya están en el CSV no altera el resultado.
+    """
+    if not entradas:
+        return df
+    # Las categorías no admiten valores nuevos: se editan como texto
+    df = df.astype({c: TIPO_TEXTO for c in COLUMNAS_CATEGORICAS if c in df.columns})
+    columnas = list(df.columns)
+    indices = {c: i for i, c in enumerate(columnas)}
+    base = len(df)
+    posiciones = {c: i for i, c in enumerate(df[COLUMNA_CLAVE].astype(str))}
+    nuevas = []
+    borradas = set()
+
+    def asignar(pos, valores):
+        if pos < base:
+            for col, valor in valores.items():
+                if col in indices:
+                    df.iat[pos, indices[col]] = valor
+        else:
+            nuevas[pos - base].update({c: v for c, v in valores.items() if c in indices})
+
+    for entrada in entradas:
+        codigo = entrada["codigo"]
+        pos = posiciones.get(codigo)
+        if entrada["op"] == "baja":
+            if pos is not None:
+                borradas.add(pos)
+                del posiciones[codigo]
+        elif entrada["op"] == "alta":
+            valores = {c: entrada["valores"].get(c) for c in columnas}
+            if pos is None:
+                posiciones[codigo] = base + len(nuevas)
+                nuevas.append(valores)
+            else:
+                asignar(pos, valores)
+        elif pos is not None:
+            valores = entrada["valores"]
+            asignar(pos, valores)
+            nuevo_codigo = valores.get(COLUMNA_CLAVE)
+            if nuevo_codigo is not None and str(nuevo_codigo) != codigo:
+                del posiciones[codigo]
+                posiciones[str(nuevo_codigo)] = pos
+
+    if borradas:
+        df = df.drop(index=df.index[sorted(p for p in borradas if p < base)])
+    altas = [f for i, f in enumerate(nuevas) if base + i not in borradas]
+    if altas:
+        df = pd.concat([df, pd.DataFrame(altas, columns=columnas)], ignore_index=True)
+    return _normalizar_tipos(df.reset_index(drop=True))
+
+
+def ruta_registro(ruta_csv=RUTA_CSV):
+    """Ruta del registro de cambios (JSON Lines) asociado a un CSV."""
+    return os.path.splitext(ruta_csv)[0] + ".cambios.jsonl"
+
+
+def _leer_registro(ruta, desde=0):
+    """Entradas del registro a partir del byte `desde` y el byte donde terminan.
+
+    Una última línea incompleta (escritura en curso o interrumpida) se ignora.
+    """
+    try:
+        with open(ruta, "rb") as f:
+            f.seek(desde)
+            datos = f.read()
+    except FileNotFoundError:
+        return [], 0
+    fin = datos.rfind(b"\n") + 1
+    entradas = [json.loads(linea) for linea in datos[:fin].decode("utf-8").splitlines() if linea.strip()]
+    return entradas, desde + fin
+
+
+def guardar_cambios(catalogo, cambios, usuario=None):
+    """Guarda los cambios de una edición y devuelve el catálogo resultante.
+
+    Los cambios se validan contra la versión vigente del catálogo (no contra
+    la que se editó) y se añaden al registro de cambios, así que guardar
+    cuesta O(filas cambiadas) y dos administradores que editan filas
+    distintas no se pisan. Cuando el registro supera LIMITE_REGISTRO_BYTES
+    se compacta en el CSV.
+    """
+    ruta = catalogo.ruta
+    with bloqueo_archivo(ruta, mensaje=MENSAJE_BLOQUEO):
+        vigente = get_catalogo(ruta)
+        _validar_cambios(vigente.df, cambios)
+        lineas = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in _entradas_de_cambios(cambios, usuario))
+        with open(ruta_registro(ruta), "a", encoding="utf-8") as f:
+            f.write(lineas)
+            f.flush()
+            os.fsync(f.fileno())
+        nuevo = get_catalogo(ruta)
+        if nuevo.bytes_registro > LIMITE_REGISTRO_BYTES:
+            nuevo = _compactar(nuevo)
+    return nuevo
+
+
+def _compactar(catalogo):
+    """Vuelca el catálogo al CSV (archivo temporal + rename) y vacía el registro.
+
+    Si el proceso se interrumpe entre ambos pasos, el registro se vuelve a
+    aplicar sobre el CSV nuevo sin efecto, porque su reproducción es idempotente.
+    """
+    ruta = catalogo.ruta
+    temporal = ruta + ".tmp"
+    catalogo.df.to_csv(temporal, index=False)
+    os.replace(temporal, ruta)
+    # Mantener la instantánea al día si se está usando
+    if pa is not None and os.path.exists(ruta_snapshot(ruta)):
+        construir_snapshot(ruta)
+    registro = ruta_registro(ruta)
+    with open(registro + ".tmp", "w", encoding="utf-8"):
+        pass
+    os.replace(registro + ".tmp", registro)
+    return get_catalogo(ruta)
+
+
+def compactar_registro(ruta=RUTA_CSV):
+    """Incorpora al CSV los cambios pendientes del registro."""
+    with bloqueo_archivo(os.path.abspath(ruta), mensaje=MENSAJE_BLOQUEO):
+        return _compactar(get_catalogo(ruta))
+
+
+def _firma_registro(ruta):
+    try:
+        return _firma_archivo(ruta)
+    except FileNotFoundError:
+        return None
+
+
+def get_catalogo(ruta=RUTA_CSV):
+    """Devuelve el catálogo vigente, recargándolo solo si los archivos cambiaron.
+
+    La comprobación habitual es un `os.stat` del CSV y de su registro de
+    cambios. Si el CSV cambia se calcula el hash del contenido; si coincide
+    con el cargado (p. ej. el archivo solo se tocó) se conserva la misma
+    versión. Si solo creció el registro, se aplican únicamente las entradas
+    nuevas sobre la versión anterior.
+    """
+    clave = os.path.abspath(ruta)
+    registro = ruta_registro(clave)
+    firma = (_firma_archivo(clave), _firma_registro(registro))
+    catalogo = _catalogos.get(clave)
+    if catalogo is not None and catalogo.firma == firma:
+        return catalogo
+
+    with _lock:
+        catalogo = _catalogos.get(clave)
+        if catalogo is not None and catalogo.firma == firma:
+            return catalogo
+        digest = _hash_archivo(clave)
+        tamano_registro = firma[1][1] if firma[1] else 0
+        if catalogo is not None and catalogo.digest == digest and tamano_registro >= catalogo.bytes_registro:
+            entradas, fin = _leer_registro(registro, catalogo.bytes_registro)
+            if not entradas:
+                catalogo.firma = firma
+                return catalogo
+            return _nueva_version(_aplicar_entradas(catalogo.df, entradas), clave, firma, digest, fin)
+        df = _cargar_df(clave, digest)
+        entradas, fin = _leer_registro(registro)
+        return _nueva_version(_aplicar_entradas(df, entradas), clave, firma, digest, fin)
+
+
+def _nueva_version(df, clave, firma, digest, bytes_registro):
+    global _ultima_version
+    _ultima_version += 1
+    # Los resultados de versiones anteriores ya no se van a pedir
+    cache_filtros.vaciar()
+    cache_exportaciones.vaciar()
+    catalogo = CatalogoCentros(df, _ultima_version, clave, firma, digest, bytes_registro)
+    _catalogos[clave] = catalogo
+    return catalogo
@@ -1,25 +1,4 @@
-﻿# --- FUNCIONES DE AUDITORÍA ---
-def obtener_auditoria():
-    conn = get_db_connection()
-    if not conn:
-        return pd.DataFrame(columns=["id", "user_id", "accion", "detalle", "fecha"])
-    try:
-        df = pd.read_sql("SELECT id, user_id, accion, detalle, fecha FROM auditoria ORDER BY fecha DESC", conn)
-        return df
-    except Exception:
-        return pd.DataFrame(columns=["id", "user_id", "accion", "detalle", "fecha"])
-
-def registrar_auditoria(user_id, accion, detalle):
-    conn = get_db_connection()
-    if not conn:
-        return
-    try:
-        with conn.cursor() as cur:
-            cur.execute("INSERT INTO auditoria (user_id, accion, detalle, fecha) VALUES (%s, %s, %s, CURRENT_TIMESTAMP)", (user_id, accion, detalle))
-        conn.commit()
-    except Exception:
-        conn.rollback()
-try:
+﻿try:
     import streamlit as st
 except Exception:
     # Si Streamlit no está instalado (por ejemplo al ejecutar init_db.py),
@@ -51,375 +30,983 @@ except Exception:
 
     st = _DummyStreamlit()
 import psycopg2
+import psycopg2.extensions
+from psycopg2 import pool as pg_pool
 import pandas as pd
 import json
 import os
+import threading
+import time
+import atexit
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from psycopg2.extras import execute_values
 
-# --- CONEXIÓN PRINCIPAL ---
+from bloqueos import bloqueo_archivo
 
-def get_db_connection():
-    """
-    Crea y devuelve una nueva conexión a la base de datos Postgres en cada llamada.
-    Esto evita devolver conexiones cacheadas que pueden cerrarse entre ejecuciones
-    (causando psycopg2.InterfaceError). Si no se encuentra la URL de la BD,
-    devuelve `None` y muestra un aviso.
-    """
-    db_url = None
+# --- CONEXIÓN PRINCIPAL ---
 
-    # 1. Intentar leer de secretos de Streamlit (cuando la app corre)
+# Pool de conexiones compartido por todas las sesiones del proceso. Se crea
+# en el primer uso con los límites DB_POOL_MIN / DB_POOL_MAX (secrets.toml o
+# variables de entorno): se mantienen abiertas hasta DB_POOL_MIN conexiones
+# libres y nunca se abren más de DB_POOL_MAX. Las funciones de este módulo
+# piden una conexión con `conexion()` y la devuelven al terminar.
+_pool = None
+_pool_lock = threading.Lock()
+# Momento en que cada conexión volvió al pool, para decidir si comprobarla
+_ultimo_uso = {}
+
+def _configuracion(nombre, defecto=None):
+    """Valor de configuración desde secrets de Streamlit o variables de entorno."""
     try:
-        if "DB_URL" in st.secrets:
-            db_url = st.secrets["DB_URL"]
+        if nombre in st.secrets:
+            return st.secrets[nombre]
     except Exception:
         pass
+    return os.environ.get(nombre, defecto)
 
-    # 2. Si falla, intentar leer de variables de entorno (para scripts)
-    if not db_url:
-        db_url = os.environ.get("DB_URL")
+def _avisar(mensaje, error=False):
+    try:
+        (st.error if error else st.warning)(mensaje)
+    except Exception:
+        print(mensaje)
 
-    if not db_url:
+def get_pool():
+    """
+    Devuelve el pool de conexiones del proceso, creándolo si hace falta.
+    Si no se encuentra la URL de la BD o no se puede conectar, devuelve
+    `None` y muestra un aviso.
+    """
+    global _pool
+    if _pool is not None and not _pool.closed:
+        return _pool
+    with _pool_lock:
+        if _pool is not None and not _pool.closed:
+            return _pool
+        db_url = _configuracion("DB_URL")
+        if not db_url:
+            _avisar("⚠️ Aviso: No se encontró DB_URL en secrets.toml ni en variables de entorno. Algunas funcionalidades dependerán de la base de datos y estarán deshabilitadas.")
+            return None
+        minimo = int(_configuracion("DB_POOL_MIN", 2))
+        maximo = max(minimo, int(_configuracion("DB_POOL_MAX", 10)))
         try:
-            st.warning("⚠️ Aviso: No se encontró DB_URL en secrets.toml ni en variables de entorno. Algunas funcionalidades dependerán de la base de datos y estarán deshabilitadas.")
-        except Exception:
-            print("⚠️ Aviso: No se encontró DB_URL en secrets.toml ni en variables de entorno.")
-        return None
+            opciones = {"connection_factory": ConexionPreparada} if _usar_preparadas(db_url) else {}
+            nuevo = pg_pool.ThreadedConnectionPool(minimo, maximo, db_url, **opciones)
+        except Exception as e:
+            _avisar(f"Error conectando a la base de datos: {e}", error=True)
+            return None
+        # ThreadedConnectionPool falla en vez de esperar cuando se agota:
+        # el semáforo hace esperar a quien pida más de `maximo` conexiones.
+        # Va con su pool, así que cerrar_pool() no afecta a los préstamos
+        # en curso del pool anterior.
+        nuevo.disponibles = threading.BoundedSemaphore(maximo)
+        _pool = nuevo
+        return _pool
+
+def cerrar_pool():
+    """Cierra todas las conexiones del pool (p. ej. al terminar un script)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and not _pool.closed:
+            _pool.closeall()
+        _pool = None
+        _ultimo_uso.clear()
+
+def _conexion_sana(conn):
+    """Comprueba una conexión antes de prestarla.
+
+    Las que llevan poco tiempo en el pool solo se revisan localmente; las
+    que llevan más de DB_POOL_PING_SEGUNDOS se prueban con un SELECT 1.
+    """
+    if conn.closed or conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    inactiva = time.monotonic() - _ultimo_uso.get(id(conn), 0)
+    if inactiva < float(_configuracion("DB_POOL_PING_SEGUNDOS", 30)):
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+@contextmanager
+def conexion():
+    """
+    Presta una conexión del pool y la devuelve al salir del bloque.
 
+    Entrega `None` si no hay base de datos configurada. Si el bloque termina
+    con una excepción se hace rollback; en todo caso la conexión vuelve al
+    pool (sin transacción abierta). Espera hasta DB_POOL_ESPERA_SEGUNDOS a
+    que haya una libre.
+    """
+    pool = get_pool()
+    if pool is None:
+        yield None
+        return
+    disponibles = pool.disponibles
+    if not disponibles.acquire(timeout=float(_configuracion("DB_POOL_ESPERA_SEGUNDOS", 30))):
+        raise RuntimeError("No hay conexiones libres a la base de datos. Intente de nuevo en unos segundos.")
+    conn = None
     try:
-        conn = psycopg2.connect(db_url)
-        return conn
-    except Exception as e:
+        # Descartar conexiones caídas (reinicio del servidor, timeouts de red...)
+        for _ in range(pool.maxconn + 1):
+            conn = pool.getconn()
+            if _conexion_sana(conn):
+                break
+            pool.putconn(conn, close=True)
+            conn = None
+        if conn is None:
+            raise RuntimeError("No se pudo obtener una conexión válida a la base de datos.")
         try:
-            st.error(f"Error conectando a la base de datos: {e}")
+            yield conn
         except Exception:
-            print(f"Error conectando a la base de datos: {e}")
-        return None
-
-# --- INICIALIZACIÓN ---
+            if not conn.closed:
+                conn.rollback()
+            raise
+    finally:
+        if conn is not None:
+            _ultimo_uso[id(conn)] = time.monotonic()
+            if pool.closed:
+                # cerrar_pool() cerró el pool mientras estaba prestada
+                conn.close()
+            else:
+                # putconn hace rollback de lo no confirmado y cierra si está rota
+                pool.putconn(conn, close=bool(conn.closed))
+        disponibles.release()
+
+# --- SENTENCIAS PREPARADAS ---
+
+# Consultas más frecuentes: login, envíos, estructura de plantillas y
+# auditoría. Con DB_SENTENCIAS_PREPARADAS = "1" cada conexión del pool las
+# prepara la primera vez que las usa y después solo las ejecuta, sin que
+# Postgres vuelva a analizarlas y planificarlas. Está desactivado por
+# defecto y se ignora si DB_URL apunta a un pooler (host "-pooler" de Neon
+# o puerto 6432 de PgBouncer): en modo transacción lo preparado pertenece a
+# la sesión del servidor y la siguiente transacción podría ir por otra.
+SENTENCIAS_PREPARADAS = {
+    "usuario_por_nombre": "SELECT id, username, password_hash, role, full_name, failed_attempts, is_locked FROM usuarios WHERE username = %s",
+    "insertar_envio": "INSERT INTO form_submissions (template_id, user_id, data) VALUES (%s, %s, %s)",
+    "estructura_plantilla": "SELECT structure FROM form_templates WHERE id = %s",
+    # Resultado del login (ver registrar_login)
+    "login_exitoso": """
+        UPDATE usuarios SET failed_attempts = 0, password_hash = COALESCE(%s, password_hash)
+        WHERE id = %s AND NOT COALESCE(is_locked, FALSE)
+        RETURNING failed_attempts, is_locked
+    """,
+    "login_fallido": """
+        UPDATE usuarios SET failed_attempts = COALESCE(failed_attempts, 0) + 1,
+                            is_locked = COALESCE(is_locked, FALSE) OR COALESCE(failed_attempts, 0) + 1 >= %s
+        WHERE id = %s
+        RETURNING failed_attempts, is_locked
+    """,
+    # Un lote de cualquier tamaño con la misma sentencia: una lista por columna
+    "insertar_auditoria": """
+        INSERT INTO auditoria (user_id, accion, detalle, fecha)
+        SELECT * FROM unnest(%s::integer[], %s::varchar[], %s::text[], %s::timestamp[])
+    """,
+}
+
+class ConexionPreparada(psycopg2.extensions.connection):
+    """Conexión que recuerda qué sentencias de SENTENCIAS_PREPARADAS ya preparó."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preparadas = set()
+
+def _es_pooler(db_url):
+    """True si la URL apunta a un pooler de conexiones (PgBouncer, Neon "-pooler")."""
+    try:
+        dsn = psycopg2.extensions.parse_dsn(db_url)
+    except psycopg2.ProgrammingError:
+        return False
+    return "-pooler" in dsn.get("host", "") or dsn.get("port") == "6432"
+
+def _usar_preparadas(db_url):
+    if str(_configuracion("DB_SENTENCIAS_PREPARADAS", "0")).strip().lower() not in ("1", "true", "si", "sí"):
+        return False
+    if _es_pooler(db_url):
+        print("⚠️ DB_SENTENCIAS_PREPARADAS se ignora: DB_URL apunta a un pooler de conexiones.")
+        return False
+    return True
+
+def ejecutar_sentencia(cur, nombre, parametros=()):
+    """
+    Ejecuta la sentencia `nombre` de SENTENCIAS_PREPARADAS con `cur`.
 
-def create_tables():
-    """Crea todas las tablas de la app si no existen."""
-    conn = get_db_connection()
-    if not conn:
-        print("⚠️ Omisión de creación de tablas: no hay conexión a la BD (DB_URL no configurada).")
+    Si la conexión es una ConexionPreparada se prepara una sola vez (PREPARE
+    no se deshace con rollback) y se ejecuta con EXECUTE; si no, se ejecuta
+    el SQL tal cual.
+    """
+    sql = SENTENCIAS_PREPARADAS[nombre]
+    conn = cur.connection
+    if not isinstance(conn, ConexionPreparada):
+        cur.execute(sql, parametros)
         return
+    if nombre not in conn.preparadas:
+        # PREPARE numera los parámetros: %s, %s -> $1, $2
+        trozos = sql.split("%s")
+        cur.execute(f"PREPARE {nombre} AS " + trozos[0] + "".join(f"${i}{t}" for i, t in enumerate(trozos[1:], 1)))
+        conn.preparadas.add(nombre)
+    marcadores = ", ".join(["%s"] * len(parametros))
+    cur.execute(f"EXECUTE {nombre} ({marcadores})" if parametros else f"EXECUTE {nombre}", parametros)
+
+# --- CONSULTAS EN PARALELO ---
+
+# Hilos compartidos para lanzar a la vez consultas de lectura independientes.
+# Cada consulta toma su propia conexión del pool, así que nunca hay más de
+# DB_POOL_MAX en curso aunque varias sesiones pidan lotes al mismo tiempo.
+_ejecutor_consultas = None
+
+def _ejecutor():
+    global _ejecutor_consultas
+    with _pool_lock:
+        if _ejecutor_consultas is None:
+            _ejecutor_consultas = ThreadPoolExecutor(
+                max_workers=int(_configuracion("DB_CONSULTAS_PARALELAS", 6)),
+                thread_name_prefix="consultas"
+            )
+        return _ejecutor_consultas
+
+class LoteConsultas:
+    """Resultados de `consultar_en_paralelo`; cada uno se recoge por nombre."""
+
+    def __init__(self, resultados, errores, segundos):
+        self._resultados = resultados
+        self._errores = errores
+        self.segundos = segundos
+
+    def obtener(self, nombre):
+        """Resultado de la consulta `nombre`; si falló, relanza su excepción."""
+        if nombre in self._errores:
+            raise self._errores[nombre]
+        return self._resultados[nombre]
+
+def consultar_en_paralelo(consultas):
+    """
+    Ejecuta a la vez las consultas de `consultas` ({nombre: función sin
+    argumentos}) y espera a que terminen todas: la espera total es la de la
+    más lenta, no la suma. Solo para lecturas independientes entre sí.
 
-    try:
+    El error de una consulta no afecta a las demás; se relanza al pedir su
+    resultado con `LoteConsultas.obtener`. `segundos` guarda lo que tardó
+    cada una.
+    """
+    segundos = {}
+
+    def medir(nombre, funcion):
+        inicio = time.perf_counter()
+        try:
+            return funcion()
+        finally:
+            segundos[nombre] = time.perf_counter() - inicio
+
+    futuros = {nombre: _ejecutor().submit(medir, nombre, funcion) for nombre, funcion in consultas.items()}
+    resultados, errores = {}, {}
+    for nombre, futuro in futuros.items():
+        try:
+            resultados[nombre] = futuro.result()
+        except Exception as e:
+            errores[nombre] = e
+    return LoteConsultas(resultados, errores, segundos)
+
+# --- FUNCIONES DE AUDITORÍA ---
+
+class BufferAuditoria:
+    """
+    Acumula las acciones auditadas en memoria y las escribe por lotes.
+
+    `registrar` solo añade la acción a la cola: no toca la base de datos.
+    Un hilo en segundo plano vacía la cola cada `intervalo` segundos o en
+    cuanto junta `max_lote` acciones, con un único INSERT de varias filas.
+    Si la escritura falla (BD caída), las acciones se añaden al archivo
+    `ruta_respaldo` y se reintentan en el siguiente vaciado. Si falla por
+    los datos de alguna fila (`es_error_de_fila`), el lote se reintenta fila
+    a fila y las que siguen fallando pasan a `ruta_cuarentena`, para que no
+    bloqueen al resto. Al terminar el proceso se hace un último vaciado.
+
+    El respaldo se comparte entre procesos: leerlo, escribirlo en la BD y
+    vaciarlo se hace con `bloqueos.bloqueo_archivo`.
+    """
+
+    def __init__(self, escribir, max_lote=100, intervalo=2.0, ruta_respaldo="auditoria_pendiente.jsonl",
+                 es_error_de_fila=lambda e: False):
+        self._escribir = escribir
+        self._es_error_de_fila = es_error_de_fila
+        self.max_lote = max_lote
+        self.intervalo = intervalo
+        self.ruta_respaldo = ruta_respaldo
+        self.ruta_cuarentena = os.path.splitext(ruta_respaldo)[0] + ".cuarentena.jsonl"
+        self._pendientes = []
+        self._lock = threading.Lock()
+        # Solo un vaciado a la vez (hilo de fondo, lecturas y cierre)
+        self._lock_vaciado = threading.Lock()
+        self._despertar = threading.Event()
+        self._hilo = None
+        self._cerrado = False
+
+    def registrar(self, user_id, accion, detalle):
+        with self._lock:
+            self._pendientes.append((user_id, accion, detalle, datetime.now()))
+            lleno = len(self._pendientes) >= self.max_lote
+            if self._hilo is None and not self._cerrado:
+                self._hilo = threading.Thread(target=self._bucle, name="auditoria", daemon=True)
+                self._hilo.start()
+                atexit.register(self.cerrar)
+        if lleno:
+            self._despertar.set()
+
+    def _bucle(self):
+        while not self._cerrado:
+            self._despertar.wait(self.intervalo)
+            self._despertar.clear()
+            self.vaciar()
+
+    def _leer_respaldo(self):
+        try:
+            with open(self.ruta_respaldo, encoding="utf-8") as f:
+                filas = [json.loads(linea) for linea in f if linea.strip()]
+        except FileNotFoundError:
+            return []
+        return [(f["user_id"], f["accion"], f["detalle"], datetime.fromisoformat(f["fecha"])) for f in filas]
+
+    @staticmethod
+    def _escribir_archivo(ruta, filas, modo="a", errores=None):
+        with open(ruta, modo, encoding="utf-8") as f:
+            for i, (user_id, accion, detalle, fecha) in enumerate(filas):
+                linea = {"user_id": user_id, "accion": accion, "detalle": detalle, "fecha": fecha.isoformat()}
+                if errores:
+                    linea["error"] = errores[i]
+                f.write(json.dumps(linea, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _guardar_respaldo(self, lote):
+        self._escribir_archivo(self.ruta_respaldo, lote)
+
+    def _reemplazar_respaldo(self, filas):
+        temporal = self.ruta_respaldo + ".tmp"
+        self._escribir_archivo(temporal, filas, modo="w")
+        os.replace(temporal, self.ruta_respaldo)
+
+    def _escribir_por_filas(self, filas):
+        """Escribe fila a fila. Devuelve (pendientes, cuarentena, errores de la cuarentena)."""
+        cuarentena, errores = [], []
+        for i, fila in enumerate(filas):
+            try:
+                self._escribir([fila])
+            except Exception as e:
+                if not self._es_error_de_fila(e):
+                    # La BD dejó de responder: el resto queda para el siguiente vaciado
+                    return filas[i:], cuarentena, errores
+                cuarentena.append(fila)
+                errores.append(str(e))
+        return [], cuarentena, errores
+
+    def vaciar(self):
+        """Escribe lo pendiente (y lo que quedó en el respaldo). Devuelve True si todo se guardó."""
+        with self._lock_vaciado:
+            with self._lock:
+                lote, self._pendientes = self._pendientes, []
+            if not lote and not os.path.exists(self.ruta_respaldo):
+                return True
+            try:
+                with bloqueo_archivo(self.ruta_respaldo, espera=5.0, caducidad=300.0,
+                                     mensaje="el respaldo de auditoría lo está vaciando otro proceso"):
+                    return self._vaciar_respaldo(lote)
+            except TimeoutError as e:
+                # El lote vuelve a la cola, delante de lo registrado mientras tanto
+                with self._lock:
+                    self._pendientes[:0] = lote
+                print(f"⚠️ Auditoría: {e}; se reintentará.")
+                return False
+
+    def _vaciar_respaldo(self, lote):
+        respaldo = self._leer_respaldo()
+        filas = respaldo + lote
+        if not filas:
+            return True
+        try:
+            self._escribir(filas)
+            pendientes, cuarentena, errores = [], [], []
+        except Exception as e:
+            if not self._es_error_de_fila(e):
+                if lote:
+                    self._guardar_respaldo(lote)
+                    print(f"⚠️ Auditoría: no se pudo escribir en la BD ({e}); {len(filas)} acciones pendientes en {self.ruta_respaldo}.")
+                return False
+            pendientes, cuarentena, errores = self._escribir_por_filas(filas)
+
+        if cuarentena:
+            self._escribir_archivo(self.ruta_cuarentena, cuarentena, errores=errores)
+            print(f"⚠️ Auditoría: {len(cuarentena)} acciones rechazadas por la BD movidas a {self.ruta_cuarentena}.")
+        if pendientes:
+            self._reemplazar_respaldo(pendientes)
+            print(f"⚠️ Auditoría: {len(pendientes)} acciones pendientes en {self.ruta_respaldo}.")
+        elif respaldo:
+            os.remove(self.ruta_respaldo)
+        return not pendientes and not cuarentena
+
+    def cerrar(self):
+        """Detiene el hilo de fondo y hace el último vaciado."""
+        self._cerrado = True
+        self._despertar.set()
+        if self._hilo is not None and self._hilo is not threading.current_thread():
+            self._hilo.join(timeout=5)
+        self.vaciar()
+
+def _error_de_fila(e):
+    """True si la BD rechazó los datos (reintentar no sirve); False si no respondió."""
+    return isinstance(e, psycopg2.Error) and not isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+def _insertar_auditoria(lote):
+    with conexion() as conn:
+        if not conn:
+            raise RuntimeError("no hay conexión a la base de datos")
         with conn.cursor() as cur:
-            # Tabla de Centros Educativos
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS centros (
-                    id SERIAL PRIMARY KEY,
-                    codigo VARCHAR(20) UNIQUE,
-                    nombre VARCHAR(255) NOT NULL,
-                    provincia VARCHAR(100),
-                    otros_campos JSONB
-                );
-            """)
-            # Tabla de auditoría
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS auditoria (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER REFERENCES usuarios(id),
-                    accion VARCHAR(100) NOT NULL,
-                    detalle TEXT,
-                    fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
-            # Tabla de Áreas
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS form_areas (
-                    id SERIAL PRIMARY KEY,
-                    area_name VARCHAR(100) UNIQUE NOT NULL,
-                    description TEXT
-                );
-            """)
-            
-            # Tabla de Usuarios (con reseteo)
-            cur.execute("DROP TABLE IF EXISTS usuarios CASCADE;")
-            cur.execute("""
-                CREATE TABLE usuarios (
-                    id SERIAL PRIMARY KEY,
-                    username VARCHAR(50) UNIQUE NOT NULL,
-                    password_hash VARCHAR(255) NOT NULL,
-                    role VARCHAR(20) NOT NULL CHECK (role IN ('admin', 'operador')),
-                    full_name VARCHAR(100),
-                    failed_attempts INTEGER DEFAULT 0,
-                    is_locked BOOLEAN DEFAULT FALSE
-                );
-            """)
-            
-            # Tabla de Plantillas
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS form_templates (
-                    id SERIAL PRIMARY KEY,
-                    name VARCHAR(100) NOT NULL,
-                    structure JSONB NOT NULL,
-                    created_by_user_id INTEGER REFERENCES usuarios(id),
-                    area_id INTEGER REFERENCES form_areas(id)
-                );
-            """)
-            
-            # Tabla de Envíos
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS form_submissions (
-                    id SERIAL PRIMARY KEY,
-                    template_id INTEGER REFERENCES form_templates(id),
-                    user_id INTEGER REFERENCES usuarios(id),
-                    data JSONB NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
+            # Una lista por columna: (user_ids, acciones, detalles, fechas)
+            ejecutar_sentencia(cur, "insertar_auditoria", tuple(list(columna) for columna in zip(*lote)))
         conn.commit()
-        print("✅ Tablas verificadas/creadas exitosamente.")
-    except Exception as e:
-        print(f"❌ Error creando tablas: {e}")
-    # NOTA: NO HAY 'conn.close()' AQUÍ. ES INTENCIONAL.
+
+buffer_auditoria = BufferAuditoria(
+    _insertar_auditoria,
+    max_lote=int(os.environ.get("AUDITORIA_MAX_LOTE", 100)),
+    intervalo=float(os.environ.get("AUDITORIA_INTERVALO_SEGUNDOS", 2.0)),
+    ruta_respaldo=os.environ.get("AUDITORIA_RESPALDO", "auditoria_pendiente.jsonl"),
+    es_error_de_fila=_error_de_fila,
+)
+
+def registrar_auditoria(user_id, accion, detalle):
+    """Registra una acción; se escribe en la BD en segundo plano (ver BufferAuditoria)."""
+    buffer_auditoria.registrar(user_id, accion, detalle)
+
+def obtener_auditoria():
+    """Historial de auditoría, incluidas las acciones aún en el buffer. Lanza la excepción si la consulta falla."""
+    buffer_auditoria.vaciar()
+    with conexion() as conn:
+        if not conn:
+            return pd.DataFrame(columns=["id", "user_id", "accion", "detalle", "fecha"])
+        df = pd.read_sql("SELECT id, user_id, accion, detalle, fecha FROM auditoria ORDER BY fecha DESC", conn)
+        return df
 
 # --- FUNCIONES DE USUARIO ---
 
 def get_user(username):
-    conn = get_db_connection()
-    if not conn:
+    with conexion() as conn:
+        if not conn:
+            return None
+        with conn.cursor() as cur:
+            ejecutar_sentencia(cur, "usuario_por_nombre", (username,))
+            user_data = cur.fetchone()
+        if user_data:
+            return {
+                "id": user_data[0],
+                "username": user_data[1],
+                "password_hash": user_data[2],
+                "role": user_data[3],
+                "full_name": user_data[4],
+                "failed_attempts": user_data[5],
+                "is_locked": user_data[6]
+            }
         return None
-    with conn.cursor() as cur:
-        cur.execute("SELECT id, username, password_hash, role, full_name, failed_attempts, is_locked FROM usuarios WHERE username = %s", (username,))
-        user_data = cur.fetchone()
-    # Sin conn.close()
-    if user_data:
-        return {
-            "id": user_data[0],
-            "username": user_data[1],
-            "password_hash": user_data[2],
-            "role": user_data[3],
-            "full_name": user_data[4],
-            "failed_attempts": user_data[5],
-            "is_locked": user_data[6]
-        }
-    return None
-
-def increment_failed_attempts(username):
-    conn = get_db_connection()
-    if not conn:
-        return
-    with conn.cursor() as cur:
-        cur.execute("UPDATE usuarios SET failed_attempts = failed_attempts + 1 WHERE username = %s", (username,))
-        cur.execute("SELECT failed_attempts FROM usuarios WHERE username = %s", (username,))
-        row = cur.fetchone()
-        attempts = row[0] if row and row[0] is not None else 0
-        if attempts >= 5:
-            cur.execute("UPDATE usuarios SET is_locked = TRUE WHERE username = %s", (username,))
-    conn.commit()
-
-def reset_failed_attempts(username):
-    conn = get_db_connection()
-    if not conn:
-        return
-    with conn.cursor() as cur:
-        cur.execute("UPDATE usuarios SET failed_attempts = 0 WHERE username = %s", (username,))
-    conn.commit()
 
-def unlock_user(user_id):
-    conn = get_db_connection()
-    if not conn:
-        return False, "No hay conexión a la base de datos."
-    try:
+# Intentos fallidos seguidos a partir de los cuales se bloquea el usuario
+MAX_INTENTOS_LOGIN = 5
+
+def registrar_login(user_id, exito, nuevo_hash=None):
+    """
+    Registra el resultado de un intento de login con un solo UPDATE ... RETURNING.
+
+    Si `exito`, reinicia los intentos fallidos y, si se pasa `nuevo_hash`,
+    guarda la contraseña con los parámetros actuales; no se aplica si el
+    usuario se bloqueó entretanto. Si no, suma un intento y bloquea al llegar
+    a MAX_INTENTOS_LOGIN. Devuelve {"failed_attempts", "is_locked"}, o None
+    si no se aplicó.
+    """
+    with conexion() as conn:
+        if not conn:
+            return None
         with conn.cursor() as cur:
-            cur.execute("UPDATE usuarios SET is_locked = FALSE, failed_attempts = 0 WHERE id = %s", (user_id,))
+            if exito:
+                ejecutar_sentencia(cur, "login_exitoso", (nuevo_hash, user_id))
+            else:
+                ejecutar_sentencia(cur, "login_fallido", (MAX_INTENTOS_LOGIN, user_id))
+            fila = cur.fetchone()
         conn.commit()
-        return True, "Usuario desbloqueado."
-    except Exception as e:
-        conn.rollback()
-        return False, f"Error al desbloquear usuario: {e}"
+    if fila is None:
+        return None
+    return {"failed_attempts": fila[0], "is_locked": fila[1]}
+
+def unlock_user(user_id):
+    with conexion() as conn:
+        if not conn:
+            return False, "No hay conexión a la base de datos."
+        try:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE usuarios SET is_locked = FALSE, failed_attempts = 0 WHERE id = %s", (user_id,))
+            conn.commit()
+            return True, "Usuario desbloqueado."
+        except Exception as e:
+            conn.rollback()
+            return False, f"Error al desbloquear usuario: {e}"
 
 def create_admin_user(username, password, full_name):
     from auth import hash_password
     hashed = hash_password(password)
-    conn = get_db_connection()
-    if not conn:
-        print("⚠️ No se pudo crear admin: no hay conexión a la BD.")
-        return
-    try:
-        with conn.cursor() as cur:
-            cur.execute("INSERT INTO usuarios (username, password_hash, role, full_name) VALUES (%s, %s, 'admin', %s)", (username, hashed, full_name))
-        conn.commit()
-        print(f"✅ Usuario admin '{username}' creado.")
-    except psycopg2.IntegrityError:
-        conn.rollback()
-        print(f"⚠️  Usuario admin '{username}' ya existe. No se creó de nuevo.")
-    except Exception as e:
-        conn.rollback()
-        print(f"❌ Error creando admin: {e}")
-    # Sin conn.close()
+    with conexion() as conn:
+        if not conn:
+            print("⚠️ No se pudo crear admin: no hay conexión a la BD.")
+            return
+        try:
+            with conn.cursor() as cur:
+                cur.execute("INSERT INTO usuarios (username, password_hash, role, full_name) VALUES (%s, %s, 'admin', %s)", (username, hashed, full_name))
+            conn.commit()
+            print(f"✅ Usuario admin '{username}' creado.")
+        except psycopg2.IntegrityError:
+            conn.rollback()
+            print(f"⚠️  Usuario admin '{username}' ya existe. No se creó de nuevo.")
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Error creando admin: {e}")
 
 def create_user(username, password, role, full_name):
     from auth import hash_password
     hashed = hash_password(password)
-    conn = get_db_connection()
-    if not conn:
-        return False, "No hay conexión a la base de datos."
-    try:
-        with conn.cursor() as cur:
-            cur.execute("INSERT INTO usuarios (username, password_hash, role, full_name) VALUES (%s, %s, %s, %s)", (username, hashed, role, full_name))
-        conn.commit()
-        return True, "Usuario creado."
-    except psycopg2.IntegrityError:
-        conn.rollback()
-        return False, "El usuario ya existe."
-    # Sin conn.close()
+    with conexion() as conn:
+        if not conn:
+            return False, "No hay conexión a la base de datos."
+        try:
+            with conn.cursor() as cur:
+                cur.execute("INSERT INTO usuarios (username, password_hash, role, full_name) VALUES (%s, %s, %s, %s)", (username, hashed, role, full_name))
+            conn.commit()
+            return True, "Usuario creado."
+        except psycopg2.IntegrityError:
+            conn.rollback()
+            return False, "El usuario ya existe."
 
 def change_user_password(user_id, new_password):
     """Actualiza la contraseña de un usuario dado su id."""
     from auth import hash_password
     hashed = hash_password(new_password)
-    conn = get_db_connection()
-    if not conn:
-        return False, "No hay conexión a la base de datos."
-    try:
-        with conn.cursor() as cur:
-            cur.execute("UPDATE usuarios SET password_hash = %s WHERE id = %s", (hashed, user_id))
-        conn.commit()
-        return True, "Contraseña actualizada." 
-    except Exception as e:
-        conn.rollback()
-        return False, f"Error al actualizar contraseña: {e}"
+    with conexion() as conn:
+        if not conn:
+            return False, "No hay conexión a la base de datos."
+        try:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE usuarios SET password_hash = %s WHERE id = %s", (hashed, user_id))
+            conn.commit()
+            return True, "Contraseña actualizada." 
+        except Exception as e:
+            conn.rollback()
+            return False, f"Error al actualizar contraseña: {e}"
+
+def update_user_role(user_id, role):
+    """Cambia el rol de un usuario."""
+    with conexion() as conn:
+        if not conn:
+            return False, "No hay conexión a la base de datos."
+        try:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE usuarios SET role = %s WHERE id = %s", (role, user_id))
+            conn.commit()
+            return True, "Rol actualizado."
+        except Exception as e:
+            conn.rollback()
+            return False, f"Error al actualizar rol: {e}"
 
 def get_all_users():
-    conn = get_db_connection()
-    if not conn:
-        return pd.DataFrame(columns=["id", "username", "role", "full_name"])
-    df = pd.read_sql("SELECT id, username, role, full_name FROM usuarios ORDER BY full_name", conn)
-    return df
+    """Todos los usuarios con su estado de bloqueo, en una sola consulta."""
+    with conexion() as conn:
+        if not conn:
+            return pd.DataFrame(columns=["id", "username", "role", "full_name", "is_locked", "failed_attempts"])
+        df = pd.read_sql("""
+            SELECT id, username, role, full_name, COALESCE(is_locked, FALSE) AS is_locked,
+                   COALESCE(failed_attempts, 0) AS failed_attempts
+            FROM usuarios ORDER BY full_name
+        """, conn)
+        return df
+
+# Operaciones masivas (carga de CSV desde Gestión de Usuarios). Cada una se
+# aplica en una sola transacción: o se aplican todas las filas o ninguna.
+
+def _usernames_inexistentes(cur, usernames):
+    cur.execute("SELECT username FROM usuarios WHERE username = ANY(%s)", (list(usernames),))
+    existentes = {fila[0] for fila in cur.fetchall()}
+    return [u for u in usernames if u not in existentes]
+
+def create_users_bulk(usuarios):
+    """Crea usuarios a partir de tuplas (username, password_hash, role, full_name)."""
+    with conexion() as conn:
+        if not conn:
+            return False, "No hay conexión a la base de datos."
+        try:
+            with conn.cursor() as cur:
+                usernames = [u[0] for u in usuarios]
+                repetidos = sorted(set(usernames) - set(_usernames_inexistentes(cur, usernames)))
+                if repetidos:
+                    conn.rollback()
+                    return False, f"Ya existen {len(repetidos)} usuarios: {', '.join(repetidos[:10])}"
+                execute_values(cur, "INSERT INTO usuarios (username, password_hash, role, full_name) VALUES %s",
+                               usuarios, page_size=1000)
+            conn.commit()
+            return True, f"{len(usuarios)} usuarios creados."
+        except psycopg2.IntegrityError:
+            # Alguien creó uno de esos usuarios entre la comprobación y el INSERT
+            conn.rollback()
+            return False, "Alguno de los usuarios ya existe."
+
+def update_user_roles_bulk(cambios):
+    """Cambia el rol de varios usuarios a partir de tuplas (username, role)."""
+    with conexion() as conn:
+        if not conn:
+            return False, "No hay conexión a la base de datos."
+        try:
+            with conn.cursor() as cur:
+                faltan = _usernames_inexistentes(cur, [c[0] for c in cambios])
+                if faltan:
+                    conn.rollback()
+                    return False, f"No existen {len(faltan)} usuarios: {', '.join(faltan[:10])}"
+                execute_values(cur, """
+                    UPDATE usuarios SET role = v.role
+                    FROM (VALUES %s) AS v(username, role)
+                    WHERE usuarios.username = v.username
+                """, cambios, page_size=1000)
+            conn.commit()
+            return True, f"Rol actualizado para {len(cambios)} usuarios."
+        except Exception as e:
+            conn.rollback()
+            return False, f"Error al actualizar roles: {e}"
+
+def unlock_users_bulk(usernames):
+    """Desbloquea varios usuarios y reinicia sus intentos fallidos."""
+    with conexion() as conn:
+        if not conn:
+            return False, "No hay conexión a la base de datos."
+        try:
+            with conn.cursor() as cur:
+                faltan = _usernames_inexistentes(cur, usernames)
+                if faltan:
+                    conn.rollback()
+                    return False, f"No existen {len(faltan)} usuarios: {', '.join(faltan[:10])}"
+                cur.execute("UPDATE usuarios SET is_locked = FALSE, failed_attempts = 0 WHERE username = ANY(%s)",
+                            (list(usernames),))
+            conn.commit()
+            return True, f"{len(usernames)} usuarios desbloqueados."
+        except Exception as e:
+            conn.rollback()
+            return False, f"Error al desbloquear usuarios: {e}"
 
 # --- FUNCIONES DE ÁREAS Y TEMPLATES ---
 
+class CacheTTL:
+    """
+    Caché de lectura compartida por todas las sesiones del proceso.
+
+    Cada valor caduca a los `ttl` segundos; las funciones que escriben
+    invalidan además sus claves en el acto. Otros procesos ven el cambio
+    cuando caduca su copia. Los valores se entregan como copias para que
+    nadie modifique la versión compartida.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.aciertos = 0
+        self.fallos = 0
+        self._datos = {}
+        self._lock = threading.Lock()
+
+    def obtener(self, clave, calcular):
+        """Valor de `clave`; si no está o caducó, lo lee con `calcular()` (None no se guarda)."""
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is not None and entrada[0] > ahora:
+                self.aciertos += 1
+                return copy.deepcopy(entrada[1])
+            self.fallos += 1
+        valor = calcular()
+        if valor is not None:
+            with self._lock:
+                self._datos[clave] = (ahora + self.ttl, valor)
+        return copy.deepcopy(valor)
+
+    def invalidar(self, *claves):
+        with self._lock:
+            for clave in claves:
+                self._datos.pop(clave, None)
+
+    def vaciar(self):
+        with self._lock:
+            self._datos.clear()
+
+    def estadisticas(self):
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {"aciertos": self.aciertos, "fallos": self.fallos, "entradas": len(self._datos),
+                    "tasa_aciertos": self.aciertos / total if total else 0.0}
+
+# Áreas, plantillas por área y estructuras: cambian muy de vez en cuando
+cache_catalogos = CacheTTL(ttl=float(_configuracion("CACHE_CATALOGOS_TTL", 300)))
+
 def create_area(area_name, description):
-    conn = get_db_connection()
-    if not conn:
-        return False, "No hay conexión a la base de datos."
-    try:
+    with conexion() as conn:
+        if not conn:
+            return False, "No hay conexión a la base de datos."
+        try:
+            with conn.cursor() as cur:
+                cur.execute("INSERT INTO form_areas (area_name, description) VALUES (%s, %s)", (area_name, description))
+            conn.commit()
+            cache_catalogos.invalidar(("areas",))
+            return True, "Área creada."
+        except psycopg2.IntegrityError:
+            conn.rollback()
+            return False, "El nombre de área ya existe."
+
+def _leer_areas():
+    with conexion() as conn:
+        if not conn:
+            return None
         with conn.cursor() as cur:
-            cur.execute("INSERT INTO form_areas (area_name, description) VALUES (%s, %s)", (area_name, description))
-        conn.commit()
-        return True, "Área creada."
-    except psycopg2.IntegrityError:
-        conn.rollback()
-        return False, "El nombre de área ya existe."
-    # Sin conn.close()
+            cur.execute("SELECT id, area_name, description FROM form_areas ORDER BY area_name")
+            data = [{"id": a[0], "name": a[1], "description": a[2]} for a in cur.fetchall()]
+        return data
 
 def get_all_areas():
-    conn = get_db_connection()
-    if not conn:
-        return []
-    with conn.cursor() as cur:
-        cur.execute("SELECT id, area_name, description FROM form_areas ORDER BY area_name")
-        data = [{"id": a[0], "name": a[1], "description": a[2]} for a in cur.fetchall()]
-    return data
+    return cache_catalogos.obtener(("areas",), _leer_areas) or []
 
 def save_form_template(name, structure, user_id, area_id):
-    conn = get_db_connection()
-    if not conn:
-        raise RuntimeError("No hay conexión a la base de datos.")
-    try:
+    with conexion() as conn:
+        if not conn:
+            raise RuntimeError("No hay conexión a la base de datos.")
+        try:
+            with conn.cursor() as cur:
+                cur.execute("INSERT INTO form_templates (name, structure, created_by_user_id, area_id) VALUES (%s, %s, %s, %s)",
+                            (name, json.dumps(structure), user_id, area_id))
+            conn.commit()
+            cache_catalogos.invalidar(("plantillas", area_id))
+        except Exception as e:
+            conn.rollback()
+            raise e
+
+def _leer_plantillas(area_id):
+    with conexion() as conn:
+        if not conn:
+            return None
         with conn.cursor() as cur:
-            cur.execute("INSERT INTO form_templates (name, structure, created_by_user_id, area_id) VALUES (%s, %s, %s, %s)",
-                        (name, json.dumps(structure), user_id, area_id))
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    # Sin conn.close()
+            cur.execute("SELECT id, name FROM form_templates WHERE area_id = %s ORDER BY name", (area_id,))
+            data = [{"id": t[0], "name": t[1]} for t in cur.fetchall()]
+        return data
 
 def get_templates_by_area(area_id):
-    conn = get_db_connection()
-    if not conn:
-        return []
-    with conn.cursor() as cur:
-        cur.execute("SELECT id, name FROM form_templates WHERE area_id = %s ORDER BY name", (area_id,))
-        data = [{"id": t[0], "name": t[1]} for t in cur.fetchall()]
-    return data
+    return cache_catalogos.obtener(("plantillas", area_id), lambda: _leer_plantillas(area_id)) or []
+
+def _leer_estructura(template_id):
+    with conexion() as conn:
+        if not conn:
+            return None
+        with conn.cursor() as cur:
+            ejecutar_sentencia(cur, "estructura_plantilla", (template_id,))
+            res = cur.fetchone()
+        return res[0] if res else None
 
 def get_template_structure(template_id):
-    conn = get_db_connection()
-    if not conn:
-        return None
-    with conn.cursor() as cur:
-        cur.execute("SELECT structure FROM form_templates WHERE id = %s", (template_id,))
-        res = cur.fetchone()
-    return res[0] if res else None
+    return cache_catalogos.obtener(("estructura", template_id), lambda: _leer_estructura(template_id))
 
 # --- FUNCIONES DE ENVÍOS Y DASHBOARD ---
 
 def save_submission(template_id, user_id, data):
-    conn = get_db_connection()
-    if not conn:
-        raise RuntimeError("No hay conexión a la base de datos.")
-    try:
+    with conexion() as conn:
+        if not conn:
+            raise RuntimeError("No hay conexión a la base de datos.")
+        try:
+            with conn.cursor() as cur:
+                ejecutar_sentencia(cur, "insertar_envio", (template_id, user_id, json.dumps(data, default=str)))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+
+def get_submissions_page_by_user(user_id, despues=None, limite=25):
+    """
+    Una página de los envíos de un usuario, del más reciente al más antiguo,
+    sin el contenido (`data`) de cada envío.
+
+    Paginación por clave: `despues` es el cursor (created_at, id) del último
+    envío de la página anterior, así cada página cuesta lo mismo sin importar
+    cuántas haya antes. Devuelve (df, cursor_siguiente); el cursor es None en
+    la última página.
+    """
+    columnas = ["id", "name", "created_at"]
+    with conexion() as conn:
+        if not conn:
+            return pd.DataFrame(columns=columnas), None
         with conn.cursor() as cur:
-            cur.execute("INSERT INTO form_submissions (template_id, user_id, data) VALUES (%s, %s, %s)",
-                        (template_id, user_id, json.dumps(data, default=str)))
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    # Sin conn.close()
-
-def get_submissions_by_user(user_id):
-    conn = get_db_connection()
-    if not conn:
-        return pd.DataFrame(columns=["id", "name", "created_at", "data"])
-    df = pd.read_sql("""
-        SELECT s.id, t.name, s.created_at, s.data FROM form_submissions s 
-        JOIN form_templates t ON s.template_id = t.id WHERE s.user_id = %s ORDER BY s.created_at DESC
-    """, conn, params=(user_id,))
-    return df
+            if despues is None:
+                cur.execute("""
+                    SELECT s.id, t.name, s.created_at FROM form_submissions s
+                    JOIN form_templates t ON s.template_id = t.id
+                    WHERE s.user_id = %s
+                    ORDER BY s.created_at DESC, s.id DESC LIMIT %s
+                """, (user_id, limite + 1))
+            else:
+                cur.execute("""
+                    SELECT s.id, t.name, s.created_at FROM form_submissions s
+                    JOIN form_templates t ON s.template_id = t.id
+                    WHERE s.user_id = %s AND (s.created_at, s.id) < (%s, %s)
+                    ORDER BY s.created_at DESC, s.id DESC LIMIT %s
+                """, (user_id, despues[0], despues[1], limite + 1))
+            filas = cur.fetchall()
+    # Se pide una fila de más solo para saber si hay otra página
+    siguiente = (filas[limite - 1][2], filas[limite - 1][0]) if len(filas) > limite else None
+    return pd.DataFrame(filas[:limite], columns=columnas), siguiente
+
+def get_submission_data(submission_id, user_id):
+    """Contenido de un envío del usuario, o None si no existe o es de otro usuario."""
+    with conexion() as conn:
+        if not conn:
+            return None
+        with conn.cursor() as cur:
+            cur.execute("SELECT data FROM form_submissions WHERE id = %s AND user_id = %s", (submission_id, user_id))
+            res = cur.fetchone()
+        return res[0] if res else None
+
+def get_submission_count_of_user(user_id):
+    """Total de envíos de un usuario, desde el resumen que mantienen los triggers."""
+    with conexion() as conn:
+        if not conn:
+            return 0
+        with conn.cursor() as cur:
+            cur.execute("SELECT total FROM resumen_envios_usuario WHERE user_id = %s", (user_id,))
+            row = cur.fetchone()
+        return int(row[0]) if row else 0
+
+# Los conteos del dashboard se leen de las tablas resumen_envios_*, que
+# mantienen los triggers de la migración 3: cuestan O(áreas + usuarios) y no
+# dependen del número de envíos.
 
 def get_total_submission_count():
-    conn = get_db_connection()
-    if not conn:
-        return 0
-    with conn.cursor() as cur:
-        cur.execute("SELECT COUNT(*) FROM form_submissions")
-        row = cur.fetchone()
-        count = int(row[0]) if row and row[0] is not None else 0
-    return count
+    with conexion() as conn:
+        if not conn:
+            return 0
+        with conn.cursor() as cur:
+            cur.execute("SELECT total FROM resumen_envios_global")
+            row = cur.fetchone()
+            count = int(row[0]) if row and row[0] is not None else 0
+        return count
 
 def get_submission_count_by_area():
-    conn = get_db_connection()
-    if not conn:
-        return pd.DataFrame(columns=["area_name", "submission_count"])
-    df = pd.read_sql("""
-        SELECT a.area_name, COUNT(s.id) as submission_count
-        FROM form_submissions s
-        JOIN form_templates t ON s.template_id = t.id
-        JOIN form_areas a ON t.area_id = a.id
-        GROUP BY a.area_name
-        ORDER BY submission_count DESC
-    """, conn)
-    return df
+    with conexion() as conn:
+        if not conn:
+            return pd.DataFrame(columns=["area_name", "submission_count"])
+        df = pd.read_sql("""
+            SELECT a.area_name, r.total AS submission_count
+            FROM resumen_envios_area r
+            JOIN form_areas a ON r.area_id = a.id
+            WHERE r.total > 0
+            ORDER BY submission_count DESC
+        """, conn)
+        return df
 
 def get_submission_count_by_user():
-    conn = get_db_connection()
-    if not conn:
-        return pd.DataFrame(columns=["full_name", "submission_count"])
-    df = pd.read_sql("""
-        SELECT u.full_name, COUNT(s.id) as submission_count
-        FROM form_submissions s
-        JOIN usuarios u ON s.user_id = u.id
-        GROUP BY u.full_name
-        ORDER BY submission_count DESC
-    """, conn)
-    return df
+    with conexion() as conn:
+        if not conn:
+            return pd.DataFrame(columns=["full_name", "submission_count"])
+        df = pd.read_sql("""
+            SELECT u.full_name, SUM(r.total)::BIGINT AS submission_count
+            FROM resumen_envios_usuario r
+            JOIN usuarios u ON r.user_id = u.id
+            WHERE r.total > 0
+            GROUP BY u.full_name
+            ORDER BY submission_count DESC
+        """, conn)
+        return df
+
+def get_actividad_envios(desde, hasta, por="area", granularidad="day"):
+    """
+    Envíos por periodo ("day" o "week") y por área o usuario entre dos fechas
+    (inclusive). Solo lee `resumen_envios_diario`: la migración 4 consolidó
+    el historial y desde entonces los triggers de `form_submissions` lo
+    mantienen al día.
+    """
+    columnas = ["periodo", "nombre", "envios"]
+    if granularidad not in ("day", "week"):
+        raise ValueError(f"Granularidad no soportada: {granularidad}")
+    if por == "usuario":
+        join_nombre = "JOIN usuarios n ON n.id = r.user_id"
+        nombre = "n.full_name"
+    else:
+        join_nombre = "JOIN form_areas n ON n.id = r.area_id"
+        nombre = "n.area_name"
+    with conexion() as conn:
+        if not conn:
+            return pd.DataFrame(columns=columnas)
+        df = pd.read_sql(f"""
+            SELECT date_trunc(%s, r.dia)::date AS periodo, {nombre} AS nombre, SUM(r.total)::BIGINT AS envios
+            FROM resumen_envios_diario r
+            {join_nombre}
+            WHERE r.dia BETWEEN %s AND %s
+            GROUP BY 1, 2
+            HAVING SUM(r.total) > 0
+            ORDER BY 1, 2
+        """, conn, params=(granularidad, desde, hasta))
+        return df
 
 def get_all_submissions_with_details():
-    conn = get_db_connection()
-    if not conn:
-        return pd.DataFrame(columns=["id", "user_name", "template_name", "area_name", "created_at"])
-    df = pd.read_sql("""
-        SELECT s.id, u.full_name as user_name, t.name as template_name, a.area_name, s.created_at
-        FROM form_submissions s
-        JOIN usuarios u ON s.user_id = u.id
-        JOIN form_templates t ON s.template_id = t.id
-        JOIN form_areas a ON t.area_id = a.id
-        ORDER BY s.created_at DESC
-    """, conn)
-    return df
\ No newline at end of file
+    with conexion() as conn:
+        if not conn:
+            return pd.DataFrame(columns=["id", "user_name", "template_name", "area_name", "created_at"])
+        df = pd.read_sql("""
+            SELECT s.id, u.full_name as user_name, t.name as template_name, a.area_name, s.created_at
+            FROM form_submissions s
+            JOIN usuarios u ON s.user_id = u.id
+            JOIN form_templates t ON s.template_id = t.id
+            JOIN form_areas a ON t.area_id = a.id
+            ORDER BY s.created_at DESC
+        """, conn)
+        return df
+
+def iterar_envios_plantilla(template_id, structure, tamano_bloque=2000):
+    """
+    Recorre los envíos de una plantilla en bloques de `tamano_bloque` filas.
+
+    Usa un cursor con nombre (del lado del servidor), así que nunca hay más
+    de un bloque en memoria. Del JSONB solo se leen los campos de `structure`:
+    de las firmas se trae si existen y de las imágenes solo los nombres de
+    archivo. Cada fila es (id, created_at, username, full_name, valor de cada
+    campo en el orden de `structure`).
+    """
+    with conexion() as conn:
+        if not conn:
+            return
+        columnas = []
+        parametros = []
+        for field in structure:
+            tipo = field.get("Tipo de Campo")
+            if tipo == "Firma":
+                columnas.append("jsonb_typeof(s.data -> %s) = 'array'")
+            elif tipo == "Carga de Imagen":
+                columnas.append("jsonb_path_query_array(s.data -> %s, '$[*].filename')")
+            else:
+                columnas.append("s.data -> %s")
+            parametros.append(field["Etiqueta del Campo"])
+        consulta = f"""
+            SELECT s.id, s.created_at, u.username, u.full_name{''.join(', ' + c for c in columnas)}
+            FROM form_submissions s
+            LEFT JOIN usuarios u ON s.user_id = u.id
+            WHERE s.template_id = %s
+            ORDER BY s.id
+        """
+        # El cursor con nombre vive en una transacción de esta conexión, que
+        # queda prestada hasta que se agota o se cierra el generador
+        with conn.cursor(name=f"exportar_envios_{template_id}") as cur:
+            cur.itersize = tamano_bloque
+            cur.execute(consulta, parametros + [template_id])
+            while True:
+                filas = cur.fetchmany(tamano_bloque)
+                if not filas:
+                    break
+                yield filas
+        conn.commit()
@@ -0,0 +1,212 @@
+"""
+Exportación de tablas a CSV, Excel y Parquet por bloques de filas.
+
+Las funciones reciben un iterable de DataFrames (bloques) en lugar de una
+tabla completa, así que el origen puede ser un DataFrame troceado o un
+cursor de base de datos. Cada bloque se escribe y se descarta antes de pedir
+el siguiente; el resultado va a un archivo temporal que se mantiene en
+memoria hasta LIMITE_MEMORIA bytes y pasa a disco a partir de ahí.
+"""
+import json
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+try:
+    import xlsxwriter
+except Exception:
+    # Sin xlsxwriter solo se ofrece la exportación a CSV
+    xlsxwriter = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except Exception:
+    # Sin pyarrow no se ofrece la exportación a Parquet
+    pa = None
+    pq = None
+
+TAMANO_BLOQUE = 5000
+LIMITE_MEMORIA = 8 * 1024 * 1024
+
+MIME_CSV = "text/csv"
+MIME_EXCEL = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+MIME_PARQUET = "application/vnd.apache.parquet"
+
+# Columnas fijas de cada envío exportado y su tipo
+COLUMNAS_ENVIO = (("id_envio", "entero"), ("fecha_envio", "fecha_hora"), ("usuario", "texto"), ("nombre_usuario", "texto"))
+
+
+def bloques_de(df, posiciones=None, tamano=TAMANO_BLOQUE):
+    """Trocea `df` (o solo sus filas `posiciones`) en bloques de `tamano` filas."""
+    if posiciones is None:
+        posiciones = np.arange(len(df))
+    for inicio in range(0, len(posiciones), tamano):
+        yield df.iloc[posiciones[inicio:inicio + tamano]]
+
+
+def _archivo_temporal():
+    return tempfile.SpooledTemporaryFile(max_size=LIMITE_MEMORIA)
+
+
+def csv_por_bloques(bloques, columnas=None, destino=None):
+    """Escribe los bloques como un único CSV UTF-8 y devuelve el archivo, al inicio.
+
+    Si no llega ningún bloque se escribe solo la cabecera con `columnas`.
+    """
+    destino = destino if destino is not None else _archivo_temporal()
+    cabecera = True
+    for bloque in bloques:
+        destino.write(bloque.to_csv(index=False, header=cabecera).encode("utf-8"))
+        cabecera = False
+    if cabecera and columnas is not None:
+        destino.write(pd.DataFrame(columns=list(columnas)).to_csv(index=False).encode("utf-8"))
+    destino.seek(0)
+    return destino
+
+
+def _celda(valor):
+    if isinstance(valor, np.generic):
+        valor = valor.item()
+    if valor is None:
+        return None
+    try:
+        if pd.isna(valor):
+            return None
+    except (TypeError, ValueError):
+        return str(valor)
+    if isinstance(valor, (str, int, float, bool)):
+        return valor
+    return str(valor)
+
+
+def excel_por_bloques(bloques, columnas=None, hoja="Datos", destino=None):
+    """Escribe los bloques en una hoja de Excel y devuelve el archivo, al inicio.
+
+    Usa el modo `constant_memory` de xlsxwriter: cada fila se vuelca a disco
+    al pasar a la siguiente, así que la memoria no crece con el número de filas.
+    """
+    if xlsxwriter is None:
+        raise RuntimeError("La exportación a Excel requiere el paquete 'xlsxwriter'.")
+    destino = destino if destino is not None else _archivo_temporal()
+    libro = xlsxwriter.Workbook(destino, {"constant_memory": True})
+    try:
+        hoja_excel = libro.add_worksheet(hoja)
+        fila_actual = 0
+        if columnas is not None:
+            hoja_excel.write_row(0, 0, [str(c) for c in columnas])
+            fila_actual = 1
+        for bloque in bloques:
+            if fila_actual == 0:
+                hoja_excel.write_row(0, 0, [str(c) for c in bloque.columns])
+                fila_actual = 1
+            for fila in bloque.itertuples(index=False, name=None):
+                hoja_excel.write_row(fila_actual, 0, [_celda(v) for v in fila])
+                fila_actual += 1
+    finally:
+        libro.close()
+    destino.seek(0)
+    return destino
+
+
+def parquet_por_bloques(bloques, tipos, destino=None):
+    """Escribe los bloques en un Parquet (un row group por bloque) y devuelve el archivo.
+
+    `tipos` es una lista de (columna, tipo) con tipo "texto", "entero",
+    "numero", "booleano" o "fecha_hora"; fija el esquema de antemano para que
+    no dependa de los valores (p. ej. nulos) del primer bloque.
+    """
+    if pa is None:
+        raise RuntimeError("La exportación a Parquet requiere el paquete 'pyarrow'.")
+    tipos_arrow = {"texto": pa.string(), "entero": pa.int64(), "numero": pa.float64(),
+                   "booleano": pa.bool_(), "fecha_hora": pa.timestamp("us")}
+    esquema = pa.schema([(columna, tipos_arrow[tipo]) for columna, tipo in tipos])
+    destino = destino if destino is not None else _archivo_temporal()
+    with pq.ParquetWriter(destino, esquema) as escritor:
+        for bloque in bloques:
+            escritor.write_table(pa.Table.from_pandas(bloque, schema=esquema, preserve_index=False))
+    destino.seek(0)
+    return destino
+
+
+# --- ENVÍOS DE FORMULARIOS ---
+
+def _columnas_campo(field):
+    etiqueta = field["Etiqueta del Campo"]
+    tipo = field.get("Tipo de Campo")
+    if tipo == "Geolocalización":
+        return [(f"{etiqueta} (latitud)", "numero"), (f"{etiqueta} (longitud)", "numero")]
+    if tipo == "Firma":
+        return [(f"{etiqueta} (firmado)", "booleano")]
+    return [(etiqueta, "texto")]
+
+
+def columnas_envios(structure):
+    """Columnas (nombre, tipo) de la exportación de envíos de una plantilla."""
+    return list(COLUMNAS_ENVIO) + [c for field in structure for c in _columnas_campo(field)]
+
+
+def _texto(valor):
+    if valor is None or isinstance(valor, str):
+        return valor
+    return json.dumps(valor, ensure_ascii=False, default=str)
+
+
+def _numero(valor):
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _valores_campo(field, valor):
+    tipo = field.get("Tipo de Campo")
+    if tipo == "Geolocalización":
+        if isinstance(valor, dict):
+            return [_numero(valor.get("lat")), _numero(valor.get("lng"))]
+        return [None, None]
+    if tipo == "Firma":
+        return [bool(valor)]
+    if tipo == "Carga de Imagen" and isinstance(valor, list):
+        return [", ".join(str(n) for n in valor if n) or None]
+    return [_texto(valor)]
+
+
+def aplanar_envios(filas, structure):
+    """DataFrame de un bloque de envíos con una o más columnas por campo.
+
+    `filas` son las tuplas de `database.iterar_envios_plantilla`. Las
+    ubicaciones se separan en latitud y longitud, las firmas se reducen a si
+    existen, las imágenes a sus nombres de archivo y cualquier otro valor
+    que no sea texto (p. ej. tablas) se guarda como JSON.
+    """
+    datos = []
+    for fila in filas:
+        valores = list(fila[:4])
+        for field, valor in zip(structure, fila[4:]):
+            valores.extend(_valores_campo(field, valor))
+        datos.append(valores)
+    return pd.DataFrame(datos, columns=[c for c, _ in columnas_envios(structure)])
+
+
+def exportar_envios(template_id, formato="csv", tamano_bloque=2000):
+    """Bytes de un CSV o Parquet con todos los envíos de una plantilla.
+
+    Los envíos se leen por bloques con un cursor de servidor y cada bloque se
+    aplana y se escribe antes de leer el siguiente, así que la memoria de la
+    consulta no depende del número de envíos; el archivo temporal solo se
+    lee entero al final, para entregarlo a la descarga.
+    """
+    import database
+
+    structure = database.get_template_structure(template_id) or []
+    tipos = columnas_envios(structure)
+    bloques = (aplanar_envios(filas, structure)
+               for filas in database.iterar_envios_plantilla(template_id, structure, tamano_bloque))
+    if formato == "parquet":
+        archivo = parquet_por_bloques(bloques, tipos)
+    else:
+        archivo = csv_por_bloques(bloques, [c for c, _ in tipos])
+    with archivo:
+        return archivo.read()
@@ -65,9 +65,12 @@ except SyntaxError as e:
 def run_init():
     try:
         print("\nConectando a la base de datos...")
-        # La conexión se prueba aquí al crear las tablas
-        database.create_tables()
-        print("✅ ¡Conexión exitosa y tablas creadas!")
+        # La conexión se prueba aquí al aplicar las migraciones del esquema
+        import migraciones
+        version = migraciones.aplicar_migraciones()
+        if version is None:
+            raise psycopg2.OperationalError("no se pudo obtener una conexión (ver el aviso anterior)")
+        print(f"✅ ¡Conexión exitosa! Esquema en la versión {version}.")
     
     except psycopg2.OperationalError as e:
         print("="*50)
@@ -0,0 +1,362 @@
+"""
+Migraciones versionadas del esquema de la base de datos.
+
+Cada migración es una función que recibe un cursor y se aplica una sola vez,
+en orden y en su propia transacción. La última versión aplicada se guarda en
+la tabla `schema_version`. Para cambiar el esquema se añade una migración al
+final de MIGRACIONES; las ya publicadas no se modifican.
+
+Uso:
+    python migraciones.py      # aplica las migraciones pendientes (requiere DB_URL)
+"""
+import database
+
+# Clave del bloqueo consultivo que impide aplicar migraciones en paralelo
+_CLAVE_BLOQUEO = 741_852_963
+
+
+def _m001_esquema_base(cur):
+    """Tablas de la aplicación, en orden de dependencias y sin borrar datos."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(50) UNIQUE NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            role VARCHAR(20) NOT NULL CHECK (role IN ('admin', 'operador')),
+            full_name VARCHAR(100),
+            failed_attempts INTEGER DEFAULT 0,
+            is_locked BOOLEAN DEFAULT FALSE
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS centros (
+            id SERIAL PRIMARY KEY,
+            codigo VARCHAR(20) UNIQUE,
+            nombre VARCHAR(255) NOT NULL,
+            provincia VARCHAR(100),
+            otros_campos JSONB
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS auditoria (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES usuarios(id),
+            accion VARCHAR(100) NOT NULL,
+            detalle TEXT,
+            fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS form_areas (
+            id SERIAL PRIMARY KEY,
+            area_name VARCHAR(100) UNIQUE NOT NULL,
+            description TEXT
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS form_templates (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            structure JSONB NOT NULL,
+            created_by_user_id INTEGER REFERENCES usuarios(id),
+            area_id INTEGER REFERENCES form_areas(id)
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS form_submissions (
+            id SERIAL PRIMARY KEY,
+            template_id INTEGER REFERENCES form_templates(id),
+            user_id INTEGER REFERENCES usuarios(id),
+            data JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+
+
+def _m002_indices_consultas(cur):
+    """Índices de las consultas frecuentes de envíos, auditoría y plantillas."""
+    # Mis Envíos: WHERE user_id = ? ORDER BY created_at DESC
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_submissions_user_fecha ON form_submissions (user_id, created_at DESC);")
+    # Exportación y joins por plantilla
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_submissions_template ON form_submissions (template_id);")
+    # Revisión de Envíos: ORDER BY created_at DESC
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_submissions_fecha ON form_submissions (created_at DESC);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_auditoria_fecha ON auditoria (fecha DESC);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_templates_area ON form_templates (area_id, name);")
+
+
+def _sql_resumen_envios(funcion, tabla, signo):
+    """Función de trigger que suma (`signo` = +1) o resta (-1) las filas de la tabla de transición."""
+    return f"""
+        CREATE OR REPLACE FUNCTION {funcion}() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO resumen_envios_global (id, total)
+                SELECT TRUE, {signo} * COUNT(*) FROM {tabla} HAVING COUNT(*) > 0
+            ON CONFLICT (id) DO UPDATE SET total = resumen_envios_global.total + EXCLUDED.total;
+            INSERT INTO resumen_envios_area (area_id, total)
+                SELECT t.area_id, {signo} * COUNT(*)
+                FROM {tabla} x JOIN form_templates t ON t.id = x.template_id
+                WHERE t.area_id IS NOT NULL
+                GROUP BY t.area_id
+            ON CONFLICT (area_id) DO UPDATE SET total = resumen_envios_area.total + EXCLUDED.total;
+            INSERT INTO resumen_envios_usuario (user_id, total)
+                SELECT x.user_id, {signo} * COUNT(*) FROM {tabla} x
+                WHERE x.user_id IS NOT NULL
+                GROUP BY x.user_id
+            ON CONFLICT (user_id) DO UPDATE SET total = resumen_envios_usuario.total + EXCLUDED.total;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """
+
+
+def _m003_resumen_envios(cur):
+    """Conteos de envíos (global, por área y por usuario) mantenidos por triggers.
+
+    Los triggers son por sentencia y usan tablas de transición, así que una
+    inserción masiva actualiza cada resumen una vez y no una vez por fila.
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS resumen_envios_global (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            total BIGINT NOT NULL DEFAULT 0
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS resumen_envios_area (
+            area_id INTEGER PRIMARY KEY REFERENCES form_areas(id) ON DELETE CASCADE,
+            total BIGINT NOT NULL DEFAULT 0
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS resumen_envios_usuario (
+            user_id INTEGER PRIMARY KEY REFERENCES usuarios(id) ON DELETE CASCADE,
+            total BIGINT NOT NULL DEFAULT 0
+        );
+    """)
+    cur.execute(_sql_resumen_envios("resumen_envios_sumar", "nuevas", 1))
+    cur.execute(_sql_resumen_envios("resumen_envios_restar", "viejas", -1))
+    # Mover los conteos si una plantilla cambia de área
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION resumen_envios_cambio_area() RETURNS trigger AS $$
+        DECLARE
+            n BIGINT;
+        BEGIN
+            IF NEW.area_id IS DISTINCT FROM OLD.area_id THEN
+                SELECT COUNT(*) INTO n FROM form_submissions WHERE template_id = NEW.id;
+                IF n > 0 THEN
+                    UPDATE resumen_envios_area SET total = total - n WHERE area_id = OLD.area_id;
+                    IF NEW.area_id IS NOT NULL THEN
+                        INSERT INTO resumen_envios_area (area_id, total) VALUES (NEW.area_id, n)
+                        ON CONFLICT (area_id) DO UPDATE SET total = resumen_envios_area.total + EXCLUDED.total;
+                    END IF;
+                END IF;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    # Impedir envíos nuevos mientras se cargan los conteos iniciales
+    cur.execute("LOCK TABLE form_submissions IN SHARE ROW EXCLUSIVE MODE;")
+    for trigger in ("trg_resumen_envios_insert", "trg_resumen_envios_delete",
+                    "trg_resumen_envios_update_old", "trg_resumen_envios_update_new"):
+        cur.execute(f"DROP TRIGGER IF EXISTS {trigger} ON form_submissions;")
+    cur.execute("""
+        CREATE TRIGGER trg_resumen_envios_insert AFTER INSERT ON form_submissions
+        REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION resumen_envios_sumar();
+    """)
+    cur.execute("""
+        CREATE TRIGGER trg_resumen_envios_delete AFTER DELETE ON form_submissions
+        REFERENCING OLD TABLE AS viejas FOR EACH STATEMENT EXECUTE FUNCTION resumen_envios_restar();
+    """)
+    cur.execute("""
+        CREATE TRIGGER trg_resumen_envios_update_old AFTER UPDATE ON form_submissions
+        REFERENCING OLD TABLE AS viejas FOR EACH STATEMENT EXECUTE FUNCTION resumen_envios_restar();
+    """)
+    cur.execute("""
+        CREATE TRIGGER trg_resumen_envios_update_new AFTER UPDATE ON form_submissions
+        REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION resumen_envios_sumar();
+    """)
+    cur.execute("DROP TRIGGER IF EXISTS trg_resumen_envios_area ON form_templates;")
+    cur.execute("""
+        CREATE TRIGGER trg_resumen_envios_area AFTER UPDATE OF area_id ON form_templates
+        FOR EACH ROW EXECUTE FUNCTION resumen_envios_cambio_area();
+    """)
+
+    cur.execute("TRUNCATE resumen_envios_global, resumen_envios_area, resumen_envios_usuario;")
+    cur.execute("INSERT INTO resumen_envios_global (id, total) SELECT TRUE, COUNT(*) FROM form_submissions;")
+    cur.execute("""
+        INSERT INTO resumen_envios_area (area_id, total)
+        SELECT t.area_id, COUNT(*) FROM form_submissions s JOIN form_templates t ON t.id = s.template_id
+        WHERE t.area_id IS NOT NULL GROUP BY t.area_id;
+    """)
+    cur.execute("""
+        INSERT INTO resumen_envios_usuario (user_id, total)
+        SELECT user_id, COUNT(*) FROM form_submissions WHERE user_id IS NOT NULL GROUP BY user_id;
+    """)
+
+
+def _sql_resumen_diario(funcion, tabla, signo):
+    """Función de trigger que suma o resta las filas de la tabla de transición por día."""
+    return f"""
+        CREATE OR REPLACE FUNCTION {funcion}() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO resumen_envios_diario (dia, area_id, user_id, total)
+                SELECT x.created_at::date, t.area_id, x.user_id, {signo} * COUNT(*)
+                FROM {tabla} x JOIN form_templates t ON t.id = x.template_id
+                WHERE t.area_id IS NOT NULL AND x.user_id IS NOT NULL AND x.created_at IS NOT NULL
+                GROUP BY 1, 2, 3
+            ON CONFLICT (dia, area_id, user_id) DO UPDATE SET total = resumen_envios_diario.total + EXCLUDED.total;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """
+
+
+def _m004_resumen_diario(cur):
+    """Envíos por día, área y usuario para las gráficas de actividad.
+
+    Se carga una vez con el historial existente; desde entonces los triggers
+    de `form_submissions` y `form_templates` lo mantienen al día.
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS resumen_envios_diario (
+            dia DATE NOT NULL,
+            area_id INTEGER NOT NULL REFERENCES form_areas(id) ON DELETE CASCADE,
+            user_id INTEGER NOT NULL REFERENCES usuarios(id) ON DELETE CASCADE,
+            total BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (dia, area_id, user_id)
+        );
+    """)
+    cur.execute(_sql_resumen_diario("resumen_diario_sumar", "nuevas", 1))
+    cur.execute(_sql_resumen_diario("resumen_diario_restar", "viejas", -1))
+    # Mover los conteos diarios si una plantilla cambia de área
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION resumen_diario_cambio_area() RETURNS trigger AS $$
+        BEGIN
+            IF NEW.area_id IS DISTINCT FROM OLD.area_id THEN
+                INSERT INTO resumen_envios_diario (dia, area_id, user_id, total)
+                    SELECT s.created_at::date, a.area_id, s.user_id, a.signo * COUNT(*)
+                    FROM form_submissions s
+                    CROSS JOIN (VALUES (OLD.area_id, -1), (NEW.area_id, 1)) AS a (area_id, signo)
+                    WHERE s.template_id = NEW.id AND a.area_id IS NOT NULL
+                      AND s.user_id IS NOT NULL AND s.created_at IS NOT NULL
+                    GROUP BY 1, 2, 3, a.signo
+                ON CONFLICT (dia, area_id, user_id) DO UPDATE SET total = resumen_envios_diario.total + EXCLUDED.total;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    # Impedir envíos nuevos mientras se carga el historial
+    cur.execute("LOCK TABLE form_submissions IN SHARE ROW EXCLUSIVE MODE;")
+    for trigger in ("trg_resumen_diario_insert", "trg_resumen_diario_delete",
+                    "trg_resumen_diario_update_old", "trg_resumen_diario_update_new"):
+        cur.execute(f"DROP TRIGGER IF EXISTS {trigger} ON form_submissions;")
+    cur.execute("""
+        CREATE TRIGGER trg_resumen_diario_insert AFTER INSERT ON form_submissions
+        REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION resumen_diario_sumar();
+    """)
+    cur.execute("""
+        CREATE TRIGGER trg_resumen_diario_delete AFTER DELETE ON form_submissions
+        REFERENCING OLD TABLE AS viejas FOR EACH STATEMENT EXECUTE FUNCTION resumen_diario_restar();
+    """)
+    cur.execute("""
+        CREATE TRIGGER trg_resumen_diario_update_old AFTER UPDATE ON form_submissions
+        REFERENCING OLD TABLE AS viejas FOR EACH STATEMENT EXECUTE FUNCTION resumen_diario_restar();
+    """)
+    cur.execute("""
+        CREATE TRIGGER trg_resumen_diario_update_new AFTER UPDATE ON form_submissions
+        REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION resumen_diario_sumar();
+    """)
+    cur.execute("DROP TRIGGER IF EXISTS trg_resumen_diario_area ON form_templates;")
+    cur.execute("""
+        CREATE TRIGGER trg_resumen_diario_area AFTER UPDATE OF area_id ON form_templates
+        FOR EACH ROW EXECUTE FUNCTION resumen_diario_cambio_area();
+    """)
+
+    cur.execute("TRUNCATE resumen_envios_diario;")
+    cur.execute("""
+        INSERT INTO resumen_envios_diario (dia, area_id, user_id, total)
+        SELECT s.created_at::date, t.area_id, s.user_id, COUNT(*)
+        FROM form_submissions s JOIN form_templates t ON t.id = s.template_id
+        WHERE t.area_id IS NOT NULL AND s.user_id IS NOT NULL AND s.created_at IS NOT NULL
+        GROUP BY 1, 2, 3;
+    """)
+
+
+def _m005_indice_mis_envios(cur):
+    """Índice de la paginación por clave de Mis Envíos."""
+    # WHERE user_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_submissions_user_fecha_id ON form_submissions (user_id, created_at DESC, id DESC);")
+    # Lo cubre el índice nuevo
+    cur.execute("DROP INDEX IF EXISTS idx_submissions_user_fecha;")
+
+
+# (versión, descripción, función). Las versiones son consecutivas.
+MIGRACIONES = [
+    (1, "Esquema base", _m001_esquema_base),
+    (2, "Índices de envíos, auditoría y plantillas", _m002_indices_consultas),
+    (3, "Resúmenes de envíos para el dashboard", _m003_resumen_envios),
+    (4, "Resumen diario de envíos", _m004_resumen_diario),
+    (5, "Índice de Mis Envíos por fecha e id", _m005_indice_mis_envios),
+]
+
+
+def version_actual(cur):
+    """Última versión registrada en `schema_version` (0 si no hay ninguna)."""
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cur.fetchone()[0]
+
+
+def aplicar_migraciones():
+    """
+    Aplica las migraciones pendientes y devuelve la versión resultante.
+
+    Devuelve None si no hay conexión. Si una migración falla se revierte
+    solo esa migración y se relanza el error; las anteriores quedan aplicadas.
+    """
+    with database.conexion() as conn:
+        if not conn:
+            print("⚠️ Omisión de migraciones: no hay conexión a la BD (DB_URL no configurada).")
+            return None
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    descripcion TEXT NOT NULL,
+                    aplicada_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+            cur.execute("SELECT pg_advisory_lock(%s)", (_CLAVE_BLOQUEO,))
+        conn.commit()
+        try:
+            with conn.cursor() as cur:
+                version = version_actual(cur)
+            conn.commit()
+            for numero, descripcion, migracion in MIGRACIONES:
+                if numero <= version:
+                    continue
+                try:
+                    with conn.cursor() as cur:
+                        migracion(cur)
+                        cur.execute("INSERT INTO schema_version (version, descripcion) VALUES (%s, %s)", (numero, descripcion))
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    print(f"❌ Error en la migración {numero} ({descripcion}): {e}")
+                    raise
+                version = numero
+                print(f"✅ Migración {numero} aplicada: {descripcion}")
+            return version
+        finally:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (_CLAVE_BLOQUEO,))
+            conn.commit()
+
+
+if __name__ == "__main__":
+    version = aplicar_migraciones()
+    if version is not None:
+        print(f"Esquema en la versión {version}.")
@@ -3,6 +3,11 @@ import pandas as pd
 import database
 import json
 import base64
+import io
+import numpy as np
+import hashlib
+from collections import namedtuple
+from centros_catalog import CacheLRU
 import streamlit.components.v1 as components
 from typing import Any, NoReturn
 try:
@@ -107,37 +112,83 @@ CSV_TO_FORM_MAP = {
     "CODSABER": "Código Saber"
 }
 
-def _render_form_from_structure(structure):
+# Mapa inverso: etiqueta del formulario -> columna del CSV
+FORM_TO_CSV_MAP = {v: k for k, v in CSV_TO_FORM_MAP.items()}
+
+# Plan de dibujo de una plantilla: se calcula una vez por estructura y no cambia
+CampoPlan = namedtuple("CampoPlan", "etiqueta tipo requerido clave etiqueta_visible columna_centro")
+PlanFormulario = namedtuple("PlanFormulario", "campos requeridos prefill geolocalizaciones")
+
+_planes = CacheLRU(64)
+
+MIS_ENVIOS_POR_PAGINA = 25
+
+
+def _clave_campo(label):
+    """Clave de session_state del widget de un campo."""
+    return f"form_field_{label.replace(' ', '_')}"
+
+
+def _compilar_plan(structure):
+    campos = []
+    for field in structure:
+        label = field["Etiqueta del Campo"]
+        required = bool(field.get("Requerido", False))
+        campos.append(CampoPlan(
+            etiqueta=label,
+            tipo=field.get("Tipo de Campo"),
+            requerido=required,
+            clave=_clave_campo(label),
+            # Indicador visual para los campos requeridos
+            etiqueta_visible=f"{label}*" if required else label,
+            columna_centro=FORM_TO_CSV_MAP.get(label),
+        ))
+    campos = tuple(campos)
+    return PlanFormulario(
+        campos=campos,
+        requeridos=tuple(c.etiqueta for c in campos if c.requerido),
+        prefill=tuple((c.etiqueta, c.columna_centro) for c in campos if c.columna_centro),
+        geolocalizaciones=tuple(c for c in campos if c.tipo == "Geolocalización"),
+    )
+
+
+def _plan_formulario(structure, template_id=None):
+    """Plan de dibujo de `structure`, guardado por id de plantilla y hash de la estructura."""
+    huella = hashlib.sha1(json.dumps(structure, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return _planes.obtener((template_id, huella), lambda: _compilar_plan(structure))
+
+
+def _valor_centro(centro_dict, columna):
+    """Valor de `columna` en el centro adjunto, sin distinguir mayúsculas si no está tal cual."""
+    if columna in centro_dict:
+        return centro_dict[columna]
+    for k, v in centro_dict.items():
+        if str(k).upper() == columna:
+            return v
+    return None
+
+
+def _render_form_from_structure(structure, template_id=None):
     """Función interna para dibujar el formulario dinámico."""
+    plan = _plan_formulario(structure, template_id)
     form_data = {}
     
     # --- LÓGICA DE PRE-LLENADO ---
     prefill_data = {}
-    if "centro_adjunto" in st.session_state and st.session_state.centro_adjunto:
-        # Invertir el mapa para buscar fácilmente por la etiqueta del formulario
-        FORM_TO_CSV_MAP = {v: k for k, v in CSV_TO_FORM_MAP.items()}
-
-        # Normalizar claves del centro adjunto para evitar problemas de mayúsculas/minúsculas
-        centro_dict = {str(k).upper(): v for k, v in st.session_state.centro_adjunto.items()}
-
-        for form_label, csv_col in FORM_TO_CSV_MAP.items():
-            # csv_col viene en mayúsculas en el mapeo
-            if csv_col and str(csv_col).upper() in centro_dict:
-                prefill_data[form_label] = centro_dict[str(csv_col).upper()]
+    centro_adjunto = st.session_state.get("centro_adjunto")
+    if centro_adjunto:
+        for form_label, csv_col in plan.prefill:
+            prefill_data[form_label] = _valor_centro(centro_adjunto, csv_col)
     # --- FIN LÓGICA PRE-LLENADO ---
 
-    for field in structure:
-        label = field["Etiqueta del Campo"]
-        field_type = field["Tipo de Campo"]
-        required = field["Requerido"]
-        
-        field_key = f"form_field_{label.replace(' ', '_')}" # Clave única
+    for campo in plan.campos:
+        label = campo.etiqueta
+        field_type = campo.tipo
+        field_key = campo.clave
+        display_label = campo.etiqueta_visible
         
         # Obtener el valor por defecto del diccionario prefill_data
         default_value = prefill_data.get(label, None)
-        
-        # Add a visual indicator for required fields
-        display_label = f"{label}*" if required else label
 
         if field_type == "Texto":
             form_data[label] = st.text_input(display_label, value=default_value, key=field_key)
@@ -271,18 +322,84 @@ def _render_form_from_structure(structure):
                 
     return form_data
 
-def _validate_form(form_data, structure):
+def _adjuntar_centro(centro_dict, sobrescribir=False):
+    """Adjunta un centro y pre-carga en session_state los campos del formulario que coincidan.
+
+    Con `sobrescribir=False` no se pisan valores que el usuario ya haya escrito.
+    """
+    st.session_state.centro_adjunto = centro_dict
+    # Intentar poblar automáticamente los keys del formulario en session_state
+    try:
+        # Mapa auxiliar de claves del centro en mayúsculas -> original
+        centro_keys_upper = {str(k).upper(): k for k in centro_dict.keys()}
+        for form_label, csv_col in FORM_TO_CSV_MAP.items():
+            if not csv_col:
+                continue
+            try:
+                csv_col_upper = str(csv_col).upper()
+                if csv_col_upper in centro_keys_upper:
+                    orig_key = centro_keys_upper[csv_col_upper]
+                    val = centro_dict.get(orig_key)
+                    if val is not None:
+                        sess_key = _clave_campo(form_label)
+                        if sobrescribir or sess_key not in st.session_state:
+                            st.session_state[sess_key] = val
+            except Exception:
+                continue
+    except Exception:
+        pass
+
+
+def _mostrar_centros_cercanos(catalogo, ubicacion, field_key, k=5):
+    """Sugiere los `k` centros más cercanos a una ubicación, con botón para adjuntar cada uno."""
+    try:
+        posiciones, distancias = catalogo.centros_cercanos(float(ubicacion['lat']), float(ubicacion['lng']), k)
+    except Exception:
+        return
+    if len(posiciones) == 0:
+        return
+    st.caption("🏫 Centros más cercanos a esta ubicación:")
+    for pos, dist in zip(posiciones, distancias):
+        fila = catalogo.df.iloc[pos]
+        col_nombre, col_boton = st.columns([4, 1])
+        with col_nombre:
+            st.write(f"**{fila['CENTRO_EDUCATIVO']}** — {fila.get('DISTRITO', '')}, {fila.get('CANTON', '')} ({dist:.2f} km)")
+        with col_boton:
+            if st.button("📎 Adjuntar", key=f"btn_adjuntar_cercano_{field_key}_{pos}", use_container_width=True):
+                # Los campos del formulario ya se dibujaron en esta ejecución y no se
+                # pueden modificar: se adjunta al inicio de la siguiente.
+                st.session_state["centro_por_adjuntar"] = fila.to_dict()
+                st.rerun()
+
+
+def _validate_form(form_data, structure, template_id=None):
     """Checks if all required fields are filled."""
-    for field in structure:
-        if field["Requerido"]:
-            label = field["Etiqueta del Campo"]
-            if form_data[label] is None or (isinstance(form_data[label], str) and not form_data[label].strip()):
-                return False, f"El campo '{label}' es requerido."
+    for label in _plan_formulario(structure, template_id).requeridos:
+        if form_data[label] is None or (isinstance(form_data[label], str) and not form_data[label].strip()):
+            return False, f"El campo '{label}' es requerido."
     return True, ""
 
 
-def _build_print_html(form_data, title="Formulario"):
-    """Construye un HTML sencillo con los datos del formulario para impresión."""
+def _es_firma(val):
+    """True si `val` son los píxeles RGBA de un canvas de firma (filas de [r, g, b, a])."""
+    return (isinstance(val, list) and bool(val) and isinstance(val[0], list) and bool(val[0])
+            and isinstance(val[0][0], list) and len(val[0][0]) == 4)
+
+
+def _firma_html(val):
+    """La firma como imagen PNG incrustada, en lugar de sus píxeles en crudo."""
+    try:
+        from PIL import Image
+        buffer = io.BytesIO()
+        Image.fromarray(np.asarray(val, dtype=np.uint8), "RGBA").save(buffer, format="PNG")
+        encoded = base64.b64encode(buffer.getvalue()).decode("utf-8")
+        return f"<img src=\"data:image/png;base64,{encoded}\" style='max-width:400px;border:1px solid #ddd'/>"
+    except Exception:
+        return "<em>(firma)</em>"
+
+
+def _html_envio(form_data, title="Formulario"):
+    """HTML sencillo con los datos de un formulario (sin lanzar la impresión)."""
     parts = [f"<h1>{title}</h1>", "<style>body{font-family:Arial,Helvetica,sans-serif;padding:20px}table{width:100%;border-collapse:collapse}td,th{border:1px solid #ddd;padding:8px;vertical-align:top}th{background:#f4f4f4;text-align:left}</style>"]
     parts.append("<table>")
     for key, val in form_data.items():
@@ -291,6 +408,8 @@ def _build_print_html(form_data, title="Formulario"):
         # Manejar distintos tipos de valor
         if val is None:
             display = "<em>(vacío)</em>"
+        elif _es_firma(val):
+            display = _firma_html(val)
         elif isinstance(val, list):
             # Si es lista de imágenes (diccionarios con base64)
             if val and isinstance(val[0], dict) and 'content_base64' in val[0]:
@@ -342,12 +461,22 @@ def _build_print_html(form_data, title="Formulario"):
         parts.append(f"<td>{display}</td>")
         parts.append("</tr>")
     parts.append("</table>")
-    # Script para lanzar el diálogo de impresión al cargar el iframe
-    parts.append("<script>window.onload=function(){setTimeout(function(){window.print();},300);}</script>")
     return "".join(parts)
 
 
-def show_ui(df_centros):
+def _build_print_html(form_data, title="Formulario"):
+    """Construye un HTML sencillo con los datos del formulario para impresión."""
+    # Script para lanzar el diálogo de impresión al cargar el iframe
+    return (_html_envio(form_data, title)
+            + "<script>window.onload=function(){setTimeout(function(){window.print();},300);}</script>")
+
+
+def show_ui(catalogo):
+    df_centros = catalogo.df
+    # Centro elegido entre los cercanos a una ubicación en la ejecución anterior.
+    # El usuario lo eligió explícitamente: reemplaza los datos pre-llenados.
+    if st.session_state.get("centro_por_adjuntar"):
+        _adjuntar_centro(st.session_state.pop("centro_por_adjuntar"), sobrescribir=True)
     st.title(f"Panel de Operador")
     
     tab_buscador, tab_fill_form, tab_my_submissions = st.tabs([
@@ -360,7 +489,31 @@ def show_ui(df_centros):
     with tab_buscador:
         st.header("Consulta de Centros Educativos")
         st.info("Estos son los datos originales del archivo CSV.")
-        st.dataframe(df_centros, use_container_width=True)
+        # Solo se envía al navegador la página actual del catálogo
+        col_tamano, col_pagina = st.columns(2)
+        with col_tamano:
+            page_size = st.selectbox("Resultados por página", [10, 25, 50, 100], index=1, key="operator_page_size")
+        total_rows = len(df_centros)
+        total_pages = max(1, (total_rows // page_size) + int(total_rows % page_size > 0))
+        with col_pagina:
+            page = st.number_input("Página", min_value=1, max_value=total_pages, value=1, step=1, key="operator_page")
+        start_idx = (page - 1) * page_size
+        end_idx = start_idx + page_size
+        st.caption(f"Mostrando {min(start_idx+1, total_rows)} a {min(end_idx, total_rows)} de {total_rows} centros")
+        st.dataframe(df_centros.iloc[start_idx:end_idx], use_container_width=True)
+
+        with st.expander("📍 Centros cercanos a un punto"):
+            col_lat, col_lng, col_radio = st.columns(3)
+            with col_lat:
+                radio_lat = st.number_input("Latitud", value=9.9333, format="%.6f", key="operator_radio_lat")
+            with col_lng:
+                radio_lng = st.number_input("Longitud", value=-84.0833, format="%.6f", key="operator_radio_lng")
+            with col_radio:
+                radio_km = st.number_input("Radio (km)", min_value=0.1, max_value=100.0, value=5.0, step=0.5, key="operator_radio_km")
+            posiciones, distancias = catalogo.centros_en_radio(radio_lat, radio_lng, radio_km)
+            st.caption(f"{len(posiciones)} centros a {radio_km:g} km o menos")
+            if len(posiciones):
+                st.dataframe(df_centros.iloc[posiciones].assign(DISTANCIA_KM=distancias.round(2)), use_container_width=True)
         
         st.divider()
         st.subheader("📎 Adjuntar Centro a un Formulario")
@@ -370,66 +523,41 @@ def show_ui(df_centros):
         search_query = st.text_input("Buscar centro (por nombre)", key="operator_search_query")
 
         if 'CENTRO_EDUCATIVO' in df_centros.columns:
-            lista_nombres_centros = sorted(df_centros['CENTRO_EDUCATIVO'].astype(str).unique().tolist())
-            if search_query and search_query.strip():
-                lower_q = search_query.strip().lower()
-                lista_nombres_centros = [n for n in lista_nombres_centros if lower_q in n.lower()]
+            # Solo los mejores resultados del índice de trigramas (tolera errores de tipeo)
+            # La lista lleva los CODSABER: los nombres se repiten entre centros
+            lista_codigos_centros = catalogo.codigos(catalogo.sugerir_centros(search_query))
         else:
-            lista_nombres_centros = []
+            lista_codigos_centros = []
 
         centro_para_adjuntar = st.selectbox(
             "Escriba o seleccione el nombre del centro que desea adjuntar:",
-            options=lista_nombres_centros,
-            index=0 if lista_nombres_centros else None,
-            format_func=lambda x: x,
+            options=lista_codigos_centros,
+            index=0 if lista_codigos_centros else None,
+            format_func=catalogo.etiqueta,
             key="operator_attach_selectbox"
         )
 
         if st.button("Adjuntar Centro Seleccionado", key="btn_adjuntar_operator"):
             if centro_para_adjuntar:
                 try:
-                    datos_centro_seleccionado = df_centros[df_centros['CENTRO_EDUCATIVO'] == centro_para_adjuntar].iloc[0]
-                    st.session_state.centro_adjunto = datos_centro_seleccionado.to_dict()
-                    st.success(f"¡{centro_para_adjuntar} adjuntado!")
+                    datos_centro_seleccionado = catalogo.centro(centro_para_adjuntar)
+                    _adjuntar_centro(datos_centro_seleccionado)
+                    st.success(f"¡{datos_centro_seleccionado.get('CENTRO_EDUCATIVO', centro_para_adjuntar)} adjuntado!")
                     st.info("Ahora vaya a la pestaña 'Llenar Formulario' para ver la información pre-llenada.")
-                    # Intentar poblar automáticamente los keys del formulario en session_state
-                    try:
-                        centro_dict = datos_centro_seleccionado.to_dict()
-                        # Invertir el mapeo CSV->FORM para obtener FORM->CSV
-                        FORM_TO_CSV_MAP = {v: k for k, v in CSV_TO_FORM_MAP.items()}
-                        # Mapa auxiliar de claves del centro en mayúsculas -> original
-                        centro_keys_upper = {str(k).upper(): k for k in centro_dict.keys()}
-                        for form_label, csv_col in FORM_TO_CSV_MAP.items():
-                            if not csv_col:
-                                continue
-                            try:
-                                csv_col_upper = str(csv_col).upper()
-                                if csv_col_upper in centro_keys_upper:
-                                    orig_key = centro_keys_upper[csv_col_upper]
-                                    val = centro_dict.get(orig_key)
-                                    if val is not None:
-                                        sess_key = f"form_field_{form_label.replace(' ', '_')}"
-                                        # Only set if not already present to avoid overwriting user edits
-                                        if sess_key not in st.session_state:
-                                            st.session_state[sess_key] = val
-                            except Exception:
-                                continue
-                    except Exception:
-                        pass
                     # Forzar rerun para que la pestaña de formulario recoja el centro adjunto y se prellene
                     st.rerun()
                 except Exception:
-                    st.error("No se pudo adjuntar el centro seleccionado. Revisa el nombre o el CSV de centros.")
+                    st.error("No se pudo adjuntar el centro seleccionado. Revisa el código o el CSV de centros.")
             else:
                 st.warning("Por favor, selecciona un centro de la lista.")
 
         # Mostrar preview del centro seleccionado (si existe)
         if 'operator_attach_selectbox' in st.session_state and st.session_state.operator_attach_selectbox:
             try:
-                preview = df_centros[df_centros['CENTRO_EDUCATIVO'] == st.session_state.operator_attach_selectbox]
-                if not preview.empty:
+                preview = catalogo.centro(st.session_state.operator_attach_selectbox)
+                if preview:
                     st.subheader("Vista previa del centro seleccionado")
-                    st.write(preview.iloc[0].to_dict())
+                    st.write(preview)
             except Exception:
                 pass
 
@@ -501,7 +629,7 @@ def show_ui(df_centros):
                     st.subheader(template_options[selected_template_id])
                     
                     # Renderizar todos los campos
-                    form_data = _render_form_from_structure(form_structure)
+                    form_data = _render_form_from_structure(form_structure, selected_template_id)
                     
                     submitted = st.form_submit_button("✅ Enviar Formulario")
                 
@@ -509,131 +637,135 @@ def show_ui(df_centros):
                 # Iteramos la estructura para añadir botones GPS por cada campo geolocalización
                 st.divider()
                 st.subheader("⚙️ Captura de Ubicación GPS")
-                for field in form_structure:
-                    if field.get("Tipo de Campo") == "Geolocalización":
-                        label = field["Etiqueta del Campo"]
-                        field_key = f"form_field_{label.replace(' ', '_')}"
-                        gps_session_key = f"{field_key}_gps"
-
-                        col1, col2, col3 = st.columns([3, 1, 1])
-                        with col1:
-                            st.write(f"**{label}**")
-                        with col2:
-                            if not ST_JAVASCRIPT_AVAILABLE:
-                                st.info("El método 'Usar mi ubicación' no está disponible en este despliegue. Usa el mapa o introduce coordenadas manualmente abajo.")
-
-                            if st.button(f"📍 Capturar", key=f"btn_gps_out_{field_key}", use_container_width=True):
-                                # Intentar abrir modal con postMessage (más fiable en algunos navegadores)
-                                if ST_JAVASCRIPT_AVAILABLE:
-                                    modal_res = show_geo_modal(label, field_key)
-                                    gps_res = None
-                                    if modal_res:
-                                        gps_payload = None
-                                        # Depuración opcional
-                                        if st.session_state.get('debug_geo'):
-                                            st.write("Modal raw response:", modal_res)
-                                        try:
-                                            # modal_res puede ser JSON string, dict, o mensajes como 'timeout'
-                                            if isinstance(modal_res, str):
-                                                s = modal_res.strip()
-                                                if not s:
-                                                    st.warning("Respuesta vacía del modal.")
-                                                elif s.lower() in ('timeout', 'null', 'none'):
-                                                    st.warning(f"Modal terminó con estado: {s}")
-                                                    gps_payload = {'error': s}
-                                                else:
-                                                    try:
-                                                        gps_payload = json.loads(s)
-                                                    except Exception:
-                                                        # Intentar ast.literal_eval como fallback para dicts sin comillas
-                                                        try:
-                                                            import ast
-                                                            gps_payload = ast.literal_eval(s)
-                                                        except Exception:
-                                                            # No se pudo parsear
-                                                            st.warning(f"Respuesta del modal no es JSON: {s}")
-                                                            gps_payload = None
-                                            elif isinstance(modal_res, dict):
-                                                gps_payload = modal_res
-                                            else:
-                                                gps_payload = modal_res
-                                        except Exception as e:
-                                            st.error(f"Error procesando respuesta del modal: {e}")
-
-                                        if gps_payload:
-                                            # Manejar errores enviados desde el modal
-                                            if isinstance(gps_payload, dict) and gps_payload.get('error'):
-                                                st.error(f"Error GPS: {gps_payload.get('error')}")
-                                            elif isinstance(gps_payload, dict) and gps_payload.get('closed'):
-                                                st.info("Modal cerrado por el usuario.")
+                for campo in _plan_formulario(form_structure, selected_template_id).geolocalizaciones:
+                    label = campo.etiqueta
+                    field_key = campo.clave
+                    gps_session_key = f"{field_key}_gps"
+
+                    col1, col2, col3 = st.columns([3, 1, 1])
+                    with col1:
+                        st.write(f"**{label}**")
+                    with col2:
+                        if not ST_JAVASCRIPT_AVAILABLE:
+                            st.info("El método 'Usar mi ubicación' no está disponible en este despliegue. Usa el mapa o introduce coordenadas manualmente abajo.")
+
+                        if st.button(f"📍 Capturar", key=f"btn_gps_out_{field_key}", use_container_width=True):
+                            # Intentar abrir modal con postMessage (más fiable en algunos navegadores)
+                            if ST_JAVASCRIPT_AVAILABLE:
+                                modal_res = show_geo_modal(label, field_key)
+                                gps_res = None
+                                if modal_res:
+                                    gps_payload = None
+                                    # Depuración opcional
+                                    if st.session_state.get('debug_geo'):
+                                        st.write("Modal raw response:", modal_res)
+                                    try:
+                                        # modal_res puede ser JSON string, dict, o mensajes como 'timeout'
+                                        if isinstance(modal_res, str):
+                                            s = modal_res.strip()
+                                            if not s:
+                                                st.warning("Respuesta vacía del modal.")
+                                            elif s.lower() in ('timeout', 'null', 'none'):
+                                                st.warning(f"Modal terminó con estado: {s}")
+                                                gps_payload = {'error': s}
                                             else:
                                                 try:
-                                                        lat = float(gps_payload.get('lat'))
-                                                        lng = float(gps_payload.get('lng'))
-                                                        # Guardar con precisión de 6 decimales
-                                                        lat = round(float(lat), 6)
-                                                        lng = round(float(lng), 6)
-                                                        gps_coords = {'lat': lat, 'lng': lng}
-                                                        st.session_state[gps_session_key] = gps_coords
-                                                        # También guardar en map_click para mostrar marcador inmediatamente
-                                                        try:
-                                                            map_click_key = f"{field_key}_map_click"
-                                                            st.session_state[map_click_key] = gps_coords
-                                                        except Exception:
-                                                            pass
-                                                        st.success(f"✅ Ubicación detectada: {gps_coords['lat']:.6f}, {gps_coords['lng']:.6f}")
-                                                        # Forzar rerun para que el mapa y el formulario muestren la nueva coordenada
-                                                        st.rerun()
-                                                except Exception as e:
-                                                    st.error(f"La respuesta del modal no contiene lat/lng válidos: {e}")
+                                                    gps_payload = json.loads(s)
+                                                except Exception:
+                                                    # Intentar ast.literal_eval como fallback para dicts sin comillas
+                                                    try:
+                                                        import ast
+                                                        gps_payload = ast.literal_eval(s)
+                                                    except Exception:
+                                                        # No se pudo parsear
+                                                        st.warning(f"Respuesta del modal no es JSON: {s}")
+                                                        gps_payload = None
+                                        elif isinstance(modal_res, dict):
+                                            gps_payload = modal_res
                                         else:
-                                            st.warning("⚠️ No se obtuvo ubicación desde el modal. Verifica permisos del navegador o usa la entrada manual.")
+                                            gps_payload = modal_res
+                                    except Exception as e:
+                                        st.error(f"Error procesando respuesta del modal: {e}")
+
+                                    if gps_payload:
+                                        # Manejar errores enviados desde el modal
+                                        if isinstance(gps_payload, dict) and gps_payload.get('error'):
+                                            st.error(f"Error GPS: {gps_payload.get('error')}")
+                                        elif isinstance(gps_payload, dict) and gps_payload.get('closed'):
+                                            st.info("Modal cerrado por el usuario.")
+                                        else:
+                                            try:
+                                                    lat = float(gps_payload.get('lat'))
+                                                    lng = float(gps_payload.get('lng'))
+                                                    # Guardar con precisión de 6 decimales
+                                                    lat = round(float(lat), 6)
+                                                    lng = round(float(lng), 6)
+                                                    gps_coords = {'lat': lat, 'lng': lng}
+                                                    st.session_state[gps_session_key] = gps_coords
+                                                    # También guardar en map_click para mostrar marcador inmediatamente
+                                                    try:
+                                                        map_click_key = f"{field_key}_map_click"
+                                                        st.session_state[map_click_key] = gps_coords
+                                                    except Exception:
+                                                        pass
+                                                    st.success(f"✅ Ubicación detectada: {gps_coords['lat']:.6f}, {gps_coords['lng']:.6f}")
+                                                    # Forzar rerun para que el mapa y el formulario muestren la nueva coordenada
+                                                    st.rerun()
+                                            except Exception as e:
+                                                st.error(f"La respuesta del modal no contiene lat/lng válidos: {e}")
                                     else:
                                         st.warning("⚠️ No se obtuvo ubicación desde el modal. Verifica permisos del navegador o usa la entrada manual.")
                                 else:
-                                    st.warning("El método 'Usar mi ubicación' no está disponible en este despliegue. Usa la entrada manual o el mapa.")
-
-                            # Campo alternativo manual para ingresar coordenadas (útil si JS o permisos fallan)
-                            manual_lat = st.text_input(f"Latitud manual — {label}", value="", key=f"manual_lat_{field_key}")
-                            manual_lng = st.text_input(f"Longitud manual — {label}", value="", key=f"manual_lng_{field_key}")
-                            if st.button(f"Guardar coordenadas manuales — {label}", key=f"btn_save_manual_{field_key}"):
+                                    st.warning("⚠️ No se obtuvo ubicación desde el modal. Verifica permisos del navegador o usa la entrada manual.")
+                            else:
+                                st.warning("El método 'Usar mi ubicación' no está disponible en este despliegue. Usa la entrada manual o el mapa.")
+
+                        # Campo alternativo manual para ingresar coordenadas (útil si JS o permisos fallan)
+                        manual_lat = st.text_input(f"Latitud manual — {label}", value="", key=f"manual_lat_{field_key}")
+                        manual_lng = st.text_input(f"Longitud manual — {label}", value="", key=f"manual_lng_{field_key}")
+                        if st.button(f"Guardar coordenadas manuales — {label}", key=f"btn_save_manual_{field_key}"):
+                            try:
+                                if manual_lat and manual_lng:
+                                    lat = float(manual_lat.strip())
+                                    lng = float(manual_lng.strip())
+                                    # Guardar tanto en la clave GPS como en el clic de mapa para visualizar marcador inmediatamente
+                                    st.session_state[gps_session_key] = {'lat': lat, 'lng': lng}
+                                    # También guardar como mapa click para mostrar marcador
+                                    map_click_key = f"{field_key}_map_click"
+                                    st.session_state[map_click_key] = {'lat': lat, 'lng': lng}
+                                    st.success(f"Coordenadas guardadas manualmente: {lat:.6f}, {lng:.6f}")
+                                    # Forzar rerun para que el mapa actualice y muestre el marcador
+                                    st.rerun()
+                                else:
+                                    st.warning("Ingresa latitud y longitud válidas antes de guardar.")
+                            except Exception:
+                                st.error("Formato inválido. Usa números decimales para latitud y longitud, por ejemplo: 9.9333")
+                    with col3:
+                        if st.session_state.get(gps_session_key):
+                            if st.button("🗑️ Limpiar", key=f"btn_clear_gps_{field_key}", use_container_width=True):
+                                # Eliminar tanto la ubicación GPS como cualquier clic persistido en el mapa
                                 try:
-                                    if manual_lat and manual_lng:
-                                        lat = float(manual_lat.strip())
-                                        lng = float(manual_lng.strip())
-                                        # Guardar tanto en la clave GPS como en el clic de mapa para visualizar marcador inmediatamente
-                                        st.session_state[gps_session_key] = {'lat': lat, 'lng': lng}
-                                        # También guardar como mapa click para mostrar marcador
-                                        map_click_key = f"{field_key}_map_click"
-                                        st.session_state[map_click_key] = {'lat': lat, 'lng': lng}
-                                        st.success(f"Coordenadas guardadas manualmente: {lat:.6f}, {lng:.6f}")
-                                        # Forzar rerun para que el mapa actualice y muestre el marcador
-                                        st.rerun()
-                                    else:
-                                        st.warning("Ingresa latitud y longitud válidas antes de guardar.")
+                                    if gps_session_key in st.session_state:
+                                        del st.session_state[gps_session_key]
                                 except Exception:
-                                    st.error("Formato inválido. Usa números decimales para latitud y longitud, por ejemplo: 9.9333")
-                        with col3:
-                            if st.session_state.get(gps_session_key):
-                                if st.button("🗑️ Limpiar", key=f"btn_clear_gps_{field_key}", use_container_width=True):
-                                    # Eliminar tanto la ubicación GPS como cualquier clic persistido en el mapa
-                                    try:
-                                        if gps_session_key in st.session_state:
-                                            del st.session_state[gps_session_key]
-                                    except Exception:
-                                        pass
-                                    try:
-                                        map_click_key = f"{field_key}_map_click"
-                                        if map_click_key in st.session_state:
-                                            del st.session_state[map_click_key]
-                                    except Exception:
-                                        pass
-                                    st.success("Coordenadas eliminadas.")
-
-                        # Mostrar coordenadas actuales si existen
-                        if st.session_state.get(gps_session_key):
-                            coords = st.session_state[gps_session_key]
-                            st.info(f"Coordenadas guardadas: {coords['lat']:.6f}, {coords['lng']:.6f}")
+                                    pass
+                                try:
+                                    map_click_key = f"{field_key}_map_click"
+                                    if map_click_key in st.session_state:
+                                        del st.session_state[map_click_key]
+                                except Exception:
+                                    pass
+                                st.success("Coordenadas eliminadas.")
+
+                    # Mostrar coordenadas actuales si existen
+                    if st.session_state.get(gps_session_key):
+                        coords = st.session_state[gps_session_key]
+                        st.info(f"Coordenadas guardadas: {coords['lat']:.6f}, {coords['lng']:.6f}")
+
+                    # Sugerir centros cercanos a la ubicación capturada (GPS o clic en mapa)
+                    ubicacion = st.session_state.get(gps_session_key) or st.session_state.get(f"{field_key}_map_click")
+                    if ubicacion:
+                        _mostrar_centros_cercanos(catalogo, ubicacion, field_key)
             else:
                 submitted = False
                 form_data = {}
@@ -647,7 +779,7 @@ def show_ui(df_centros):
                         st.error(f"Error generando vista imprimible: {e}")
             
             if submitted:
-                is_valid, error_message = _validate_form(form_data, form_structure)
+                is_valid, error_message = _validate_form(form_data, form_structure, selected_template_id)
                 if is_valid:
                     try:
                         database.save_submission(
@@ -672,10 +804,41 @@ def show_ui(df_centros):
     with tab_my_submissions:
         st.header("Historial de Mis Envíos")
         try:
-            my_submissions_df = database.get_submissions_by_user(st.session_state["user_id"])
-            if my_submissions_df.empty:
+            user_id = st.session_state["user_id"]
+            # Cursor de inicio de cada página visitada; la primera empieza en None
+            cursores = st.session_state.setdefault("mis_envios_cursores", [None])
+            my_submissions_df, siguiente = database.get_submissions_page_by_user(
+                user_id, despues=cursores[-1], limite=MIS_ENVIOS_POR_PAGINA
+            )
+            if my_submissions_df.empty and len(cursores) == 1:
                 st.info("Aún no has enviado ningún formulario.")
             else:
-                st.dataframe(my_submissions_df.drop(columns=['data']), use_container_width=True)
+                st.caption(f"Página {len(cursores)} · {database.get_submission_count_of_user(user_id)} envíos en total")
+                st.dataframe(my_submissions_df, use_container_width=True)
+
+                col_anterior, col_siguiente = st.columns(2)
+                with col_anterior:
+                    if st.button("⬅️ Anterior", key="btn_mis_envios_anterior", disabled=len(cursores) == 1, use_container_width=True):
+                        cursores.pop()
+                        st.rerun()
+                with col_siguiente:
+                    if st.button("Siguiente ➡️", key="btn_mis_envios_siguiente", disabled=siguiente is None, use_container_width=True):
+                        cursores.append(siguiente)
+                        st.rerun()
+
+                # El contenido (imágenes, firmas...) solo se descarga al abrir un envío
+                if not my_submissions_df.empty:
+                    etiquetas = {
+                        int(row.id): f"#{row.id} — {row.name} ({row.created_at:%d/%m/%Y %H:%M})"
+                        for row in my_submissions_df.itertuples()
+                    }
+                    envio_id = st.selectbox("Ver envío", list(etiquetas), format_func=etiquetas.get, index=None,
+                                            placeholder="Seleccione un envío para ver su contenido", key="mis_envios_ver")
+                    if envio_id is not None:
+                        contenido = database.get_submission_data(envio_id, user_id)
+                        if contenido is None:
+                            st.warning("No se encontró el envío.")
+                        else:
+                            components.html(_html_envio(contenido, etiquetas[envio_id]), height=600, scrolling=True)
         except Exception as e:
             st.error(f"Error al cargar tus envíos: {e}")
\ No newline at end of file
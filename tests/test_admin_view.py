@@ -0,0 +1,53 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+import streamlit as st
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import centros_catalog
+from admin_view import _base_edicion
+
+CSV = (
+    "CODSABER,CODPRES,CENTRO_EDUCATIVO,TIPO_INSTITUCION,REGIONAL,PROVINCIA,CANTON,DISTRITO,POBLADO,DIRECCION,LATITUD,LONGITUD\n"
+    "100182-00,0000,LICEO DE SAN JOSÉ,PÚBLICO,DIRECCIÓN REGIONAL SAN JOSÉ NORTE,SAN JOSÉ,MONTES DE OCA,SAN PEDRO,CALLE LA CRUZ,50E DE LA UCR,9.93836787,-84.04763892\n"
+    "100210-00,0000,ESCUELA SINAI,PÚBLICO,DIRECCIÓN REGIONAL PÉREZ ZELEDÓN,SAN JOSÉ,PÉREZ ZELEDÓN,SAN ISIDRO DEL GENERAL,SINAI,1 KM NORTE,9.37993884,-83.6912943\n"
+)
+
+
+def test_edicion_sobrevive_a_un_guardado_de_otro_administrador(tmp_path):
+    st.session_state.clear()
+    ruta = tmp_path / "centros.csv"
+    ruta.write_text(CSV, encoding="utf-8")
+    ruta = str(ruta)
+    pagina = ("", "", 25, 1)
+    base = _base_edicion(centros_catalog.get_catalogo(ruta), np.array([0, 1]), pagina)
+    editada = base["df"].copy()
+    editada.loc[1, "CENTRO_EDUCATIVO"] = "ESCUELA SINAÍ"
+
+    # Otro administrador guarda otra fila mientras tanto: sube la versión
+    catalogo = centros_catalog.get_catalogo(ruta)
+    pagina_otro = catalogo.df.iloc[[0]]
+    editada_otro = pagina_otro.copy()
+    editada_otro.loc[0, "POBLADO"] = "SAN PEDRO CENTRO"
+    vigente = centros_catalog.guardar_cambios(catalogo, centros_catalog.diferencias(pagina_otro, editada_otro), usuario=2)
+    assert vigente.version != base["version"]
+
+    # La edición conserva su base y sus cambios no se pierden
+    assert _base_edicion(vigente, np.array([0, 1]), pagina) is base
+    cambios = centros_catalog.diferencias(base["df"], editada)
+    assert cambios["modificaciones"] == {"100210-00": {"CENTRO_EDUCATIVO": ("ESCUELA SINAI", "ESCUELA SINAÍ")}}
+    resultado = centros_catalog.guardar_cambios(vigente, cambios, usuario=1)
+    assert list(resultado.df["POBLADO"])[0] == "SAN PEDRO CENTRO"
+    assert list(resultado.df["CENTRO_EDUCATIVO"])[1] == "ESCUELA SINAÍ"
+
+    # Si los dos tocaron la misma celda, guardar_cambios lo detecta
+    editada.loc[0, "POBLADO"] = "OTRO"
+    with pytest.raises(centros_catalog.ConflictoEdicion):
+        centros_catalog.guardar_cambios(resultado, centros_catalog.diferencias(base["df"], editada), usuario=1)
+
+    # Otra página (filtros o paginación) empieza una base nueva
+    assert _base_edicion(resultado, np.array([1]), ("", "", 25, 2)) is not base
+    st.session_state.clear()
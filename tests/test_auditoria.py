@@ -0,0 +1,136 @@
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bloqueos import bloqueo_archivo
+from database import BufferAuditoria
+
+
+class _Escritor:
+    def __init__(self):
+        self.lotes = []
+        self.fallar = False
+        # Detalles que la BD rechaza (ValueError hace de error de fila)
+        self.rechazar = set()
+
+    def __call__(self, lote):
+        if self.fallar:
+            raise RuntimeError("BD caída")
+        if any(detalle in self.rechazar for _, _, detalle, _ in lote):
+            raise ValueError("fila rechazada")
+        self.lotes.append(list(lote))
+
+
+def _es_error_de_fila(e):
+    return isinstance(e, ValueError)
+
+
+def test_registrar_no_escribe_hasta_vaciar(tmp_path):
+    escritor = _Escritor()
+    buffer = BufferAuditoria(escritor, max_lote=100, intervalo=60, ruta_respaldo=str(tmp_path / "respaldo.jsonl"))
+    buffer.registrar(1, "login", "a")
+    buffer.registrar(2, "logout", "b")
+    assert escritor.lotes == []
+
+    assert buffer.vaciar()
+    assert [(u, a) for u, a, _, _ in escritor.lotes[0]] == [(1, "login"), (2, "logout")]
+    buffer.cerrar()
+
+
+def test_lote_lleno_despierta_al_hilo(tmp_path):
+    escritor = _Escritor()
+    buffer = BufferAuditoria(escritor, max_lote=3, intervalo=60, ruta_respaldo=str(tmp_path / "respaldo.jsonl"))
+    for i in range(3):
+        buffer.registrar(i, "accion", "")
+    limite = time.monotonic() + 5
+    while not escritor.lotes and time.monotonic() < limite:
+        time.sleep(0.01)
+    assert len(escritor.lotes[0]) == 3
+    buffer.cerrar()
+
+
+def test_respaldo_en_archivo_si_la_bd_falla(tmp_path):
+    ruta = tmp_path / "respaldo.jsonl"
+    escritor = _Escritor()
+    buffer = BufferAuditoria(escritor, max_lote=100, intervalo=60, ruta_respaldo=str(ruta))
+    escritor.fallar = True
+    buffer.registrar(1, "edicion", "áéí")
+    assert not buffer.vaciar()
+    assert ruta.exists()
+
+    # Al volver la BD se escribe primero lo del respaldo y se borra el archivo
+    escritor.fallar = False
+    buffer.registrar(2, "edicion", "otra")
+    assert buffer.vaciar()
+    assert [(u, d) for u, _, d, _ in escritor.lotes[0]] == [(1, "áéí"), (2, "otra")]
+    assert not ruta.exists()
+    buffer.cerrar()
+
+
+def test_fila_rechazada_va_a_cuarentena_sin_bloquear_al_resto(tmp_path):
+    ruta = tmp_path / "respaldo.jsonl"
+    escritor = _Escritor()
+    escritor.rechazar = {"mala"}
+    buffer = BufferAuditoria(escritor, max_lote=100, intervalo=60, ruta_respaldo=str(ruta),
+                             es_error_de_fila=_es_error_de_fila)
+    buffer.registrar(1, "edicion", "buena")
+    buffer.registrar(2, "edicion", "mala")
+    buffer.registrar(3, "edicion", "otra")
+    assert not buffer.vaciar()
+
+    assert [d for lote in escritor.lotes for _, _, d, _ in lote] == ["buena", "otra"]
+    assert not ruta.exists()
+    cuarentena = [json.loads(linea) for linea in open(buffer.ruta_cuarentena, encoding="utf-8")]
+    assert [(c["detalle"], c["error"]) for c in cuarentena] == [("mala", "fila rechazada")]
+
+    # Los vaciados siguientes ya no la reintentan
+    buffer.registrar(4, "edicion", "nueva")
+    assert buffer.vaciar()
+    assert escritor.lotes[-1][0][2] == "nueva"
+    buffer.cerrar()
+
+
+def test_caida_a_mitad_del_reintento_conserva_el_resto_en_respaldo(tmp_path):
+    ruta = tmp_path / "respaldo.jsonl"
+    escritor = _Escritor()
+    escritor.rechazar = {"mala"}
+    llamadas = []
+
+    def escribir(lote):
+        llamadas.append(lote)
+        # Tras el lote completo, "a" y "mala", la BD deja de responder
+        if len(llamadas) == 4:
+            escritor.fallar = True
+        escritor(lote)
+
+    buffer = BufferAuditoria(escribir, max_lote=100, intervalo=60, ruta_respaldo=str(ruta),
+                             es_error_de_fila=_es_error_de_fila)
+    for detalle in ("a", "mala", "b", "c"):
+        buffer.registrar(1, "edicion", detalle)
+    assert not buffer.vaciar()
+    assert [d for _, _, d, _ in buffer._leer_respaldo()] == ["b", "c"]
+
+    escritor.fallar = False
+    assert buffer.vaciar()
+    assert [d for lote in escritor.lotes for _, _, d, _ in lote] == ["a", "b", "c"]
+    assert not ruta.exists()
+    buffer.cerrar()
+
+
+def test_respaldo_bloqueado_por_otro_proceso_devuelve_el_lote_a_la_cola(tmp_path):
+    ruta = tmp_path / "respaldo.jsonl"
+    escritor = _Escritor()
+    buffer = BufferAuditoria(escritor, max_lote=100, intervalo=60, ruta_respaldo=str(ruta))
+    buffer.registrar(1, "edicion", "a")
+    with bloqueo_archivo(str(ruta)):
+        inicio = time.monotonic()
+        assert not buffer.vaciar()
+        assert time.monotonic() - inicio < 10
+    assert escritor.lotes == []
+
+    assert buffer.vaciar()
+    assert escritor.lotes[0][0][2] == "a"
+    buffer.cerrar()
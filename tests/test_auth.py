@@ -38,5 +38,24 @@ class TestAuth(unittest.TestCase):
 
         self.assertFalse(check_password(wrong_password, hashed_password))
 
+    def test_verificar_password_rehashes_old_parameters(self):
+        """
+        Tests that a hash made with other parameters is verified and replaced.
+        """
+        from werkzeug.security import generate_password_hash
+        from auth import necesita_rehash, verificar_password
+
+        password = "mysecretpassword"
+        old_hash = generate_password_hash(password, method="pbkdf2:sha256:1000")
+        self.assertTrue(necesita_rehash(old_hash))
+
+        valid, new_hash = verificar_password(password, old_hash)
+        self.assertTrue(valid)
+        self.assertTrue(check_password(password, new_hash))
+        self.assertFalse(necesita_rehash(new_hash))
+
+        self.assertEqual(verificar_password("anotherpassword", old_hash), (False, None))
+        self.assertEqual(verificar_password(password, new_hash), (True, None))
+
 if __name__ == '__main__':
     unittest.main()
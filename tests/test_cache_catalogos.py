@@ -0,0 +1,42 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database import CacheTTL
+
+
+def test_lee_una_vez_y_entrega_copias():
+    cache = CacheTTL(ttl=60)
+    lecturas = []
+
+    def leer():
+        lecturas.append(1)
+        return [{"id": 1, "name": "Área"}]
+
+    primera = cache.obtener(("areas",), leer)
+    primera[0]["name"] = "modificada"
+    segunda = cache.obtener(("areas",), leer)
+
+    assert len(lecturas) == 1
+    assert segunda == [{"id": 1, "name": "Área"}]
+    assert cache.estadisticas()["aciertos"] == 1
+    assert cache.estadisticas()["fallos"] == 1
+
+
+def test_caduca_e_invalida():
+    cache = CacheTTL(ttl=0.05)
+    valores = iter(range(10))
+    assert cache.obtener("clave", lambda: next(valores)) == 0
+    assert cache.obtener("clave", lambda: next(valores)) == 0
+    time.sleep(0.06)
+    assert cache.obtener("clave", lambda: next(valores)) == 1
+    cache.invalidar("clave")
+    assert cache.obtener("clave", lambda: next(valores)) == 2
+
+
+def test_no_guarda_none():
+    cache = CacheTTL(ttl=60)
+    assert cache.obtener("estructura", lambda: None) is None
+    assert cache.obtener("estructura", lambda: [1]) == [1]
@@ -0,0 +1,248 @@
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pandas as pd
+
+import centros_catalog
+
+
+CSV_BASE = (
+    "CODSABER,CODPRES,CENTRO_EDUCATIVO,TIPO_INSTITUCION,REGIONAL,PROVINCIA,CANTON,DISTRITO,POBLADO,DIRECCION,LATITUD,LONGITUD\n"
+    "100182-00,0000,LICEO DE SAN JOSÉ,PÚBLICO,DIRECCIÓN REGIONAL SAN JOSÉ NORTE,SAN JOSÉ,MONTES DE OCA,SAN PEDRO,CALLE LA CRUZ,50E DE LA UCR,9.93836787,-84.04763892\n"
+    "100210-00,0000,ESCUELA SINAI,PÚBLICO,DIRECCIÓN REGIONAL PÉREZ ZELEDÓN,SAN JOSÉ,PÉREZ ZELEDÓN,SAN ISIDRO DEL GENERAL,SINAI,1 KM NORTE,9.37993884,-83.6912943\n"
+)
+
+
+def _escribir_csv(tmp_path, contenido=CSV_BASE):
+    ruta = tmp_path / "centros.csv"
+    ruta.write_text(contenido, encoding="utf-8")
+    return str(ruta)
+
+
+def test_catalogo_se_carga_una_vez(tmp_path):
+    ruta = _escribir_csv(tmp_path)
+    primero = centros_catalog.get_catalogo(ruta)
+    segundo = centros_catalog.get_catalogo(ruta)
+    assert primero is segundo
+    assert len(primero) == 2
+
+
+def test_catalogo_recarga_solo_si_cambia_el_contenido(tmp_path):
+    ruta = _escribir_csv(tmp_path)
+    catalogo = centros_catalog.get_catalogo(ruta)
+    version = catalogo.version
+
+    # Tocar el archivo sin cambiar su contenido conserva la versión
+    os.utime(ruta, ns=(0, 0))
+    assert centros_catalog.get_catalogo(ruta).version == version
+
+    _escribir_csv(tmp_path, CSV_BASE + CSV_BASE.splitlines()[1] + "\n")
+    recargado = centros_catalog.get_catalogo(ruta)
+    assert recargado.version > version
+    assert len(recargado) == 3
+
+
+def test_snapshot_equivale_al_csv_y_se_descarta_si_cambia(tmp_path):
+    ruta = _escribir_csv(tmp_path)
+    snapshot = centros_catalog.construir_snapshot(ruta)
+
+    df = centros_catalog.leer_snapshot(snapshot, centros_catalog._hash_archivo(ruta))
+    assert list(df["CODPRES"]) == ["0000", "0000"]
+    assert str(df["PROVINCIA"].dtype) == "category"
+    assert df["LATITUD"].dtype == "float64"
+
+    _escribir_csv(tmp_path, CSV_BASE.replace("ESCUELA SINAI", "ESCUELA SINAÍ"))
+    assert centros_catalog.leer_snapshot(snapshot, centros_catalog._hash_archivo(ruta)) is None
+    assert "ESCUELA SINAÍ" in set(centros_catalog.get_catalogo(ruta).df["CENTRO_EDUCATIVO"])
+
+
+def test_snapshot_y_csv_dan_el_mismo_dataframe(tmp_path):
+    ruta = _escribir_csv(tmp_path)
+    desde_csv = centros_catalog.leer_csv_centros(ruta)
+    desde_snapshot = centros_catalog.leer_snapshot(centros_catalog.construir_snapshot(ruta))
+    pd.testing.assert_frame_equal(desde_csv, desde_snapshot, check_exact=True)
+
+    # Tras una edición las categorías conservan el mismo tipo
+    editado = centros_catalog._aplicar_entradas(
+        desde_csv, [{"op": "modificacion", "codigo": "100182-00", "valores": {"PROVINCIA": "CARTAGO"}}])
+    assert editado["PROVINCIA"].dtype.categories.dtype == desde_csv["PROVINCIA"].dtype.categories.dtype
+
+
+def test_filtrar_ignora_mayusculas_y_tildes(tmp_path):
+    catalogo = centros_catalog.get_catalogo(_escribir_csv(tmp_path))
+    assert list(catalogo.filtrar(provincia="San Jose")) == [0, 1]
+    assert list(catalogo.filtrar(nombre="liceo de san jose")) == [0]
+    assert list(catalogo.filtrar(nombre="escuela", codigo="100182")) == []
+    assert list(catalogo.filtrar(codigo="100210")) == [1]
+
+
+def test_sugerir_centros_tolera_errores_y_orden(tmp_path):
+    catalogo = centros_catalog.get_catalogo(_escribir_csv(tmp_path))
+    assert list(catalogo.sugerir_centros("san jose liceo"))[0] == 0
+    assert list(catalogo.sugerir_centros("escuela sinay"))[0] == 1
+    assert list(catalogo.sugerir_centros("xyzq")) == []
+    assert len(catalogo.sugerir_centros("", k=1)) == 1
+
+
+def test_indice_espacial_coincide_con_busqueda_exhaustiva():
+    import numpy as np
+
+    rng = np.random.default_rng(7)
+    lats = rng.uniform(8.0, 11.2, 500)
+    lngs = rng.uniform(-86.0, -82.6, 500)
+    lats[:5] = 0.0  # coordenadas inválidas que deben ignorarse
+    indice = centros_catalog.IndiceEspacial(lats, lngs)
+    assert len(indice) == 495
+
+    for lat, lng in [(9.93, -84.08), (10.6, -85.4), (8.1, -82.7)]:
+        todas = centros_catalog.distancia_km(lat, lng, lats[5:], lngs[5:])
+        _, distancias = indice.cercanos(lat, lng, k=7)
+        assert np.allclose(distancias, np.sort(todas)[:7])
+        ids, distancias = indice.en_radio(lat, lng, 25.0)
+        assert set(ids) == set(np.flatnonzero(todas <= 25.0) + 5)
+        assert list(distancias) == sorted(distancias)
+
+
+def test_facetas_en_cascada(tmp_path):
+    catalogo = centros_catalog.get_catalogo(_escribir_csv(tmp_path))
+    facetas = catalogo.facetas
+    assert facetas.conteos("PROVINCIA") == {"SAN JOSÉ": 2}
+
+    filas, conteos = facetas.cascada(None, {"CANTON": "MONTES DE OCA"})
+    assert list(filas) == [0]
+    assert conteos["CANTON"] == {"MONTES DE OCA": 1, "PÉREZ ZELEDÓN": 1}
+    assert conteos["DISTRITO"] == {"SAN PEDRO": 1}
+
+    # Una selección sin filas en su nivel se ignora
+    filas, _ = facetas.cascada(None, {"REGIONAL": "DIRECCIÓN REGIONAL PÉREZ ZELEDÓN", "CANTON": "MONTES DE OCA"})
+    assert list(filas) == [1]
+
+
+def test_cambios_de_una_pagina_se_aplican_por_clave(tmp_path):
+    catalogo = centros_catalog.get_catalogo(_escribir_csv(tmp_path))
+    pagina = catalogo.df.iloc[[1]]
+    editada = pagina.copy()
+    editada.loc[1, "CENTRO_EDUCATIVO"] = "ESCUELA SINAÍ"
+    nueva = pagina.iloc[0].copy()
+    nueva["CODSABER"] = "999999-00"
+    editada.loc[2] = nueva
+
+    cambios = centros_catalog.diferencias(pagina, editada)
+    assert cambios["modificaciones"] == {"100210-00": {"CENTRO_EDUCATIVO": ("ESCUELA SINAI", "ESCUELA SINAÍ")}}
+    assert [a["CODSABER"] for a in cambios["altas"]] == ["999999-00"]
+    assert cambios["bajas"] == []
+
+    centros_catalog.guardar_cambios(catalogo, cambios)
+    recargado = centros_catalog.get_catalogo(catalogo.ruta)
+    # Las filas fuera de la página se conservan
+    assert list(recargado.df["CODSABER"]) == ["100182-00", "100210-00", "999999-00"]
+    assert recargado.df.loc[1, "CENTRO_EDUCATIVO"] == "ESCUELA SINAÍ"
+
+    cambios = centros_catalog.diferencias(recargado.df.iloc[[2]], recargado.df.iloc[[]])
+    assert cambios["bajas"] == ["999999-00"]
+
+
+def test_ediciones_concurrentes_de_filas_distintas_se_conservan(tmp_path):
+    ruta = _escribir_csv(tmp_path)
+    abierto_por_a = centros_catalog.get_catalogo(ruta)
+    abierto_por_b = centros_catalog.get_catalogo(ruta)
+
+    pagina = abierto_por_a.df.iloc[[0]]
+    editada = pagina.copy()
+    editada.loc[0, "POBLADO"] = "SAN PEDRO CENTRO"
+    centros_catalog.guardar_cambios(abierto_por_a, centros_catalog.diferencias(pagina, editada), usuario=1)
+
+    # B editó otra fila sobre la versión anterior: no hay conflicto
+    pagina = abierto_por_b.df.iloc[[1]]
+    editada = pagina.copy()
+    editada.loc[1, "POBLADO"] = "SINAÍ"
+    catalogo = centros_catalog.guardar_cambios(abierto_por_b, centros_catalog.diferencias(pagina, editada), usuario=2)
+    assert list(catalogo.df["POBLADO"]) == ["SAN PEDRO CENTRO", "SINAÍ"]
+
+    # El CSV no se reescribió: los cambios están en el registro y se reproducen al recargar
+    assert "SINAÍ" not in open(ruta, encoding="utf-8").read()
+    centros_catalog._catalogos.clear()
+    assert list(centros_catalog.get_catalogo(ruta).df["POBLADO"]) == ["SAN PEDRO CENTRO", "SINAÍ"]
+
+    # Editar una celda que otro usuario ya cambió es un conflicto
+    editada = pagina.copy()
+    editada.loc[1, "POBLADO"] = "SINAI NORTE"
+    try:
+        centros_catalog.guardar_cambios(abierto_por_b, centros_catalog.diferencias(pagina, editada))
+        assert False, "se esperaba ConflictoEdicion"
+    except centros_catalog.ConflictoEdicion as e:
+        assert e.codigos == ["100210-00"]
+
+
+def test_compactar_registro_vuelca_al_csv(tmp_path):
+    ruta = _escribir_csv(tmp_path)
+    catalogo = centros_catalog.get_catalogo(ruta)
+    centros_catalog.guardar_cambios(catalogo, {"modificaciones": {}, "altas": [], "bajas": ["100182-00"]})
+
+    compactado = centros_catalog.compactar_registro(ruta)
+    assert compactado.bytes_registro == 0
+    assert os.path.getsize(centros_catalog.ruta_registro(ruta)) == 0
+    assert list(centros_catalog.leer_csv_centros(ruta)["CODSABER"]) == ["100210-00"]
+    assert list(compactado.df["CODSABER"]) == ["100210-00"]
+
+
+def test_busqueda_por_codigo_y_etiqueta_con_nombres_repetidos(tmp_path):
+    repetido = CSV_BASE.splitlines()[1].replace("100182-00", "100183-00").replace("MONTES DE OCA", "CURRIDABAT")
+    catalogo = centros_catalog.get_catalogo(_escribir_csv(tmp_path, CSV_BASE + repetido + "\n"))
+
+    assert catalogo.posicion("100183-00") == 2
+    assert catalogo.etiqueta("100183-00") == "LICEO DE SAN JOSÉ (100183-00)"
+    assert catalogo.posicion("LICEO DE SAN JOSÉ (100182-00)") == 0
+    assert catalogo.centro("100183-00")["CANTON"] == "CURRIDABAT"
+    assert catalogo.centro("000000-00") is None
+    assert catalogo.codigos([2, 0]) == ["100183-00", "100182-00"]
+
+
+def test_cache_de_filtros_por_version(tmp_path):
+    ruta = _escribir_csv(tmp_path)
+    catalogo = centros_catalog.get_catalogo(ruta)
+    cache = centros_catalog.cache_filtros
+    cache.vaciar()
+    fallos, aciertos = cache.fallos, cache.aciertos
+
+    ids, _ = catalogo.buscar(nombre="Liceo", seleccion={"PROVINCIA": "SAN JOSÉ"})
+    assert list(ids) == [0]
+    # La misma consulta con otras mayúsculas/tildes sale de la caché
+    otro, _ = catalogo.buscar(nombre="  liceo ", seleccion={"PROVINCIA": "SAN JOSÉ"})
+    assert otro is ids
+    assert (cache.fallos - fallos, cache.aciertos - aciertos) == (1, 1)
+
+    # Guardar crea una versión nueva y descarta los resultados anteriores
+    nuevo = centros_catalog.guardar_cambios(catalogo, {"modificaciones": {}, "altas": [], "bajas": ["100182-00"]})
+    assert len(cache) == 0
+    assert list(nuevo.buscar(nombre="Liceo")[0]) == []
+
+    pequena = centros_catalog.CacheLRU(maximo=2)
+    for clave in "abc":
+        pequena.obtener(clave, lambda: clave)
+    assert len(pequena) == 2 and pequena.obtener("a", lambda: "otra") == "otra"
+
+
+def test_exportar_por_bloques_y_en_cache(tmp_path):
+    import io
+
+    import numpy as np
+    import pandas as pd
+
+    catalogo = centros_catalog.get_catalogo(_escribir_csv(tmp_path))
+    datos = catalogo.exportar(np.array([1]), "csv")
+    assert catalogo.exportar(np.array([1]), "csv") is datos
+    df = pd.read_csv(io.BytesIO(datos), dtype=str)
+    assert list(df["CODSABER"]) == ["100210-00"]
+
+    vacio = pd.read_csv(io.BytesIO(catalogo.exportar(np.array([], dtype=np.int64), "csv")))
+    assert list(vacio.columns) == list(catalogo.df.columns) and vacio.empty
+
+    if centros_catalog.exportaciones.xlsxwriter is not None:
+        import zipfile
+
+        with zipfile.ZipFile(io.BytesIO(catalogo.exportar(np.array([0, 1]), "xlsx"))) as libro:
+            hoja = libro.read("xl/worksheets/sheet1.xml").decode("utf-8")
+        assert hoja.index("LICEO DE SAN JOSÉ") < hoja.index("ESCUELA SINAI")
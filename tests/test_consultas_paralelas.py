@@ -0,0 +1,37 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database import consultar_en_paralelo
+
+
+def test_consultas_se_ejecutan_a_la_vez():
+    # Las tres consultas esperan a que lleguen las demás: en serie no terminarían
+    barrera = threading.Barrier(3, timeout=5)
+
+    def consulta(valor):
+        def ejecutar():
+            barrera.wait()
+            return valor
+        return ejecutar
+
+    inicio = time.perf_counter()
+    lote = consultar_en_paralelo({"a": consulta(1), "b": consulta(2), "c": consulta(3)})
+    assert time.perf_counter() - inicio < 5
+    assert [lote.obtener(n) for n in "abc"] == [1, 2, 3]
+    assert set(lote.segundos) == {"a", "b", "c"}
+
+
+def test_el_error_de_una_consulta_se_relanza_al_pedirla():
+    def falla():
+        raise ValueError("sin datos")
+
+    lote = consultar_en_paralelo({"falla": falla, "bien": lambda: "ok"})
+    assert lote.obtener("bien") == "ok"
+    with pytest.raises(ValueError):
+        lote.obtener("falla")
@@ -0,0 +1,73 @@
+import io
+import os
+import sys
+from datetime import datetime
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pandas as pd
+
+import exportaciones
+
+
+ESTRUCTURA = [
+    {"Etiqueta del Campo": "Nombre", "Tipo de Campo": "Texto", "Requerido": True},
+    {"Etiqueta del Campo": "Ubicación", "Tipo de Campo": "Geolocalización", "Requerido": False},
+    {"Etiqueta del Campo": "Firma", "Tipo de Campo": "Firma", "Requerido": False},
+    {"Etiqueta del Campo": "Fotos", "Tipo de Campo": "Carga de Imagen", "Requerido": False},
+    {"Etiqueta del Campo": "Tabla", "Tipo de Campo": "Tabla Dinámica", "Requerido": False},
+]
+
+# Filas tal como las devuelve database.iterar_envios_plantilla
+FILAS = [
+    (1, datetime(2024, 5, 1, 8, 30), "ana", "Ana Mora", "Visita", {"lat": 9.93, "lng": -84.08}, True, ["a.jpg", "b.png"], [{"x": 1}]),
+    (2, datetime(2024, 5, 2, 9, 0), "luis", "Luis Soto", None, None, False, [], None),
+]
+
+
+def test_aplanar_envios_segun_estructura():
+    df = exportaciones.aplanar_envios(FILAS, ESTRUCTURA)
+    assert list(df.columns) == [
+        "id_envio", "fecha_envio", "usuario", "nombre_usuario", "Nombre",
+        "Ubicación (latitud)", "Ubicación (longitud)", "Firma (firmado)", "Fotos", "Tabla",
+    ]
+    primera = df.iloc[0]
+    assert (primera["Ubicación (latitud)"], primera["Ubicación (longitud)"]) == (9.93, -84.08)
+    assert primera["Fotos"] == "a.jpg, b.png"
+    assert primera["Tabla"] == '[{"x": 1}]'
+    assert pd.isna(df.iloc[1]["Fotos"]) and not df.iloc[1]["Firma (firmado)"]
+
+
+def test_csv_y_parquet_por_bloques():
+    tipos = exportaciones.columnas_envios(ESTRUCTURA)
+    bloques = [exportaciones.aplanar_envios([fila], ESTRUCTURA) for fila in FILAS]
+
+    csv = pd.read_csv(exportaciones.csv_por_bloques(iter(bloques), [c for c, _ in tipos]))
+    assert list(csv["id_envio"]) == [1, 2]
+
+    # Sin envíos se exporta al menos la cabecera
+    vacio = pd.read_csv(exportaciones.csv_por_bloques(iter([]), [c for c, _ in tipos]))
+    assert vacio.empty and len(vacio.columns) == len(tipos)
+
+    if exportaciones.pa is not None:
+        parquet = pd.read_parquet(io.BytesIO(exportaciones.parquet_por_bloques(iter(bloques), tipos).read()))
+        assert list(parquet["usuario"]) == ["ana", "luis"]
+        assert parquet["Ubicación (latitud)"].isna().tolist() == [False, True]
+
+
+def test_exportar_envios_entrega_bytes_aceptados_por_streamlit(monkeypatch):
+    import database
+    from streamlit.runtime.download_data_util import convert_data_to_bytes_and_infer_mime
+
+    monkeypatch.setattr(database, "get_template_structure", lambda template_id: ESTRUCTURA)
+    monkeypatch.setattr(database, "iterar_envios_plantilla",
+                        lambda template_id, structure, tamano_bloque: iter([FILAS[:1], FILAS[1:]]))
+
+    formatos = ["csv", "parquet"] if exportaciones.pa is not None else ["csv"]
+    for formato in formatos:
+        datos = exportaciones.exportar_envios(7, formato)
+        convertido, _ = convert_data_to_bytes_and_infer_mime(datos, RuntimeError("formato no aceptado"))
+        if formato == "csv":
+            assert list(pd.read_csv(io.BytesIO(convertido))["id_envio"]) == [1, 2]
+        else:
+            assert list(pd.read_parquet(io.BytesIO(convertido))["id_envio"]) == [1, 2]
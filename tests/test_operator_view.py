@@ -38,3 +38,37 @@ def test_render_form_with_gps_and_map(monkeypatch):
     st.session_state.clear()
     form_data = _render_form_from_structure(structure)
     assert form_data["Ubicación"] is None
+
+
+def test_plan_formulario_se_compila_una_vez():
+    from operator_view import _plan_formulario, _validate_form
+    structure = [
+        {"Tipo de Campo": "Texto", "Etiqueta del Campo": "Nombre del Centro", "Requerido": True},
+        {"Tipo de Campo": "Geolocalización", "Etiqueta del Campo": "Ubicación"},
+    ]
+    plan = _plan_formulario(structure, template_id=99)
+    assert plan is _plan_formulario([dict(f) for f in structure], template_id=99)
+    assert plan.requeridos == ("Nombre del Centro",)
+    assert plan.prefill == (("Nombre del Centro", "CENTRO_EDUCATIVO"),)
+    assert [c.clave for c in plan.geolocalizaciones] == ["form_field_Ubicación"]
+    assert plan.campos[0].etiqueta_visible == "Nombre del Centro*"
+
+    # Una estructura distinta con el mismo id no reutiliza el plan
+    assert _plan_formulario(structure[:1], template_id=99) is not plan
+
+    assert _validate_form({"Nombre del Centro": " ", "Ubicación": None}, structure, 99)[0] is False
+    assert _validate_form({"Nombre del Centro": "Liceo", "Ubicación": None}, structure, 99) == (True, "")
+
+
+def test_html_envio_no_imprime_y_muestra_la_firma_como_imagen():
+    from operator_view import _build_print_html, _html_envio
+    firma = [[[0, 0, 0, 255], [255, 255, 255, 0]], [[255, 255, 255, 0], [0, 0, 0, 255]]]
+    datos = {"Nombre": "Liceo", "Firma": firma}
+
+    vista = _html_envio(datos, "Envío")
+    assert "window.print" not in vista
+    assert "data:image/png;base64," in vista
+    assert "255, 255, 255" not in vista
+
+    impresion = _build_print_html(datos, "Envío")
+    assert impresion.startswith(vista) and "window.print" in impresion
@@ -0,0 +1,44 @@
+import os
+import sys
+import threading
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+
+
+class _Conexion:
+    closed = 0
+
+    def close(self):
+        self.closed = 1
+
+
+class _Pool:
+    maxconn = 1
+
+    def __init__(self):
+        self.closed = False
+        self.disponibles = threading.BoundedSemaphore(1)
+
+    def getconn(self):
+        return _Conexion()
+
+    def putconn(self, conn, close=False):
+        assert not self.closed
+
+
+def test_cada_prestamo_libera_el_semaforo_de_su_pool(monkeypatch):
+    monkeypatch.setattr(database, "_conexion_sana", lambda conn: True)
+    viejo, nuevo = _Pool(), _Pool()
+    monkeypatch.setattr(database, "get_pool", lambda: viejo)
+    with database.conexion() as conn:
+        # cerrar_pool() y un pool nuevo mientras la conexión sigue prestada
+        viejo.closed = True
+        monkeypatch.setattr(database, "get_pool", lambda: nuevo)
+        with database.conexion():
+            pass
+    assert conn.closed
+    # Ninguno de los dos semáforos queda de más ni de menos
+    assert viejo.disponibles.acquire(blocking=False) and not viejo.disponibles.acquire(blocking=False)
+    assert nuevo.disponibles.acquire(blocking=False) and not nuevo.disponibles.acquire(blocking=False)
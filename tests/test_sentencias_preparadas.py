@@ -0,0 +1,18 @@
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+
+
+def test_desactivadas_por_defecto(monkeypatch):
+    monkeypatch.delenv("DB_SENTENCIAS_PREPARADAS", raising=False)
+    assert not database._usar_preparadas("postgresql://u@localhost:5432/db")
+
+
+def test_se_ignoran_detras_de_un_pooler(monkeypatch):
+    monkeypatch.setenv("DB_SENTENCIAS_PREPARADAS", "1")
+    assert database._usar_preparadas("postgresql://u@localhost:5432/db")
+    assert not database._usar_preparadas("postgresql://u@ep-abc-pooler.us-east-2.aws.neon.tech/db")
+    assert not database._usar_preparadas("host=bouncer port=6432 dbname=db")
@@ -0,0 +1,45 @@
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import usuarios_masivos
+from auth import check_password, hash_passwords
+
+
+def _csv(texto):
+    return io.BytesIO(texto.encode("utf-8"))
+
+
+def test_leer_csv_normaliza_columnas_y_valores():
+    df = usuarios_masivos.leer_csv(_csv("Username , Role,extra\n ana ,admin,x\n"), "rol")
+    assert list(df.columns) == ["username", "role"]
+    assert df.to_dict("records") == [{"username": "ana", "role": "admin"}]
+
+
+def test_leer_csv_sin_columnas_requeridas():
+    with pytest.raises(ValueError):
+        usuarios_masivos.leer_csv(_csv("username,role\nana,admin\n"), "crear")
+
+
+def test_validar_informa_cada_fila():
+    df = usuarios_masivos.leer_csv(_csv(
+        "username,full_name,role,password\n"
+        "ana,Ana,jefe,corta\n"
+        "ana,Ana Mora,operador,suficiente\n"
+    ), "crear")
+    errores = usuarios_masivos.validar(df)
+    assert any(e.startswith("Fila 2") and "rol" in e for e in errores)
+    assert any(e.startswith("Fila 2") and "contraseña" in e for e in errores)
+    assert not any(e.startswith("Fila 3") for e in errores)
+    assert any("repetidos" in e and "ana" in e for e in errores)
+
+
+def test_hash_passwords_conserva_el_orden():
+    passwords = ["primera1", "segunda2", "tercera3"]
+    hashes = hash_passwords(passwords, hilos=3)
+    assert all(check_password(p, h) for p, h in zip(passwords, hashes))
+    assert not check_password(passwords[0], hashes[1])
@@ -0,0 +1,71 @@
+"""
+Administración masiva de usuarios desde un CSV.
+
+Cada operación pide estas columnas (se ignoran las demás):
+
+    crear        username, full_name, role, password
+    rol          username, role
+    desbloquear  username
+
+El archivo se valida completo antes de tocar la base de datos y se aplica en
+una sola transacción: si una fila falla no se aplica ninguna.
+"""
+import pandas as pd
+
+import auth
+import database
+
+ROLES = ("operador", "admin")
+LONGITUD_MINIMA_PASSWORD = 8
+
+OPERACIONES = {
+    "crear": ("username", "full_name", "role", "password"),
+    "rol": ("username", "role"),
+    "desbloquear": ("username",),
+}
+
+
+def leer_csv(archivo, operacion):
+    """Columnas de `operacion` del CSV, como texto sin espacios sobrantes.
+
+    Lanza ValueError si falta alguna columna.
+    """
+    df = pd.read_csv(archivo, dtype=str, keep_default_na=False, encoding="utf-8-sig")
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    columnas = list(OPERACIONES[operacion])
+    faltan = [c for c in columnas if c not in df.columns]
+    if faltan:
+        raise ValueError(f"Faltan columnas en el CSV: {', '.join(faltan)}")
+    return df[columnas].apply(lambda columna: columna.str.strip())
+
+
+def validar(df):
+    """Errores del archivo ("Fila N: ..."), o lista vacía si se puede aplicar."""
+    errores = []
+    # La fila 1 del archivo es la cabecera
+    for numero, fila in enumerate(df.to_dict("records"), start=2):
+        if not fila["username"]:
+            errores.append(f"Fila {numero}: falta el username.")
+        if "full_name" in fila and not fila["full_name"]:
+            errores.append(f"Fila {numero}: falta el nombre completo.")
+        if "role" in fila and fila["role"] not in ROLES:
+            errores.append(f"Fila {numero}: rol '{fila['role']}' no válido (use {' o '.join(ROLES)}).")
+        if "password" in fila and len(fila["password"]) < LONGITUD_MINIMA_PASSWORD:
+            errores.append(f"Fila {numero}: la contraseña debe tener al menos {LONGITUD_MINIMA_PASSWORD} caracteres.")
+    repetidos = sorted(df.loc[df["username"].duplicated() & (df["username"] != ""), "username"].unique())
+    if repetidos:
+        errores.append(f"Usernames repetidos en el archivo: {', '.join(repetidos)}")
+    return errores
+
+
+def aplicar(df, operacion):
+    """Aplica `operacion` a todas las filas de `df` (ya validado). Devuelve (ok, mensaje)."""
+    if df.empty:
+        return False, "El archivo no tiene filas."
+    if operacion == "crear":
+        # Los hashes se calculan antes de abrir la transacción
+        hashes = auth.hash_passwords(df["password"])
+        return database.create_users_bulk(list(zip(df["username"], hashes, df["role"], df["full_name"])))
+    if operacion == "rol":
+        return database.update_user_roles_bulk(list(zip(df["username"], df["role"])))
+    return database.unlock_users_bulk(list(df["username"]))